@@ -0,0 +1,43 @@
+'''
+生产环境多进程部署（gunicorn + uvicorn worker）
+    gunicorn src.api.main:app -c gunicorn.conf.py
+- preload_app：应用在主进程导入一次，when_ready 里预热（导入重量级模块、同步知识库并导出向量快照），
+  再 fork 出 worker，模块与词典内存以写时复制方式共享
+- 各 worker 的向量检索查内存映射的只读快照（RAG_INDEX_SNAPSHOT=1），N 个 worker 共享同一份物理内存
+- 会话记忆默认写入外部 SQLite（SESSION_DB_PATH），同一会话的请求落到任意 worker 都能取到完整历史
+- 向量库只连 Chroma 服务（CHROMA_MODE=http）：多个 worker 不能同时故障切换到同一个本地 PersistentClient 目录，
+  显式设置为 auto/local 时只允许单 worker
+'''
+
+import multiprocessing
+import os
+
+# 多进程共享的状态默认放到进程外；显式设置的环境变量优先
+os.environ.setdefault("RAG_INDEX_SNAPSHOT", "1")
+os.environ.setdefault("SESSION_DB_PATH", "./chroma_db/sessions.sqlite3")
+os.environ.setdefault("SESSION_SHARED", "1")
+os.environ.setdefault("CHROMA_MODE", "http")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count(), 8))))
+if workers > 1 and os.environ["CHROMA_MODE"] != "http":
+    raise RuntimeError(
+        f"CHROMA_MODE={os.environ['CHROMA_MODE']} 会让多个 worker 共用本地 PersistentClient 目录，"
+        "多 worker 部署请使用 CHROMA_MODE=http，或设置 WEB_CONCURRENCY=1"
+    )
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+# 首次启动可能需要完整入库，预热期间不算 worker 超时
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+errorlog = "-"
+
+
+def when_ready(server):
+    """主进程已导入应用、监听端口，fork worker 之前预热"""
+    from src.api.main import warm_up
+
+    server.log.info("预热：导入模块、同步知识库、导出向量快照 ...")
+    warm_up()
@@ -1,28 +1,96 @@
 from langchain_chroma import Chroma
 from langchain_community.embeddings import ZhipuAIEmbeddings
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 import os
-import re  # 导入正则表达式用于清洗
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, List, Optional
 
-from langchain_classic.retrievers import MultiQueryRetriever  # 问题改写（需要外部传入LLM）
-from langchain_community.document_loaders import PyPDFLoader, TextLoader,UnstructuredWordDocumentLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownTextSplitter,MarkdownHeaderTextSplitter
+import numpy as np
+
+
+from src.Agent.query_rewrite import CachedMultiQueryRetriever, RewriteCache  # 问题改写（需要外部传入LLM）
 
 
 import chromadb
 from chromadb.config import Settings
 
+from src.Agent.embedding_cache import CachedEmbeddings
+from src.Agent.kb_manifest import KB_SUPPORTED_EXTS, InterProcessLock, KnowledgeBaseManifest, make_chunk_id
+from src.Agent.doc_pipeline import clean_document_text, iter_split_documents
+from src.Agent.ingest_writer import EmbeddingWriter
+from src.Agent.query_cache import QueryResultCache
+from src.Agent.vector_index import mmr_select, normalize_rows
+from src.Agent.bm25_index import BM25Index, reciprocal_rank_fusion
+from src.Agent.facet_index import FacetIndex, annotate_documents
+from src.Agent.reranker import get_reranker
+from src.Agent.context_packer import ContextPacker
+from src.Agent.chroma_connection import ChromaConnection
+from src.Agent.index_snapshot import export_snapshot, load_snapshot, pointer_stamp, snapshot_version
+
+# 检索模式：
+# similarity —— 相似度 top-k
+# mmr        —— 不带 llm 时走 Chroma 检索器的 MMR
+# fast_mmr   —— 一次 collection.query 取回 fetch_k 个候选及其向量，本地 NumPy 向量化 MMR，fetch_k 可以放大
+# hybrid     —— 向量相似度 top fetch_k 与 BM25 top fetch_k 做倒数排名融合（RRF）
+SEARCH_TYPES = ("mmr", "similarity", "fast_mmr", "hybrid")
+CANDIDATE_SEARCH_TYPES = ("mmr", "fast_mmr", "hybrid")  # 需要先取 fetch_k 个候选的模式
+
+
+class EngineRetriever(BaseRetriever):
+    """直接走引擎的“单次查询 + 本地重排”，也可作为 MultiQueryRetriever 的底层检索器"""
+
+    engine: Any
+    k: int = 6
+    search_type: str = "fast_mmr"
+    metadata_filter: Optional[dict] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs, _ = self.engine._search(
+            self.engine.embeddings.embed_query(query), self.k, self.search_type, query, self.metadata_filter
+        )
+        return docs
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        query_embedding = await self.engine.embeddings.aembed_query(query)
+        docs, _ = await self.engine._asearch(query_embedding, self.k, self.search_type, query, self.metadata_filter)
+        return docs
+
+
 class RAGEngineLCEL:
     def __init__(self, persist_directory="./chroma_db",docs_path="./knowledge_base"): #向量库路径， 知识库文件夹路径
 
-         # 使用 HTTP 客户端连接 chromadb 容器
-        self.chroma_client = chromadb.HttpClient(
-            host="chromadb",           # 对应 docker-compose 中的服务名
-            port=8000                   # chromadb 容器内的端口
+        # 异步路径上无法原生 await 的同步调用放进专用线程池，不受默认线程池大小限制
+        io_workers = int(os.getenv("RAG_IO_WORKERS", "32"))
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=io_workers,
+            thread_name_prefix="rag-io",
         )
-        # self.persist_directory = persist_directory  # 路径
+        # 连接 chromadb 容器：长连接池（与 IO 线程数一致）+ 超时 + 健康探测，服务不可用时改用本地 PersistentClient
+        self.chroma = ChromaConnection.from_env(persist_directory, pool_size=io_workers)
+        self.chroma_client = self.chroma.connect()
+        self.chroma_host = self.chroma.host
+        self.chroma_port = self.chroma.port
+        # 异步检索用的 AsyncHttpClient 集合，首次异步查询时创建（本地模式下不可用）
+        self._async_collection = None
+        self._async_collection_loop = None
+        self._async_client_failed = self.chroma.mode != "http"
+        # 向量数据在 chromadb 容器里，本地目录只存放嵌入缓存等辅助数据
+        self.persist_directory = persist_directory  # 路径
         self.docs_path = docs_path
 
-        self.embeddings = ZhipuAIEmbeddings(model="embedding-3", api_key=os.getenv("ZHIPUAI_API_KEY"))
+        # 嵌入结果按 (模型名, 文本哈希) 缓存到磁盘，重建知识库、重复上传时不再重复调用接口
+        self.embeddings = CachedEmbeddings(
+            ZhipuAIEmbeddings(model="embedding-3", api_key=os.getenv("ZHIPUAI_API_KEY")),
+            cache_path=os.path.join(persist_directory, "embedding_cache.sqlite3"),
+            executor=self.io_executor,
+        )
 
         #测试代码， 事先就已经创建好了知识库
         #self.vectorstore = Chroma(persist_directory=persist_directory, embedding_function=self.embeddings)
@@ -34,11 +102,59 @@ class RAGEngineLCEL:
         #     "knowledge_base/rules.md"
         # ]
         #不再用硬编码， 采用扫描文件夹的方式添加文件
+        # 清单记录每个文件的 mtime/大小/哈希/块id，用于增量同步
+        self.manifest = KnowledgeBaseManifest(os.path.join(persist_directory, "kb_manifest.json"))
+        # 运行时入库任务与启动同步可能并发更新清单
+        self._manifest_lock = threading.RLock()
+        # 多个 worker 共用同一个持久化目录：同步、入库、快照导出同一时刻只允许一个进程执行
+        self._kb_lock = InterProcessLock(os.path.join(persist_directory, "kb.lock"))
         self.files_list = self._scan_knowledge_base()
 
 
+        # 检索结果两级缓存（精确 + 语义），绑定知识库版本
+        self.query_cache = QueryResultCache(
+            max_entries=int(os.getenv("RAG_QUERY_CACHE_SIZE", "512")),
+            ttl_seconds=float(os.getenv("RAG_QUERY_CACHE_TTL", "600")),
+            similarity_threshold=float(os.getenv("RAG_SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        )
+        self.kb_version = None
+
+        # 检索器对象只构建一次；MultiQuery 的改写结果按问题做 LRU 缓存
+        self._base_retrievers = {}
+        self._multi_query_retrievers = {}
+        self.rewrite_cache = RewriteCache(max_entries=int(os.getenv("RAG_REWRITE_CACHE_SIZE", "1024")))
+        # 改写预算：普通检索最高余弦相似度达到该阈值时跳过 LLM 改写（设为大于 1 即总是改写）
+        self.rewrite_skip_threshold = float(os.getenv("RAG_REWRITE_SKIP_THRESHOLD", "0.75"))
+        # MMR 参数：RAG_MMR_FETCH_K 为 0 时按 max(20, k*3) 取候选
+        self.mmr_fetch_k = int(os.getenv("RAG_MMR_FETCH_K", "0"))
+        self.mmr_lambda = float(os.getenv("RAG_MMR_LAMBDA", "0.5"))
+
+        # BM25 倒排索引与向量库放在同一目录，随知识库同步增量更新
+        self.bm25 = BM25Index(os.path.join(persist_directory, "bm25_index.sqlite3"))
+        self.rrf_k = int(os.getenv("RAG_RRF_K", "60"))
+        # 分面索引（type / category / source / rule_type -> 块id），按 metadata 过滤时直接取子集
+        self.facets = FacetIndex()
+        # 交叉编码器重排服务：启动时加载一次，各请求共享（微批 + 分数缓存 + 延迟预算）
+        self.reranker = get_reranker() if os.getenv("RAG_RERANK", "1") == "1" else None
+        # 重排时先取 k * 倍数 个候选
+        self.rerank_candidates_mult = int(os.getenv("RAG_RERANK_CANDIDATES_MULT", "3"))
+        # 上下文打包：去重、合并重叠块、按 token 预算裁剪
+        self.context_packer = ContextPacker(
+            max_tokens=int(os.getenv("RAG_CONTEXT_TOKENS", "2000")),
+            near_dup_threshold=float(os.getenv("RAG_NEAR_DUP_THRESHOLD", "0.85")),
+        )
+
+        # 多进程部署：向量检索改查内存映射的只读快照，各 worker 共享同一份物理内存
+        self.snapshot_enabled = os.getenv("RAG_INDEX_SNAPSHOT", "0") == "1"
+        self.snapshot_dir = os.path.join(persist_directory, "index_snapshot")
+        self.snapshot = None
+        self._snapshot_stamp = None  # 上次检查时 current.json 的 (mtime, inode)
+        self._version_lock = threading.Lock()
+
         # 检查数据库是否存在（用Chroma的get_collection检查）
         self.vectorstore = self._load_or_create_vectorstore()
+        self._refresh_snapshot()
+        self.chroma.start_health_probe(on_failover=self._on_chroma_failover)
         # '''{“context”: self.retriever, “question”: RunnablePassthrough()}：。它接收一个输入（即用户问题），然后并行执行两个操作：
         # retriever：接收问题，检索出相关文档，结果赋值给 context。
         # RunnablePassthrough()：简单地让原问题通过，赋值给 question。
@@ -48,28 +164,306 @@ class RAGEngineLCEL:
         # | StrOutputParser()：将大模型的复杂响应对象解析为纯文本字符串
         # '''
     
-    def retrieve(self, question: str, k: int = 6, *, search_type: str = "mmr", llm=None):
-        """仅检索：支持 MMR；可选用 MultiQuery 做问题改写（需要外部传入 llm）。"""
-        if search_type not in ("mmr", "similarity"):
-            search_type = "mmr"
+    def _fetch_k(self, k: int) -> int:
+        return max(self.mmr_fetch_k or max(20, k * 3), k)
+
+    def _get_base_retriever(self, k: int, search_type: str, metadata_filter: Optional[dict] = None):
+        """按 (k, search_type, 过滤签名) 缓存向量检索器，避免每次调用都重新构建"""
+        key = (k, search_type, FacetIndex.signature(metadata_filter))
+        if key not in self._base_retrievers:
+            # 一律走引擎检索（_search / _asearch）：同步与异步同一套候选与本地 mmr_select，结果一致；
+            # 启用快照时问题改写的子查询也不会绕过快照去查 Chroma
+            self._base_retrievers[key] = EngineRetriever(
+                engine=self, k=k, search_type=search_type, metadata_filter=metadata_filter or None
+            )
+        return self._base_retrievers[key]
+
+    def _get_multi_query_retriever(self, llm, k: int, search_type: str, metadata_filter: Optional[dict] = None):
+        """MultiQueryRetriever 每个 (llm, k, search_type, 过滤签名) 只构建一次，改写结果走 LRU 缓存"""
+        key = (id(llm), k, search_type, FacetIndex.signature(metadata_filter))
+        if key not in self._multi_query_retrievers:
+            retriever = CachedMultiQueryRetriever.from_llm(
+                retriever=self._get_base_retriever(k, search_type, metadata_filter), llm=llm
+            )
+            retriever.rewrite_cache = self.rewrite_cache
+            self._multi_query_retrievers[key] = retriever
+        return self._multi_query_retrievers[key]
 
-        retriever = self.vectorstore.as_retriever(
-            search_type=search_type,
-            search_kwargs={"k": k, "fetch_k": max(20, k * 3), "lambda_mult": 0.5} if search_type == "mmr" else {"k": k},
+    def _select_from_result(self, query_embedding, result, k: int, search_type: str):
+        """从一次 collection.query 的候选中选出最终文档，并返回最高余弦相似度（用于改写预算判断）"""
+        docs, embeddings = self._docs_from_query_result(result)
+        if not docs:
+            return [], 0.0
+        query_vec = normalize_rows(query_embedding)[0]
+        matrix = normalize_rows(embeddings)
+        relevance = matrix @ query_vec
+        top_score = float(np.max(relevance))
+        if search_type in ("similarity", "hybrid"):
+            return docs[:k], top_score
+        # MMR：在 fetch_k 个候选上本地做向量化多样性重排
+        indices = mmr_select(query_vec, matrix, k, self.mmr_lambda)
+        return [docs[i] for i in indices], top_score
+
+    def _n_results(self, k: int, search_type: str) -> int:
+        return self._fetch_k(k) if search_type in CANDIDATE_SEARCH_TYPES else k
+
+    def _plan_query(self, k: int, search_type: str, metadata_filter: Optional[dict]):
+        """返回 (候选数, 过滤后的块id列表或 None)；过滤后没有任何块时返回 None"""
+        n_results = self._n_results(k, search_type)
+        ids = self.facets.ids_for(metadata_filter)
+        if ids is None:
+            return n_results, None
+        if not ids:
+            return None
+        return min(n_results, len(ids)), ids
+
+    def _search(self, query_embedding, k: int, search_type: str, question: str = "",
+                metadata_filter: Optional[dict] = None):
+        """一次 collection.query 取回候选及其向量，再本地选出 k 个，返回 (文档列表, 最高余弦相似度)"""
+        plan = self._plan_query(k, search_type, metadata_filter)
+        if plan is None:
+            return [], 0.0
+        n_results, ids = plan
+        # 有过滤条件时只在分面子集内检索
+        result = self._query_vectors(query_embedding, n_results, ids)
+        # hybrid 需要保留全部向量候选参与融合，其余模式直接选出 k 个
+        docs, top_score = self._select_from_result(
+            query_embedding, result, n_results if search_type == "hybrid" else k, search_type
+        )
+        if search_type == "hybrid":
+            lexical = self.bm25.search_documents(question, n_results, allowed_ids=ids)
+            return self._fuse_hybrid(docs, lexical, k), top_score
+        return docs, top_score
+
+    async def _asearch(self, query_embedding, k: int, search_type: str, question: str = "",
+                       metadata_filter: Optional[dict] = None):
+        plan = self._plan_query(k, search_type, metadata_filter)
+        if plan is None:
+            return [], 0.0
+        n_results, ids = plan
+        if self._active_snapshot() is not None:
+            # 快照检索是本地矩阵运算 + SQLite 读取，放进 IO 线程池
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self.io_executor, self._query_vectors, query_embedding, n_results, ids
+            )
+        else:
+            query_kwargs = {"ids": ids} if ids is not None else {}
+            result = await self._aquery_collection(
+                query_embedding, n_results, ["documents", "metadatas", "embeddings"], **query_kwargs
+            )
+        docs, top_score = self._select_from_result(
+            query_embedding, result, n_results if search_type == "hybrid" else k, search_type
+        )
+        if search_type == "hybrid":
+            loop = asyncio.get_running_loop()
+            lexical = await loop.run_in_executor(
+                self.io_executor, functools.partial(self.bm25.search_documents, question, n_results, allowed_ids=ids)
+            )
+            return self._fuse_hybrid(docs, lexical, k), top_score
+        return docs, top_score
+
+    def _active_snapshot(self):
+        """与当前知识库版本一致的快照；运行时入库后版本变化，重新导出前先回退到向量库"""
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == self.kb_version:
+            return snapshot
+        return None
+
+    def _query_vectors(self, query_embedding, n_results: int, ids=None):
+        """向量检索，返回与 collection.query 相同结构的结果；有快照时查快照，否则查 Chroma 集合"""
+        snapshot = self._active_snapshot()
+        if snapshot is None:
+            query_kwargs = {"ids": ids} if ids is not None else {}
+            return self.vectorstore._collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                include=["documents", "metadatas", "embeddings"],
+                **query_kwargs,
+            )
+        hit_ids, vectors, _ = snapshot.search(query_embedding, n_results, ids)
+        # 文本与 metadata 从 BM25 索引取回（与向量库同一套块id）
+        by_id = {doc.id: doc for doc in self.bm25.get_documents(hit_ids)}
+        keep = [i for i, doc_id in enumerate(hit_ids) if doc_id in by_id]
+        return {
+            "ids": [[hit_ids[i] for i in keep]],
+            "documents": [[by_id[hit_ids[i]].page_content for i in keep]],
+            "metadatas": [[by_id[hit_ids[i]].metadata for i in keep]],
+            "embeddings": [vectors[keep]],
+        }
+
+    def _fuse_hybrid(self, vector_docs, lexical_docs, k: int):
+        """向量结果与 BM25 结果做 RRF 融合；电话、公司名这类精确词靠 BM25 一路召回"""
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], k, rrf_k=self.rrf_k)
+
+    def retrieve(self, question: str, k: int = 6, *, search_type: str = "mmr", llm=None,
+                 metadata_filter: Optional[dict] = None, rerank: bool = False):
+        """
+        仅检索：支持 similarity / mmr / fast_mmr / hybrid；可选用 MultiQuery 做问题改写（需要外部传入 llm）。
+        metadata_filter 形如 {"type": "rule"} 或 {"category": ["star_method", "general"]}，按分面子集检索。
+        rerank=True 时先取 k 的若干倍候选，再用交叉编码器重排取前 k 个（重排不可用时忽略）。
+        """
+        if search_type not in SEARCH_TYPES:
+            search_type = "mmr"
+        self._sync_shared_version()
+        if rerank and self.reranker is not None:
+            candidates = self.retrieve(question, k * self.rerank_candidates_mult, search_type=search_type,
+                                       llm=llm, metadata_filter=metadata_filter)
+            return self.reranker.rerank(question, candidates, k)
+
+        if llm is None:
+            return self._get_base_retriever(k, search_type, metadata_filter).invoke(question)
+
+        # 改写预算：先做一次普通检索，最相关的块已经足够相似就不再花一次 LLM 调用改写问题
+        docs, top_score = self._search(self.embeddings.embed_query(question), k, search_type, question, metadata_filter)
+        if docs and top_score >= self.rewrite_skip_threshold:
+            print(f"⏭️ 普通检索最高相似度 {top_score:.3f}，跳过问题改写")
+            return docs
+
+        # 问题改写（MultiQueryRetriever 需要一个 llm，这里不在 RAGEngine 内部创建）
+        return self._get_multi_query_retriever(llm, k, search_type, metadata_filter).invoke(question)
+
+    async def aretrieve(self, question: str, k: int = 6, *, search_type: str = "mmr", llm=None,
+                        metadata_filter: Optional[dict] = None, rerank: bool = False):
+        """retrieve 的原生异步版本：await 查询向量的嵌入与 Chroma 查询，MMR 在本地计算。"""
+        if search_type not in SEARCH_TYPES:
+            search_type = "mmr"
+        await self._async_shared_version()
+        if rerank and self.reranker is not None:
+            candidates = await self.aretrieve(question, k * self.rerank_candidates_mult, search_type=search_type,
+                                              llm=llm, metadata_filter=metadata_filter)
+            return await self.reranker.arerank(question, candidates, k)
+
+        # 一次取回候选及其向量，相似度检索取 k 个，MMR 取 fetch_k 个再本地重排
+        query_embedding = await self.embeddings.aembed_query(question)
+        docs, top_score = await self._asearch(query_embedding, k, search_type, question, metadata_filter)
+
+        if llm is None:
+            return docs
+        if docs and top_score >= self.rewrite_skip_threshold:
+            print(f"⏭️ 普通检索最高相似度 {top_score:.3f}，跳过问题改写")
+            return docs
+        # 问题改写需要 MultiQueryRetriever，走它的异步接口
+        return await self._get_multi_query_retriever(llm, k, search_type, metadata_filter).ainvoke(question)
+
+    async def _get_async_collection(self):
+        """懒创建 AsyncHttpClient 集合；客户端绑定事件循环，换了事件循环需要重建"""
+        if self._async_client_failed:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._async_collection is None or self._async_collection_loop is not loop:
+            try:
+                client = await chromadb.AsyncHttpClient(
+                    host=self.chroma_host, port=self.chroma_port, settings=self.chroma.http_settings()
+                )
+                self._async_collection = await client.get_collection("resume_rules")
+                self._async_collection_loop = loop
+            except Exception as e:
+                print(f"⚠️ 异步 Chroma 客户端不可用，改用线程池执行同步查询：{e}")
+                self._async_client_failed = True
+                return None
+        return self._async_collection
+
+    async def _aquery_collection(self, query_embedding, n_results: int, include, **query_kwargs):
+        collection = await self._get_async_collection()
+        if collection is not None:
+            return await collection.query(
+                query_embeddings=[query_embedding], n_results=n_results, include=include, **query_kwargs
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.io_executor,
+            functools.partial(
+                self.vectorstore._collection.query,
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                include=include,
+                **query_kwargs,
+            ),
         )
 
-        # 可选：问题改写（MultiQueryRetriever 需要一个 llm，这里不在 RAGEngine 内部创建）
-        if llm is not None:
-            retriever = MultiQueryRetriever.from_llm(retriever=retriever, llm=llm)
-
-        return retriever.invoke(question)
-
-    def get_context(self, question: str, k: int = 6, *, search_type: str = "mmr", llm=None) -> str:
-        """仅检索：把相关文档块拼成上下文，供 Agent 生成最终答案。"""
-        docs = self.retrieve(question, k=k, search_type=search_type, llm=llm)
+    @staticmethod
+    def _docs_from_query_result(result):
+        """把 collection.query 的结果转成 (Document 列表, 向量列表)"""
+        texts = (result.get("documents") or [[]])[0]
+        metadatas = (result.get("metadatas") or [[]])[0] or [None] * len(texts)
+        ids = (result.get("ids") or [[]])[0] or [None] * len(texts)
+        embeddings = result.get("embeddings")
+        embeddings = embeddings[0] if embeddings is not None and len(embeddings) else None
+        docs = [
+            Document(id=doc_id, page_content=text, metadata=metadata or {})
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+            if text
+        ]
+        if embeddings is None:
+            return docs, None
+        embeddings = [emb for text, emb in zip(texts, embeddings) if text]
+        return docs, embeddings
+
+    def get_context(self, question: str, k: int = 6, *, search_type: str = "mmr", llm=None,
+                    metadata_filter: Optional[dict] = None, rerank: bool = False) -> str:
+        """仅检索：把相关文档块拼成上下文，供 Agent 生成最终答案。先查精确缓存，再查语义缓存。"""
+        self._sync_shared_version()
+        rerank = rerank and self.reranker is not None
+        params = (k, search_type, llm is not None, FacetIndex.signature(metadata_filter), rerank)
+        cached = self.query_cache.get_exact(question, params, self.kb_version)
+        if cached is not None:
+            return cached
+        # 问题向量本身也走嵌入缓存，后面 retrieve 再次嵌入时直接命中
+        query_embedding = self.embeddings.embed_query(question)
+        cached = self.query_cache.get_semantic(query_embedding, params, self.kb_version)
+        if cached is not None:
+            return cached
+
+        docs = self.retrieve(question, k=k, search_type=search_type, llm=llm, metadata_filter=metadata_filter,
+                             rerank=rerank)
+        context = self._format_context(docs)
+        self.query_cache.put(question, query_embedding, params, self.kb_version, context)
+        return context
+
+    async def aget_context(self, question: str, k: int = 6, *, search_type: str = "mmr", llm=None,
+                           metadata_filter: Optional[dict] = None, rerank: bool = False) -> str:
+        """get_context 的原生异步版本。"""
+        await self._async_shared_version()
+        rerank = rerank and self.reranker is not None
+        params = (k, search_type, llm is not None, FacetIndex.signature(metadata_filter), rerank)
+        cached = self.query_cache.get_exact(question, params, self.kb_version)
+        if cached is not None:
+            return cached
+        query_embedding = await self.embeddings.aembed_query(question)
+        cached = self.query_cache.get_semantic(query_embedding, params, self.kb_version)
+        if cached is not None:
+            return cached
+
+        docs = await self.aretrieve(question, k=k, search_type=search_type, llm=llm,
+                                    metadata_filter=metadata_filter, rerank=rerank)
+        context = self._format_context(docs)
+        self.query_cache.put(question, query_embedding, params, self.kb_version, context)
+        return context
+
+    def cache_stats(self) -> dict:
+        """检索缓存与嵌入缓存的命中率统计"""
+        return {
+            "kb_version": self.kb_version,
+            "query_cache": self.query_cache.stats(),
+            "embedding_cache": self.embeddings.stats(),
+            "rewrite_cache": self.rewrite_cache.stats(),
+            "reranker": self.reranker.stats() if self.reranker is not None else None,
+            "chroma": self.chroma.stats(),
+            "snapshot": {
+                "version": self.snapshot.version,
+                "chunks": len(self.snapshot),
+                "memory_mapped": self.snapshot.memory_mapped,
+                "active": self._active_snapshot() is not None,
+            } if self.snapshot is not None else None,
+        }
+
+    def _format_context(self, docs) -> str:
+        """把文档块去重、合并、按 token 预算裁剪后拼成带说明的上下文字符串"""
         if not docs:
             return "（知识库未检索到相关规则片段）"
-        context = "\n\n".join([doc.page_content for doc in docs if getattr(doc, "page_content", None)])
+        packed = self.context_packer.pack([doc for doc in docs if getattr(doc, "page_content", None)])
+        context = "\n\n".join(doc.page_content for doc in packed)
         if not context.strip():
             return "（知识库检索到了结果，但内容为空）"
         return f"（以下为知识库检索到的规则片段，请据此回答/润色）\n{context}"
@@ -88,7 +482,7 @@ class RAGEngineLCEL:
             #     return {"context": [doc for doc, _ in docs_with_score], "question": inputs["question"]}
     def _scan_knowledge_base(self):
         """扫描knowledge_base文件夹，获取所有支持的文件"""
-        supported_exts = ['.pdf', '.md', '.txt',]
+        supported_exts = KB_SUPPORTED_EXTS
         files = []
         if not os.path.exists(self.docs_path):
             print(f"⚠️ 知识库路径 {self.docs_path} 不存在，将创建空目录。")
@@ -103,170 +497,314 @@ class RAGEngineLCEL:
         return files
 
     def _clean_document_text(self, text):
-        """清洗文档文本的辅助函数"""
-        # 1. 去除多余的空行（将连续两个以上的换行替换为两个换行）
-        text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
-        # 2. 去除行首行尾的空白
-        lines = [line.strip() for line in text.split('\n')]
-        # 3. 过滤掉空行后重新组合（根据需求选择是否保留空行分隔）
-        cleaned_lines = [line for line in lines if line]  # 完全去掉空行
-        # 或者保留一个空行作为段落分隔：cleaned_text = '\n\n'.join(cleaned_lines)
-        cleaned_text = '\n'.join(cleaned_lines)  # 简单连接
-        return cleaned_text
-
-
-    def _load_and_split_documents(self):
-        """加载所有文档，并根据格式进行差异化分割和清洗"""
-        all_docs = []  # 加载后的原始文档
-        for file_path in self.files_list:
-            print(f"正在处理: {file_path}")
-            try:
-                if file_path.endswith('.pdf'):
-                    loader = PyPDFLoader(file_path)
-                    docs = loader.load()
-                elif file_path.endswith('.md'):
-                # 对于Markdown文件，先用UnstructuredMarkdownLoader加载
-                # loader = UnstructuredMarkdownLoader(file_path)
-                # 使用 TextLoader 加载 Markdown 文件（无需 unstructured） 后续升级环境 安装Unstructured依赖包
-                    loader = TextLoader(file_path, encoding='utf-8')
-                    docs = loader.load()
-                    
-                elif file_path.endswith('.txt'):
-                    loader = TextLoader(file_path, encoding='utf-8')
-                    docs = loader.load()
-                #暂时不支持docx文件， 等安装Unstructured依赖包
-                elif file_path.endswith('.docx'):
-                    loader = UnstructuredWordDocumentLoader(file_path)
-                    docs = loader.load()
-                else:
-                    print(f"⚠️ 跳过不支持的文件: {file_path}")
-                    continue
-                
-                # **数据清洗步骤**：对每个文档的文本内容进行清洗
-                for doc in docs:
-                    original_text = doc.page_content
-                    cleaned_text = self._clean_document_text(original_text)
-                    doc.page_content = cleaned_text
-                
-                all_docs.extend(docs)
-                print(f"  加载了 {len(docs)} 个文档片段")
-            except Exception as e:
-                print(f"❌ 处理文件 {file_path} 时出错: {e}，跳过此文件")
-        
-        # **差异化分割**
-        all_splits = []
-        
-        # 按来源文件类型分组处理
-        pdf_docs = [doc for doc in all_docs if doc.metadata.get('source', '').endswith('.pdf')]
-        md_docs = [doc for doc in all_docs if doc.metadata.get('source', '').endswith('.md')]
-        txt_docs = [doc for doc in all_docs if doc.metadata.get('source', '').endswith('.txt')]
-        docx_docs = [doc for doc in all_docs if doc.metadata.get('source', '').endswith('.docx')]
-
-        # 1. 处理 PDF 和 TXT（使用递归字符分割器，按自然边界）
-        if pdf_docs or txt_docs:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=600,
-                chunk_overlap=60,
-                separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""],
-                keep_separator=False
-            )
-            if pdf_docs:
-                pdf_splits = text_splitter.split_documents(pdf_docs)
-                all_splits.extend(pdf_splits)
-                print(f"📄 PDF 分割完成，得到 {len(pdf_splits)} 个块")
-            if txt_docs:
-                txt_splits = text_splitter.split_documents(txt_docs)
-                all_splits.extend(txt_splits)
-                print(f"📄 TXT 分割完成，得到 {len(txt_splits)} 个块")
-
-        # 2. 处理 Markdown（先按标题分割，再对长块二次分割）
-        if md_docs:
-            headers_to_split_on = [("#", "H1"), ("##", "H2"), ("###", "H3")]
-            markdown_splitter = MarkdownHeaderTextSplitter(
-                headers_to_split_on=headers_to_split_on,
-                strip_headers=False
-            )
-            md_splits_by_header = []
-            for doc in md_docs:
-                # 注意：MarkdownHeaderTextSplitter 需要文本，返回的是 Document 列表
-                splits = markdown_splitter.split_text(doc.page_content)
-                for split in splits:
-                    # 保留原始文件的元数据
-                    split.metadata.update(doc.metadata)
-                    md_splits_by_header.append(split)
-            
-            # 对过长的块进行二次分割
-            final_md_splits = []
-            md_text_splitter = MarkdownTextSplitter(chunk_size=500, chunk_overlap=50)
-            for doc in md_splits_by_header:
-                if len(doc.page_content) > 600:
-                    sub_splits = md_text_splitter.split_documents([doc])
-                    final_md_splits.extend(sub_splits)
-                else:
-                    final_md_splits.append(doc)
-            all_splits.extend(final_md_splits)
-            print(f"📑 Markdown 分割完成，得到 {len(final_md_splits)} 个块")
-
-        # 3. 处理 DOCX（先用简单分割，后续可优化为按样式分割）
-        if docx_docs:
-            docx_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=600,
-                chunk_overlap=100,
-                separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
-            )
-            docx_splits = docx_splitter.split_documents(docx_docs)
-            all_splits.extend(docx_splits)
-            print(f"📄 DOCX 分割完成，得到 {len(docx_splits)} 个块")
+        """清洗文档文本的辅助函数（实现见 doc_pipeline，子进程里也要用）"""
+        return clean_document_text(text)
 
+    def _iter_split_documents(self, files=None):
+        """并行加载、清洗、分割文档，按文件完成顺序流式产出 (文件路径, 文档块列表, 错误信息)"""
+        files = self.files_list if files is None else files
+        print(f"正在处理 {len(files)} 个文件（进程池并行）...")
+        yield from iter_split_documents(files)
+
+    def _load_and_split_documents(self, files=None):
+        """加载文档（默认全部），并根据格式进行差异化分割和清洗"""
+        all_splits = []
+        for _, splits, _ in self._iter_split_documents(files):
+            all_splits.extend(splits)
         print(f"✅ 总计生成 {len(all_splits)} 个文档块")
         return all_splits
 
 
 
     def _load_or_create_vectorstore(self):
-        """加载或创建向量库：如果存在，直接加载；否则，加载文件并创建"""
-        # 检查collection是否存在
-        try:
-            vectorstore = Chroma(
+        """加载向量库，并按清单增量同步：只处理新增/修改/删除的文件"""
+        vectorstore = Chroma(
             client=self.chroma_client,
             collection_name="resume_rules",
             embedding_function=self.embeddings
         )
-            # vectorstore = Chroma(persist_directory=self.persist_directory, embedding_function=self.embeddings)
-            if vectorstore._collection.count() > 0:
-                print("✅ 加载现有向量库（已存在）。")
-                return vectorstore
-        except Exception as e:
-            print(f"⚠️ 向量库不存在或错误：{e}，将重新创建。")
-
-        print("🔄 创建新向量库...")
+        # vectorstore = Chroma(persist_directory=self.persist_directory, embedding_function=self.embeddings)
         if not self.files_list:
-            print("⚠️ 知识库文件夹为空，将创建空的向量库。")
-            # 创建空库并持久化
-            vectorstore = Chroma.from_documents(
-                documents=[],
-                embedding=self.embeddings,
-                # persist_directory=self.persist_directory
-                client=self.chroma_client,
-                collection_name="resume_rules",
-            )
-            
-            return vectorstore
-
-        # 加载并分割文档
-        all_splits = self._load_and_split_documents()
+            print("⚠️ 知识库文件夹为空。")
+        with self._kb_write():
+            self._sync_knowledge_base(vectorstore)
+        return vectorstore
 
-        # 创建向量库
-        vectorstore = Chroma.from_documents(
-            documents=all_splits,
-            embedding=self.embeddings,
-            # persist_directory=self.persist_directory
-            client=self.chroma_client,
+    def _on_chroma_failover(self, client):
+        """
+        Chroma 服务不可用、已切换到本地库：先把检索切到本地库，再按清单补齐数据，清空检索器与结果缓存
+        整个过程持有知识库写锁，不会和运行时入库（/kb）或其他进程的同步交错
+        """
+        print("⚠️ Chroma 服务不可用，切换到本地向量库并重新加载。")
+        vectorstore = Chroma(
+            client=client,
             collection_name="resume_rules",
+            embedding_function=self.embeddings
         )
-        
-        print("✅ 新向量库创建完成。")
-        return vectorstore
+        with self._kb_write():
+            # 先换掉指向已失效 HTTP 客户端的引用（同步检索、异步检索的线程池兜底都走 self.vectorstore）
+            self.chroma_client = client
+            self._async_client_failed = True
+            self._async_collection = None
+            self.vectorstore = vectorstore
+            self._base_retrievers.clear()
+            self._multi_query_retrievers.clear()
+            self.query_cache.invalidate()
+            self._sync_knowledge_base(vectorstore)
+        # 补齐期间的检索结果可能不完整，补齐后再清一次
+        self.query_cache.invalidate()
+
+    def _sync_knowledge_base(self, vectorstore):
+        """对比清单与磁盘文件，增量更新向量库"""
+        if not self.manifest.is_empty() and vectorstore._collection.count() == 0:
+            # 清单记录了已入库的文件，但集合是空的（新建的集合或切换到了本地库）：全部重新入库
+            # 嵌入向量有磁盘缓存，重新入库基本不调用接口
+            print("⚠️ 清单与向量库不一致（集合为空），全部重新入库。")
+            self.manifest.clear()
+        changed, removed = self.manifest.diff(self.files_list)
+        # 旧版本建库时没有清单：库里已有的块没有可追踪的id，按 source 清理后重新入库
+        legacy_store = self.manifest.is_empty() and vectorstore._collection.count() > 0
+
+        if not changed and not removed:
+            print("✅ 知识库无变化，加载现有向量库。")
+            self.manifest.save()  # 可能刷新了被 touch 过的文件时间戳
+            self.kb_version = self.manifest.version()
+            self._ensure_bm25_index(vectorstore)
+            self._rebuild_facets()
+            return
+
+        print(f"🔄 知识库增量同步：{len(changed)} 个文件需要更新，{len(removed)} 个文件已删除。")
+
+        # 1. 删除已移除文件的块
+        for path in removed:
+            old_ids = self.manifest.chunk_ids(path)
+            if old_ids:
+                vectorstore.delete(ids=old_ids)
+                self.bm25.delete(old_ids)
+            self.manifest.remove(path)
+            print(f"  🗑️ 已删除 {path} 的 {len(old_ids)} 个块")
+
+        # 2. 只重新分割变更的文件，分批、并发、限流写入；中断后重启会从检查点继续
+        self._ingest_files(vectorstore, changed, legacy_store=legacy_store)
+        self._ensure_bm25_index(vectorstore)
+        self._rebuild_facets()
+        print("✅ 知识库增量同步完成。")
+
+    def _ingest_files(self, vectorstore, files, *, legacy_store=False, use_checkpoint=True,
+                      on_file_done=None, should_cancel=None) -> int:
+        """
+        分割并写入指定文件（启动同步与运行时入库任务共用）：清单 + BM25 + 分面 + 嵌入写入器
+        每个文件分割完成就立即交给写入器，不等全部文件处理完；should_cancel() 为真时不再处理后续文件
+        """
+        total = len(files)
+
+        # 先删旧块再写新块，块id由路径+序号+内容决定
+        def prepared_files():
+            splits = self._iter_split_documents(files)
+            try:
+                while True:
+                    # 取下一个文件之前检查取消：取消后不再等待下一个文件加载、分割
+                    if should_cancel is not None and should_cancel():
+                        print("⏹️ 入库已取消，剩余文件不再处理")
+                        return
+                    item = next(splits, None)
+                    if item is None:
+                        return
+                    yield from prepare_file(*item)
+            finally:
+                splits.close()
+
+        def prepare_file(path, docs, error):
+            if error is not None:
+                # 加载失败（可能只是暂时性错误）：保留旧块，清单也不更新，下次同步会重试这个文件
+                print(f"⚠️ {path} 加载失败，保留已入库的旧块，下次同步重试")
+                return
+            with self._manifest_lock:
+                old_ids = self.manifest.chunk_ids(path)
+            if old_ids:
+                vectorstore.delete(ids=old_ids)
+                self.bm25.delete(old_ids)
+                self.facets.remove(old_ids)
+            elif legacy_store:
+                vectorstore._collection.delete(where={"source": path})
+                self.bm25.delete_source(path)
+            annotate_documents(docs)
+            ids = [make_chunk_id(path, j, doc.page_content) for j, doc in enumerate(docs)]
+            pending_docs[path] = docs
+            yield path, docs, ids
+
+        done_count = 0
+        pending_docs = {}  # 已交给写入器、向量还没全部写入的文件 -> 文档块
+
+        def file_done(path, ids):
+            # 文件的全部块写入成功后才写词法索引与分面、记入清单：
+            # 嵌入或写向量库失败时不会留下指向没有向量的块的 BM25 命中；清单定期落盘，中途退出时已完成的文件不必重做
+            nonlocal done_count
+            docs = pending_docs.pop(path, None)
+            if docs is not None:
+                self.bm25.add_documents(ids, docs)
+                self.facets.add(ids, [doc.metadata for doc in docs], [doc.page_content for doc in docs])
+            with self._manifest_lock:
+                self.manifest.update(path, ids)
+                done_count += 1
+                if done_count % 50 == 0:
+                    self.manifest.save()
+            print(f"  ✅ [{done_count}/{total}] {path}：写入 {len(ids)} 个块")
+            if on_file_done is not None:
+                on_file_done(path, ids)
+
+        writer = EmbeddingWriter.from_env(
+            vectorstore,
+            self.embeddings,
+            checkpoint_path=os.path.join(self.persist_directory, "ingest_checkpoint.jsonl") if use_checkpoint else None,
+        )
+        try:
+            return writer.write_files(prepared_files(), on_file_done=file_done)
+        finally:
+            with self._manifest_lock:
+                self.manifest.save()
+                # 知识库版本变化后，检索缓存里的旧结果自动失效
+                self.kb_version = self.manifest.version()
+            self.query_cache.invalidate()
+
+    def ingest_files(self, paths, on_file_done=None, should_cancel=None) -> int:
+        """
+        运行时入库（文件已放进知识库目录）：与启动同步走同一条 清单 + 写入器 路径，不需要重启服务
+        返回写入的块数
+        """
+        with self._kb_write():
+            written = self._ingest_files(self.vectorstore, list(paths), use_checkpoint=False,
+                                         on_file_done=on_file_done, should_cancel=should_cancel)
+            for path in paths:
+                if path not in self.files_list and os.path.exists(path):
+                    self.files_list.append(path)
+            self._refresh_snapshot()
+        return written
+
+    @contextmanager
+    def _kb_write(self):
+        """知识库写操作的跨进程写锁；最外层拿到锁后先读入其他进程写过的清单，在最新状态上增量更新"""
+        with self._kb_lock:
+            if self._kb_lock.depth == 1:
+                self._reload_manifest()
+            yield
+
+    def _reload_manifest(self):
+        with self._manifest_lock:
+            before = self.manifest.version()
+            self.manifest.reload()
+            changed = self.manifest.version() != before
+        if changed:
+            self._on_external_kb_change()
+
+    def _on_external_kb_change(self):
+        """其他进程更新了知识库：刷新版本号、文件列表、BM25 统计与分面，旧的检索缓存作废"""
+        with self._manifest_lock:
+            self.kb_version = self.manifest.version()
+            paths = list(self.manifest.entries)
+        known = {os.path.normpath(path) for path in self.files_list}
+        self.files_list.extend(path for path in paths if path not in known and os.path.exists(path))
+        self.bm25.invalidate_stats()
+        self._rebuild_facets()
+        self.query_cache.invalidate()
+        print(f"🔄 其他进程更新了知识库，当前版本 {self.kb_version}")
+
+    def _shared_version_changed(self) -> bool:
+        """其他 worker 是否导出过新快照：平时每次检索只多一次 stat；本进程正在写知识库时跳过（写完会自己刷新）"""
+        if not self.snapshot_enabled or self._kb_lock.depth > 0:
+            return False
+        return pointer_stamp(self.snapshot_dir) != self._snapshot_stamp
+
+    def _sync_shared_version(self):
+        """
+        多进程：其他 worker 入库后会导出新快照（current.json 变化），发现后读入新清单并映射新快照。
+        重读清单、重建分面要读 SQLite，异步路径经 _async_shared_version 放到 IO 线程池执行
+        """
+        if not self._shared_version_changed():
+            return
+        with self._version_lock:
+            # 多个请求同时发现变化时只处理一次
+            stamp = pointer_stamp(self.snapshot_dir)
+            if stamp == self._snapshot_stamp:
+                return
+            self._snapshot_stamp = stamp
+            version = snapshot_version(self.snapshot_dir)
+            if version is None or version == self.kb_version:
+                return
+            self._reload_manifest()
+            snapshot = load_snapshot(self.snapshot_dir, self.kb_version)
+            if snapshot is not None:
+                self.snapshot = snapshot
+                print(f"🗺️ 已映射新快照：{len(snapshot)} 个块（版本 {snapshot.version}）")
+
+    async def _async_shared_version(self):
+        """_sync_shared_version 的异步版本：发现变化后在 IO 线程池里重读清单与分面，不阻塞事件循环"""
+        if not self._shared_version_changed():
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.io_executor, self._sync_shared_version)
+
+    def _refresh_snapshot(self, page_size: int = 1000):
+        """启用快照时：映射与当前知识库版本一致的快照，没有则从向量库导出一次（多个 worker 同时导出也安全）"""
+        if not self.snapshot_enabled:
+            return
+        try:
+            snapshot = load_snapshot(self.snapshot_dir, self.kb_version)
+            if snapshot is None:
+                with self._kb_write():
+                    # 拿到锁后再看一次：等锁期间其他 worker 可能已经导出了同一版本
+                    snapshot = load_snapshot(self.snapshot_dir, self.kb_version)
+                    if snapshot is None:
+                        snapshot = self._export_snapshot(page_size)
+        except Exception as e:
+            print(f"⚠️ 向量快照不可用，继续查询向量库：{e}")
+            return
+        if snapshot is not None:
+            self.snapshot = snapshot
+            self._snapshot_stamp = pointer_stamp(self.snapshot_dir)
+            print(f"🗺️ 向量快照已映射：{len(snapshot)} 个块（版本 {snapshot.version}）")
+
+    def _export_snapshot(self, page_size: int):
+        """从向量库分页导出当前版本的快照（调用方持有知识库写锁）"""
+        collection = self.vectorstore._collection
+        total = collection.count()
+        print(f"🗺️ 导出向量快照（{total} 个块）...")
+
+        def pages():
+            for offset in range(0, total, page_size):
+                page = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+                yield page["ids"], page["embeddings"]
+
+        export_snapshot(self.snapshot_dir, self.kb_version, pages())
+        return load_snapshot(self.snapshot_dir, self.kb_version)
+
+    def _rebuild_facets(self):
+        """从 BM25 索引里的块元数据重建分面索引（纯本地读取，不访问向量库）；建好后整体替换，检索不会看到空索引"""
+        facets = FacetIndex()
+        ids, metadatas, texts = [], [], []
+        for doc_id, text, metadata in self.bm25.iter_documents():
+            ids.append(doc_id)
+            metadatas.append(metadata)
+            texts.append(text)
+        facets.add(ids, metadatas, texts)
+        self.facets = facets
+        # 过滤检索器按签名缓存，分面变化后已缓存的检索器仍然有效（检索时实时取id子集）
+        print(f"🏷️ 分面索引就绪：{len(self.facets)} 个块，type={self.facets.values('type')}")
+
+    def _ensure_bm25_index(self, vectorstore, page_size: int = 1000):
+        """BM25 索引与向量库块数不一致（首次启用、分词器变化）时，从向量库全量回填"""
+        collection = vectorstore._collection
+        total = collection.count()
+        if self.bm25.tokenizer_matches() and self.bm25.count() == total:
+            return
+        print(f"🔤 重建 BM25 索引（向量库 {total} 个块）...")
+        self.bm25.clear()
+        for offset in range(0, total, page_size):
+            page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            docs = [Document(page_content=text, metadata=metadata or {})
+                    for text, metadata in zip(page["documents"], page["metadatas"])]
+            self.bm25.add_documents(page["ids"], docs)
+        print(f"✅ BM25 索引就绪：{self.bm25.count()} 个块")
 
         
     def query_document(self, question: str):
@@ -275,7 +813,7 @@ class RAGEngineLCEL:
 
     async def aquery_document(self, question: str):
         """兼容旧接口的异步版本。"""
-        return self.get_context(question)
+        return await self.aget_context(question)
 
     def debug_inspect_vectorstore(self, keyword: str, k: int = 20):
         """调试：直接查看向量库中与关键词相关的所有文档块"""
@@ -64,7 +64,7 @@ def create_ai_agent(api_key,rag_engine):
 【简历润色（可能包含上传文件）】
 - 当用户要求“润色/改写/优化简历内容”时：
   1) 先调用 smart_document_qa：检索与润色任务相关的写作规则（例如：STAR、量化、行动动词、结构等）。
-  2) 如果用户上传了文件文本（对话中会包含“用户上传了文件，内容如下：”），再调用 extract_relevant_chunks：从上传文本里抽取与润色任务最相关的文档块。
+  2) 如果用户上传了文件（对话中会包含“上传文件id：up-...”），再调用 extract_relevant_chunks(question=润色任务, upload_id=上传文件id)：从上传文档里抽取与润色任务最相关的文档块，不要把原文整段传给它。
   3) 最后调用 polish_text(text=需要润色的原文, rules_context=知识库规则片段, file_context=上传文档相关片段, style=用户指定风格) 生成润色结果。
 - 只生成一个最终详细版结果，并将 polish_text 工具返回的内容作为最终答案直接输出，不要重复调用工具。
 
@@ -83,6 +83,16 @@ def create_ai_agent(api_key,rag_engine):
     return agent
     
 
+def create_summary_llm(api_key):
+    """对话摘要用的轻量模型：只做历史压缩，用 flash 模型降低延迟和成本"""
+    return ChatZhipuAI(
+        model="glm-4-flash",
+        temperature=0.0,
+        api_key=api_key,
+        timeout=30
+    )
+
+
 # 在记忆模块部分，添加以下函数（放在 get_memory 函数后面即可）  添加参数memory_obj， 用他来管理消息操作
 def get_memory_as_langchain_messages(memory_obj):
     """将内部记忆格式转换为LangChain的Message对象列表"""
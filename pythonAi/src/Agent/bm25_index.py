@@ -0,0 +1,212 @@
+'''
+持久化 BM25 倒排索引（与向量库放在同一个目录下）
+向量检索对电话号码、公司名、日期这类“精确词”不敏感，这里补一路词法检索：
+- 中文分词：安装了 jieba 时用 jieba 搜索模式分词，否则用中文字二元组（bigram）
+  英文、数字、邮箱、电话等按整词切分并转小写
+- 倒排表存在 SQLite 里，知识库同步时按文档块id增量增删，不需要每次启动全量重建
+- 与向量检索结果用倒数排名融合（RRF）合并
+'''
+
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+try:
+    import jieba  # 可选依赖
+    jieba.setLogLevel(logging.WARNING)
+except ImportError:
+    jieba = None
+
+TOKENIZER_NAME = "jieba" if jieba is not None else "bigram"
+
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff]+")
+_WORD = re.compile(r"[a-z0-9]+(?:[.\-_@+][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """中英文混合分词；中文无 jieba 时切成二元组，单字词保留单字"""
+    text = (text or "").lower()
+    tokens = _WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if jieba is not None:
+            tokens.extend(t for t in jieba.lcut_for_search(run) if t.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """倒数排名融合：score = Σ 1 / (rrf_k + 排名)，按文档id（没有id时按内容）去重合并"""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:k]]
+
+
+class BM25Index:
+    def __init__(self, db_path: str, k1: float = 1.5, b: float = 0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc_id TEXT PRIMARY KEY,"
+            " source TEXT,"
+            " length INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " metadata TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT NOT NULL,"
+            " doc_id TEXT NOT NULL,"
+            " tf INTEGER NOT NULL,"
+            " PRIMARY KEY (term, doc_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+        self._stats: Optional[Tuple[int, float]] = None  # (文档数, 平均长度)
+
+    # ---------- 元信息 ----------
+    def tokenizer_matches(self) -> bool:
+        """索引是否由当前分词器建立（装上/卸载 jieba 后需要重建）"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'tokenizer'").fetchone()
+        return row is None or row[0] == TOKENIZER_NAME
+
+    def invalidate_stats(self):
+        """其他进程写入了索引：下次检索重新统计文档数与平均长度"""
+        with self._lock:
+            self._stats = None
+
+    def count(self) -> int:
+        return self._get_stats()[0]
+
+    def _get_stats(self) -> Tuple[int, float]:
+        with self._lock:
+            if self._stats is None:
+                n, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+                self._stats = (n, total / n if n else 0.0)
+            return self._stats
+
+    # ---------- 增删 ----------
+    def add_documents(self, ids: Sequence[str], docs: Sequence[Document]):
+        """按块id写入（同id覆盖），与向量库使用同一套id"""
+        rows, postings = [], []
+        for doc_id, doc in zip(ids, docs):
+            counts = Counter(tokenize(doc.page_content))
+            rows.append((doc_id, doc.metadata.get("source"), sum(counts.values()), doc.page_content,
+                         json.dumps(doc.metadata, ensure_ascii=False, default=str)))
+            postings.extend((term, doc_id, tf) for term, tf in counts.items())
+        with self._lock:
+            self._delete_locked(ids)
+            self._conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('tokenizer', ?)", (TOKENIZER_NAME,))
+            self._conn.commit()
+            self._stats = None
+
+    def delete(self, ids: Iterable[str]):
+        with self._lock:
+            self._delete_locked(list(ids))
+            self._conn.commit()
+            self._stats = None
+
+    def delete_source(self, source: str):
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("SELECT doc_id FROM docs WHERE source = ?", (source,))]
+            self._delete_locked(ids)
+            self._conn.commit()
+            self._stats = None
+
+    def _delete_locked(self, ids: List[str]):
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM postings WHERE doc_id IN ({marks})", batch)
+            self._conn.execute(f"DELETE FROM docs WHERE doc_id IN ({marks})", batch)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.commit()
+            self._stats = None
+
+    # ---------- 检索 ----------
+    def search(self, query: str, k: int = 10, allowed_ids: Optional[Sequence[str]] = None) -> List[Tuple[str, float]]:
+        """返回 [(块id, BM25 分数)]，按分数降序；allowed_ids 不为 None 时只在这些块里打分"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        n_docs, avg_len = self._get_stats()
+        if not terms or not n_docs:
+            return []
+        marks = ",".join("?" * len(terms))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT p.term, p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id"
+                f" WHERE p.term IN ({marks})",
+                terms,
+            ).fetchall()
+        df = Counter(term for term, _, _, _ in rows)
+        allowed = set(allowed_ids) if allowed_ids is not None else None
+        scores: Dict[str, float] = {}
+        for term, doc_id, tf, length in rows:
+            if allowed is not None and doc_id not in allowed:
+                continue
+            idf = math.log(1 + (n_docs - df[term] + 0.5) / (df[term] + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * length / (avg_len or 1))
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def get_documents(self, ids: Sequence[str]) -> List[Document]:
+        """按给定顺序取回文档块"""
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT doc_id, text, metadata FROM docs WHERE doc_id IN ({marks})", list(ids)
+            ).fetchall()
+        by_id = {doc_id: Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+                 for doc_id, text, metadata in rows}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def search_documents(self, query: str, k: int = 10, allowed_ids: Optional[Sequence[str]] = None) -> List[Document]:
+        return self.get_documents([doc_id for doc_id, _ in self.search(query, k, allowed_ids)])
+
+    def iter_documents(self, page_size: int = 1000):
+        """分页遍历全部块，产出 (块id, 文本, metadata)"""
+        offset = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT doc_id, text, metadata FROM docs ORDER BY doc_id LIMIT ? OFFSET ?", (page_size, offset)
+                ).fetchall()
+            if not rows:
+                return
+            for doc_id, text, metadata in rows:
+                yield doc_id, text, json.loads(metadata)
+            offset += page_size
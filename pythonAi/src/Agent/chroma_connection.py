@@ -0,0 +1,190 @@
+'''
+Chroma 连接层
+原来直接 chromadb.HttpClient(host="chromadb", port=8000)：默认 HTTP 设置、没有超时、没有重连，
+离开 docker-compose（本地调试、测试）就无法运行。这里统一管理：
+- HTTP 客户端使用长连接池（连接数与 IO 线程数一致），并发检索不必每次重新建立 TCP 连接
+- 连接超时与请求超时可配置；建立客户端前先做一次带超时的 TCP 探测，服务不可达时不会卡住
+- 后台线程定期 heartbeat 探测，连续失败达到阈值时切换到本地 PersistentClient（同一集合名），
+  并回调引擎重建向量库；本地模式也是测试时的替身
+- 切换到本地后不会自动切回（两边数据可能已经不一致），服务恢复后重启进程即可
+模式 CHROMA_MODE：auto（默认，优先 HTTP，失败时用本地）/ http（只用 HTTP）/ local（只用本地）
+'''
+
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+import chromadb
+from chromadb.config import Settings
+
+logger = logging.getLogger(__name__)
+
+CHROMA_MODES = ("auto", "http", "local")
+
+
+class ChromaConnection:
+    def __init__(self, host: str = "chromadb", port: int = 8000, local_path: str = "./chroma_db/chroma_local",
+                 mode: str = "auto", pool_size: int = 32, keepalive_secs: float = 40.0,
+                 connect_timeout: float = 2.0, request_timeout: float = 30.0,
+                 probe_interval: float = 15.0, failure_threshold: int = 2):
+        if mode not in CHROMA_MODES:
+            raise ValueError(f"不支持的 CHROMA_MODE: {mode}")
+        self.host = host
+        self.port = port
+        self.local_path = local_path
+        self.configured_mode = mode
+        self.pool_size = pool_size
+        self.keepalive_secs = keepalive_secs
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+
+        self.client = None
+        self.mode: Optional[str] = None  # 当前实际使用的模式：http / local
+        self.on_failover: Optional[Callable] = None
+        # 探测状态
+        self.healthy = False
+        self.last_probe_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._probe_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, persist_directory: str, pool_size: int = 32) -> "ChromaConnection":
+        return cls(
+            host=os.getenv("CHROMA_HOST", "chromadb"),  # 对应 docker-compose 中的服务名
+            port=int(os.getenv("CHROMA_PORT", "8000")),
+            local_path=os.getenv("CHROMA_LOCAL_PATH") or os.path.join(persist_directory, "chroma_local"),
+            mode=os.getenv("CHROMA_MODE", "auto"),
+            pool_size=pool_size,
+            keepalive_secs=float(os.getenv("CHROMA_KEEPALIVE_SECS", "40")),
+            connect_timeout=float(os.getenv("CHROMA_CONNECT_TIMEOUT", "2")),
+            request_timeout=float(os.getenv("CHROMA_REQUEST_TIMEOUT", "30")),
+            probe_interval=float(os.getenv("CHROMA_PROBE_INTERVAL", "15")),
+            failure_threshold=int(os.getenv("CHROMA_FAILURE_THRESHOLD", "2")),
+        )
+
+    # ---------- 建立连接 ----------
+    def http_settings(self) -> Settings:
+        """HTTP 客户端设置：长连接池大小与 IO 线程数一致"""
+        return Settings(
+            chroma_http_keepalive_secs=self.keepalive_secs,
+            chroma_http_max_connections=self.pool_size,
+            chroma_http_max_keepalive_connections=self.pool_size,
+            anonymized_telemetry=False,
+        )
+
+    def _apply_timeouts(self, client):
+        """chromadb 的 HTTP 会话默认没有超时，这里换成可配置的连接/请求超时"""
+        session = getattr(getattr(client, "_server", None), "_session", None)
+        if session is None:
+            return
+        import httpx
+
+        session.timeout = httpx.Timeout(self.request_timeout, connect=self.connect_timeout)
+
+    def _connect_http(self):
+        # 先做带超时的 TCP 探测：HttpClient 构造时就会请求服务端，不可达时可能长时间阻塞
+        with socket.create_connection((self.host, self.port), timeout=self.connect_timeout):
+            pass
+        client = chromadb.HttpClient(host=self.host, port=self.port, settings=self.http_settings())
+        self._apply_timeouts(client)
+        client.heartbeat()
+        return client
+
+    def _connect_local(self):
+        os.makedirs(self.local_path, exist_ok=True)
+        return chromadb.PersistentClient(path=self.local_path, settings=Settings(anonymized_telemetry=False))
+
+    def connect(self):
+        """按配置模式建立连接，返回 chromadb 客户端"""
+        if self.configured_mode == "local":
+            client, mode = self._connect_local(), "local"
+        else:
+            try:
+                client, mode = self._connect_http(), "http"
+            except Exception as e:
+                if self.configured_mode == "http":
+                    raise
+                logger.warning("Chroma 服务 %s:%s 不可用（%s），改用本地 PersistentClient：%s",
+                               self.host, self.port, e, self.local_path)
+                client, mode = self._connect_local(), "local"
+        with self._lock:
+            self.client, self.mode = client, mode
+            self.healthy = True
+        logger.info("Chroma 连接模式：%s", mode)
+        return client
+
+    # ---------- 健康探测与故障切换 ----------
+    def probe(self) -> bool:
+        """探测一次；HTTP 模式连续失败达到阈值时切换到本地"""
+        client = self.client
+        try:
+            client.heartbeat()
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e)
+        with self._lock:
+            self.healthy = ok
+            self.last_probe_at = time.time()
+            self.last_error = error
+            self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+            should_failover = (not ok and self.mode == "http" and self.configured_mode == "auto"
+                               and self.consecutive_failures >= self.failure_threshold)
+        if not ok:
+            logger.warning("Chroma 健康探测失败（连续 %s 次）：%s", self.consecutive_failures, error)
+        if should_failover:
+            self.failover()
+        return ok
+
+    def failover(self):
+        """切换到本地 PersistentClient，并通知引擎重建向量库"""
+        client = self._connect_local()
+        with self._lock:
+            self.client, self.mode = client, "local"
+            self.healthy = True
+            self.consecutive_failures = 0
+            self.failovers += 1
+        logger.warning("Chroma 已切换到本地模式：%s", self.local_path)
+        if self.on_failover is not None:
+            try:
+                self.on_failover(client)
+            except Exception:
+                logger.exception("Chroma 故障切换回调失败")
+
+    def start_health_probe(self, on_failover: Optional[Callable] = None):
+        """启动后台探测线程（probe_interval <= 0 时不启动）"""
+        self.on_failover = on_failover
+        if self.probe_interval <= 0 or self._probe_thread is not None:
+            return
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="chroma-probe", daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_interval):
+            self.probe()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "configured_mode": self.configured_mode,
+                "healthy": self.healthy,
+                "last_probe_at": self.last_probe_at,
+                "last_error": self.last_error,
+                "consecutive_failures": self.consecutive_failures,
+                "failovers": self.failovers,
+            }
+
+    def close(self):
+        self._stop.set()
+        if self._probe_thread is not None:
+            self._probe_thread.join(timeout=5)
+            self._probe_thread = None
@@ -0,0 +1,138 @@
+'''
+检索上下文打包（get_context 拼接前的最后一步）
+检索到的 k 个块直接用 "\n\n" 拼接时，同一段简历/规则经常重复出现多次（多路检索、分块重叠），
+提示词变长但信息没有增加。这里按检索排名依次处理：
+1. 精确去重：规范化文本哈希相同的块只保留一个
+2. 近似去重：字符 shingle + MinHash 估算 Jaccard 相似度，超过阈值视为重复
+3. 合并同一来源里首尾重叠的相邻块（分割器 chunk_overlap 造成的重叠），一个块完全包含另一个时只留大的
+4. 按排名顺序装入 token 预算（tiktoken 计数），最后一块放不下时截断
+'''
+
+import hashlib
+import zlib
+from typing import List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.Agent.embedding_cache import normalize_text
+from src.Agent.token_utils import estimate_tokens, truncate_to_tokens
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _shingles(text: str, size: int) -> set:
+    text = normalize_text(text).lower()
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    """MinHash 签名：num_perm 个 (a*x + b) mod p 哈希函数，向量化计算"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = _shingles(text, self.shingle_size)
+        if not shingles:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # (shingle 数, num_perm)；a、x 都小于 2^32，乘积不会超出 uint64
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+        return float(np.mean(sig_a == sig_b))
+
+
+def _overlap_merge(first: str, second: str, min_overlap: int) -> Optional[str]:
+    """first 的结尾与 second 的开头重叠至少 min_overlap 个字符时返回合并后的文本，否则返回 None"""
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return None
+    probe = second[:min_overlap]
+    start = first.find(probe, max(0, len(first) - len(second)))
+    while start != -1:
+        tail = first[start:]
+        if second.startswith(tail):
+            return first + second[len(tail):]
+        start = first.find(probe, start + 1)
+    return None
+
+
+def _merge_pair(a: str, b: str, min_overlap: int) -> Optional[str]:
+    """同一来源的两块：包含关系取大的，首尾重叠则拼接；无法合并返回 None"""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    return _overlap_merge(a, b, min_overlap) or _overlap_merge(b, a, min_overlap)
+
+
+class ContextPacker:
+    def __init__(self, max_tokens: int = 2000, near_dup_threshold: float = 0.85, num_perm: int = 64,
+                 shingle_size: int = 5, min_overlap: int = 20, min_tail_tokens: int = 64):
+        self.max_tokens = max_tokens
+        self.near_dup_threshold = near_dup_threshold
+        self.min_overlap = min_overlap
+        self.min_tail_tokens = min_tail_tokens  # 预算剩余不足该值时不再截断塞入最后一块
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+
+    def dedupe(self, docs: Sequence[Document]) -> List[Document]:
+        """精确去重 + MinHash 近似去重，保留排名靠前的块"""
+        kept, signatures, seen = [], [], set()
+        for doc in docs:
+            text = doc.page_content or ""
+            digest = hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+            if not text.strip() or digest in seen:
+                continue
+            seen.add(digest)
+            signature = self.hasher.signature(text)
+            if any(MinHasher.jaccard(signature, other) >= self.near_dup_threshold for other in signatures):
+                continue
+            kept.append(doc)
+            signatures.append(signature)
+        return kept
+
+    def merge_adjacent(self, docs: Sequence[Document]) -> List[Document]:
+        """同一来源里可以拼接（重叠或包含）的块合并到排名靠前的位置"""
+        merged: List[Document] = []
+        for doc in docs:
+            source = doc.metadata.get("source")
+            for i, existing in enumerate(merged):
+                if source is None or existing.metadata.get("source") != source:
+                    continue
+                text = _merge_pair(existing.page_content, doc.page_content, self.min_overlap)
+                if text is not None:
+                    merged[i] = Document(id=existing.id, page_content=text, metadata=existing.metadata)
+                    break
+            else:
+                merged.append(doc)
+        return merged
+
+    def fit_budget(self, docs: Sequence[Document], max_tokens: Optional[int] = None) -> List[Document]:
+        """按排名依次装入 token 预算；放不下的块在剩余预算足够时截断后放入，然后停止"""
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        packed, used = [], 0
+        for doc in docs:
+            tokens = estimate_tokens(doc.page_content)
+            if used + tokens <= budget:
+                packed.append(doc)
+                used += tokens
+                continue
+            remaining = budget - used
+            if remaining >= self.min_tail_tokens:
+                packed.append(Document(id=doc.id, page_content=truncate_to_tokens(doc.page_content, remaining),
+                                       metadata=doc.metadata))
+            break
+        return packed
+
+    def pack(self, docs: Sequence[Document], max_tokens: Optional[int] = None) -> List[Document]:
+        return self.fit_budget(self.merge_adjacent(self.dedupe(docs)), max_tokens)
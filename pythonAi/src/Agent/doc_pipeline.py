@@ -0,0 +1,156 @@
+'''
+文档加载 + 分割流水线
+PyPDFLoader / Unstructured 解析和文本分割都是 CPU 密集型，这里用进程池按文件并行处理，
+每个文件处理完立刻把它的文档块交给调用方（向量库写入），而不是先把所有 Document 攒在一个列表里。
+'''
+
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownTextSplitter, MarkdownHeaderTextSplitter
+
+
+def clean_document_text(text: str) -> str:
+    """清洗文档文本的辅助函数"""
+    # 1. 去除多余的空行（将连续两个以上的换行替换为两个换行）
+    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+    # 2. 去除行首行尾的空白
+    lines = [line.strip() for line in text.split('\n')]
+    # 3. 过滤掉空行后重新组合
+    cleaned_lines = [line for line in lines if line]  # 完全去掉空行
+    return '\n'.join(cleaned_lines)
+
+
+def _load_file(file_path: str) -> List[Document]:
+    """按后缀选择加载器（加载器在这里导入：langchain_community / unstructured 很重，只在真正解析文件的进程里付出）"""
+    if file_path.endswith('.pdf'):
+        from langchain_community.document_loaders import PyPDFLoader
+        loader = PyPDFLoader(file_path)
+    elif file_path.endswith('.md') or file_path.endswith('.txt'):
+        # Markdown 也用 TextLoader 加载（无需 unstructured）
+        from langchain_community.document_loaders import TextLoader
+        loader = TextLoader(file_path, encoding='utf-8')
+    elif file_path.endswith('.docx'):
+        from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+        loader = UnstructuredWordDocumentLoader(file_path)
+    else:
+        return []
+    return loader.load()
+
+
+def _split_markdown(docs: List[Document]) -> List[Document]:
+    """Markdown：先按标题分割，再对长块二次分割"""
+    headers_to_split_on = [("#", "H1"), ("##", "H2"), ("###", "H3")]
+    markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on, strip_headers=False)
+    md_text_splitter = MarkdownTextSplitter(chunk_size=500, chunk_overlap=50)
+
+    final_splits = []
+    for doc in docs:
+        for split in markdown_splitter.split_text(doc.page_content):
+            # 保留原始文件的元数据
+            split.metadata.update(doc.metadata)
+            if len(split.page_content) > 600:
+                final_splits.extend(md_text_splitter.split_documents([split]))
+            else:
+                final_splits.append(split)
+    return final_splits
+
+
+def load_and_split_file(file_path: str) -> List[Document]:
+    """加载、清洗并分割单个文件（在子进程中执行，必须是模块级函数才能被 pickle）"""
+    docs = _load_file(file_path)
+    for doc in docs:
+        doc.page_content = clean_document_text(doc.page_content)
+
+    if file_path.endswith('.md'):
+        return _split_markdown(docs)
+
+    if file_path.endswith('.docx'):
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=600,
+            chunk_overlap=100,
+            separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
+        )
+    else:
+        # PDF 和 TXT 使用递归字符分割器，按自然边界
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=600,
+            chunk_overlap=60,
+            separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""],
+            keep_separator=False
+        )
+    return splitter.split_documents(docs)
+
+
+def _safe_load_and_split(file_path: str) -> Tuple[str, List[Document], Optional[str]]:
+    try:
+        return file_path, load_and_split_file(file_path), None
+    except Exception as e:
+        return file_path, [], str(e)
+
+
+def iter_split_documents(files: Iterable[str], max_workers: Optional[int] = None,
+                         max_pending: Optional[int] = None) -> Iterator[Tuple[str, List[Document], Optional[str]]]:
+    """
+    并行加载分割，按完成顺序逐个产出 (文件路径, 文档块列表, 错误信息)。
+    加载失败的文件错误信息不为 None（块列表为空），调用方不能把它当成“文件已没有内容”处理。
+
+    Args:
+        files: 待处理文件路径
+        max_workers: 进程数，默认 CPU 核数；为 1 时在当前进程串行处理
+        max_pending: 同时在途的文件数上限（控制内存），默认 max_workers * 2
+    """
+    files = list(files)
+    total = len(files)
+    if total == 0:
+        return
+    max_workers = max_workers or int(os.getenv("KB_LOADER_WORKERS", "0")) or os.cpu_count() or 1
+    max_workers = min(max_workers, total)
+    max_pending = max_pending or max_workers * 2
+    start = time.time()
+
+    def report(done, file_path, chunks, error):
+        if error:
+            print(f"❌ [{done}/{total}] 处理文件 {file_path} 时出错: {error}，跳过此文件")
+        else:
+            print(f"  [{done}/{total}] {os.path.basename(file_path)} → {len(chunks)} 个块（已用时 {time.time() - start:.1f}s）")
+
+    # 文件少时进程池的启动开销大于收益，直接串行
+    if max_workers <= 1:
+        for done, path in enumerate(files, 1):
+            file_path, chunks, error = _safe_load_and_split(path)
+            report(done, file_path, chunks, error)
+            yield file_path, chunks, error
+        return
+
+    # spawn 方式启动子进程，避免 fork 继承 chromadb/httpx 的线程和连接
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as pool:
+        file_iter = iter(files)
+        pending = set()
+        done = 0
+        # 有界提交：在途任务不超过 max_pending，已完成的结果立刻交出去释放内存
+        for path in file_iter:
+            pending.add(pool.submit(_safe_load_and_split, path))
+            if len(pending) >= max_pending:
+                break
+        try:
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done += 1
+                    file_path, chunks, error = future.result()
+                    report(done, file_path, chunks, error)
+                    yield file_path, chunks, error
+                    next_path = next(file_iter, None)
+                    if next_path is not None:
+                        pending.add(pool.submit(_safe_load_and_split, next_path))
+        finally:
+            # 调用方提前停止（例如入库任务被取消）：还没开始的文件不再加载
+            for future in pending:
+                future.cancel()
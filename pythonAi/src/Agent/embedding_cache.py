@@ -0,0 +1,273 @@
+'''
+嵌入向量磁盘缓存
+按 (模型名, 规范化文本哈希) 作为键，把向量以 float32 二进制存进 SQLite，
+知识库重建、重复上传同一份简历时直接命中缓存，不再调用嵌入接口。
+超过条数/字节上限时按最近访问时间（LRU）淘汰；容量检查每写入一定条数才做一次，不在每次写入时全表统计。
+查询向量不进磁盘缓存（只放进程内的小 LRU），不会把知识库块的向量挤出去。
+'''
+
+import array
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "./chroma_db/embedding_cache.sqlite3"
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全角转半角、合并空白，保证同一内容得到同一个哈希"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_cache_key(model_name: str, text: str) -> str:
+    """缓存键 = sha256(模型名 + 规范化文本)"""
+    payload = f"{model_name}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingDiskCache:
+    """SQLite 持久化的向量缓存，向量以 float32 字节串存储（比 JSON 小 4~5 倍）"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 200_000, max_bytes: int = 512 * 1024 * 1024,
+                 evict_check_every: int = 1000, touch_interval: float = 600.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # 容量检查要全表 COUNT/SUM，累计写入这么多条才检查一次（超出上限最多这么多条）
+        self.evict_check_every = evict_check_every
+        # 命中时访问时间距今超过该秒数才刷新，LRU 精度到分钟级就够，避免每次命中都写库
+        self.touch_interval = touch_interval
+        self._writes_since_check = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vec BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        with self._lock:
+            self._evict_locked()
+
+    @staticmethod
+    def _encode(vector: List[float]) -> bytes:
+        return array.array("f", vector).tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        vec = array.array("f")
+        vec.frombytes(blob)
+        return vec.tolist()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """批量读取，命中的键同时刷新访问时间"""
+        if not keys:
+            return {}
+        found = {}
+        stale = []
+        now = time.time()
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            # SQLite 单条语句的参数个数有限，分批查询
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vec, last_access FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob, last_access in rows:
+                    found[key] = self._decode(blob)
+                    if now - last_access > self.touch_interval:
+                        stale.append(key)
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in stale],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """批量写入；累计写入 evict_check_every 条后检查容量并淘汰最久未使用的条目"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec, last_access) VALUES (?, ?, ?)",
+                [(key, self._encode(vec), now) for key, vec in items.items()],
+            )
+            self._conn.commit()
+            self._writes_since_check += len(items)
+            if self._writes_since_check >= self.evict_check_every:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        self._writes_since_check = 0
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings"
+        ).fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        # 每条向量长度基本一致，用平均长度估算需要淘汰多少条
+        avg_bytes = total_bytes / count if count else 1
+        keep = min(self.max_entries, int(self.max_bytes / avg_bytes))
+        # 多淘汰 10%，避免每次写入都触发淘汰
+        keep = int(keep * 0.9)
+        to_remove = count - keep
+        if to_remove <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (to_remove,),
+        )
+        self._conn.commit()
+        logger.info(f"嵌入缓存淘汰 {to_remove} 条（剩余约 {keep} 条）")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 同一个缓存文件在进程内只打开一次，引擎和工具共用
+_shared_caches: Dict[str, EmbeddingDiskCache] = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_cache(path: str = DEFAULT_CACHE_PATH, **kwargs) -> EmbeddingDiskCache:
+    key = os.path.abspath(path)
+    with _shared_lock:
+        if key not in _shared_caches:
+            _shared_caches[key] = EmbeddingDiskCache(path, **kwargs)
+        return _shared_caches[key]
+
+
+class CachedEmbeddings(Embeddings):
+    """包装任意 Embeddings 对象：先查磁盘缓存，只把未命中的文本发给嵌入接口"""
+
+    def __init__(self, underlying: Embeddings, cache: Optional[EmbeddingDiskCache] = None,
+                 model_name: Optional[str] = None, cache_path: str = DEFAULT_CACHE_PATH,
+                 executor: Optional[Executor] = None, query_cache_size: int = 2048):
+        self.underlying = underlying
+        self.cache = cache if cache is not None else get_shared_cache(cache_path)
+        self.model_name = model_name or getattr(underlying, "model", None) or type(underlying).__name__
+        # 底层模型没有原生异步实现时，同步调用放到这个线程池里（不占用默认线程池）
+        self.executor = executor
+        self.hits = 0
+        self.misses = 0
+        # 查询向量只放进程内 LRU：问题文本几乎不重复，写进磁盘缓存只会挤掉知识库块的向量
+        self.query_cache_size = query_cache_size
+        self._query_vectors: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._query_lock = threading.Lock()
+        self.query_hits = 0
+        self.query_misses = 0
+
+    def _lookup(self, texts: List[str]):
+        """查缓存，返回 (全部键, 已命中的向量, 去重后未命中的 {键: 文本})"""
+        keys = [make_cache_key(self.model_name, t) for t in texts]
+        cached = self.cache.get_many(keys)
+
+        # 未命中的文本去重后一次性发给嵌入接口
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.hits += sum(1 for k in keys if k in cached)
+        self.misses += len(texts) - sum(1 for k in keys if k in cached)
+        return keys, cached, missing
+
+    def _store(self, cached, missing, vectors):
+        fresh = dict(zip(missing.keys(), vectors))
+        self.cache.put_many(fresh)
+        cached.update(fresh)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = self._lookup(texts)
+        if missing:
+            self._store(cached, missing, self.underlying.embed_documents(list(missing.values())))
+        return [cached[key] for key in keys]
+
+    def _query_get(self, text: str) -> Tuple[str, Optional[List[float]]]:
+        key = make_cache_key(self.model_name, text)
+        with self._query_lock:
+            vector = self._query_vectors.get(key)
+            if vector is not None:
+                self._query_vectors.move_to_end(key)
+                self.query_hits += 1
+            else:
+                self.query_misses += 1
+        return key, vector
+
+    def _query_put(self, key: str, vector: List[float]):
+        with self._query_lock:
+            self._query_vectors[key] = vector
+            self._query_vectors.move_to_end(key)
+            while len(self._query_vectors) > self.query_cache_size:
+                self._query_vectors.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        key, vector = self._query_get(text)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._query_put(key, vector)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # 查缓存/写缓存要提交 SQLite 事务，还可能等入库线程持有的锁，放进线程池，不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        keys, cached, missing = await loop.run_in_executor(self.executor, self._lookup, texts)
+        if missing:
+            miss_texts = list(missing.values())
+            if type(self.underlying).aembed_documents is not Embeddings.aembed_documents:
+                # 底层模型实现了原生异步接口，直接 await
+                vectors = await self.underlying.aembed_documents(miss_texts)
+            else:
+                vectors = await loop.run_in_executor(self.executor, self.underlying.embed_documents, miss_texts)
+            await loop.run_in_executor(self.executor, self._store, cached, missing, vectors)
+        return [cached[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key, vector = self._query_get(text)
+        if vector is None:
+            if type(self.underlying).aembed_query is not Embeddings.aembed_query:
+                vector = await self.underlying.aembed_query(text)
+            else:
+                loop = asyncio.get_running_loop()
+                vector = await loop.run_in_executor(self.executor, self.underlying.embed_query, text)
+            self._query_put(key, vector)
+        return vector
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "query_hits": self.query_hits,
+            "query_misses": self.query_misses,
+        }
@@ -0,0 +1,136 @@
+'''
+知识库元数据分面索引（type / category / source / rule_type）
+按 metadata 过滤检索时，不在每次查询里重新扫描、重新建检索器，
+而是预先维护 “分面取值 -> 文档块id集合” 的倒排表：
+过滤条件直接换算成块id子集，向量检索用 collection.query(ids=...) 只在子集内搜索，
+BM25 也只在子集内打分；同一过滤条件的id列表按签名缓存。
+'''
+
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+FACET_KEYS = ("type", "category", "source", "rule_type")
+
+# 知识库文件的分面配置（与 RAGLearn/RAG_ways.py 的 KNOWLEDGE_FILES_CONFIG 保持一致，新增文件在这里加一项）
+KB_FILE_FACETS: Dict[str, Dict[str, str]] = {
+    "rules.md": {"type": "rule", "category": "general"},
+    "star.md": {"type": "rule", "category": "star_method"},
+    "newRules.txt": {"type": "rule", "category": "general"},
+    "template.md": {"type": "template", "category": "template_education"},
+    "简历模版.docx": {"type": "template", "category": "template"},
+}
+DEFAULT_FACETS = {"type": "document", "category": "general"}
+
+
+def compute_facets(metadata: dict, text: str = "") -> Dict[str, str]:
+    """根据块的 source 与标题元数据计算分面；rule_type 取最近一级标题（同 clean_md_to_df 的规则名）"""
+    source = os.path.basename(str(metadata.get("source") or ""))
+    facets = dict(KB_FILE_FACETS.get(source, DEFAULT_FACETS))
+    if source.endswith(".md"):
+        header = metadata.get("H3") or metadata.get("H2") or metadata.get("H1")
+        if not header and text:
+            header = text.strip().split("\n", 1)[0].lstrip("#").strip()[:50]
+        if header:
+            facets["rule_type"] = header
+    return facets
+
+
+def annotate_documents(docs):
+    """入库前把分面写进块的 metadata（向量库和 BM25 里都能看到）"""
+    for doc in docs:
+        for key, value in compute_facets(doc.metadata, doc.page_content).items():
+            doc.metadata.setdefault(key, value)
+    return docs
+
+
+def _values(value) -> Tuple[str, ...]:
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(str(v) for v in value))
+    return (str(value),)
+
+
+class FacetIndex:
+    def __init__(self):
+        self._postings: Dict[Tuple[str, str], set] = defaultdict(set)
+        self._doc_facets: Dict[str, List[Tuple[str, str]]] = {}
+        self._id_lists: Dict[Tuple, List[str]] = {}  # 过滤签名 -> 排好序的块id列表
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(metadata_filter: Optional[dict]) -> Tuple:
+        """过滤条件的规范化签名，可作为缓存键；{"type": "rule"} 与 {"type": ["rule"]} 等价"""
+        if not metadata_filter:
+            return ()
+        return tuple(sorted((key, _values(value)) for key, value in metadata_filter.items()))
+
+    @staticmethod
+    def _facets_of(metadata: dict, text: str) -> List[Tuple[str, str]]:
+        facets = compute_facets(metadata, text)
+        # 已写入 metadata 的分面优先（入库时计算的结果），source 统一用文件名
+        for key in ("type", "category", "rule_type"):
+            if metadata.get(key):
+                facets[key] = metadata[key]
+        facets["source"] = os.path.basename(str(metadata.get("source") or ""))
+        return [(key, str(value)) for key, value in facets.items() if value]
+
+    def add(self, ids: Sequence[str], metadatas: Sequence[dict], texts: Optional[Sequence[str]] = None):
+        texts = texts or [""] * len(ids)
+        with self._lock:
+            for doc_id, metadata, text in zip(ids, metadatas, texts):
+                self._remove_locked(doc_id)
+                facets = self._facets_of(metadata or {}, text)
+                self._doc_facets[doc_id] = facets
+                for facet in facets:
+                    self._postings[facet].add(doc_id)
+            self._id_lists.clear()
+
+    def remove(self, ids: Iterable[str]):
+        with self._lock:
+            for doc_id in ids:
+                self._remove_locked(doc_id)
+            self._id_lists.clear()
+
+    def _remove_locked(self, doc_id: str):
+        for facet in self._doc_facets.pop(doc_id, []):
+            postings = self._postings.get(facet)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[facet]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_facets.clear()
+            self._id_lists.clear()
+
+    def ids_for(self, metadata_filter: Optional[dict]) -> Optional[List[str]]:
+        """过滤条件 -> 块id列表（键之间为“与”，同一键的多个取值为“或”）；无过滤条件返回 None"""
+        sig = self.signature(metadata_filter)
+        if not sig:
+            return None
+        with self._lock:
+            cached = self._id_lists.get(sig)
+            if cached is not None:
+                return cached
+            result = None
+            for key, values in sig:
+                if key == "source":
+                    values = tuple(os.path.basename(v) for v in values)
+                matched = set().union(*(self._postings.get((key, v), set()) for v in values))
+                result = matched if result is None else result & matched
+                if not result:
+                    break
+            ids = sorted(result or ())
+            self._id_lists[sig] = ids
+            return ids
+
+    def values(self, key: str) -> Dict[str, int]:
+        """某个分面的全部取值及块数，便于调试和前端展示"""
+        with self._lock:
+            return {value: len(ids) for (k, value), ids in self._postings.items() if k == key}
+
+    def __len__(self):
+        return len(self._doc_facets)
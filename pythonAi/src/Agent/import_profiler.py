@@ -0,0 +1,127 @@
+'''
+导入耗时分析
+服务冷启动慢、--reload 和多 worker 扩容时每个进程都要重复付出导入成本，先要知道时间花在哪些模块上。
+在子进程里执行 `python -X importtime -c "import <模块>"`（不污染当前进程已导入的模块），
+解析 stderr 中每个模块的 自身耗时 / 累计耗时 / 层级，汇总出：
+- 导入目标模块的总耗时与子进程峰值内存（RSS）
+- 累计耗时最高的模块、自身耗时最高的模块、按顶层包汇总的耗时
+用法：python -m src.Agent.import_profiler src.api.main --top 20
+'''
+
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# import time:       565 |     315563 |         langsmith.env._runtime_env
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( +)(\S+)\s*$")
+_RSS_MARKER = "__import_profiler_max_rss_kb__"
+
+
+def parse_importtime(text: str) -> List[dict]:
+    """解析 -X importtime 输出，返回 [{module, self_us, cumulative_us, depth}]（按导入完成顺序）"""
+    records = []
+    for line in text.splitlines():
+        match = _LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        records.append({
+            "module": module,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "depth": (len(indent) - 1) // 2,  # 顶层模块缩进 1 个空格，每深一层多 2 个
+        })
+    return records
+
+
+def summarize(records: List[dict], top: int = 20) -> dict:
+    """汇总：总耗时、累计/自身耗时排行、按顶层包的自身耗时合计"""
+    by_package: Dict[str, int] = {}
+    for record in records:
+        package = record["module"].split(".")[0]
+        by_package[package] = by_package.get(package, 0) + record["self_us"]
+    total_us = sum(record["cumulative_us"] for record in records if record["depth"] == 0)
+
+    def _ms(us: int) -> float:
+        return round(us / 1000, 2)
+
+    return {
+        "total_ms": _ms(total_us),
+        "module_count": len(records),
+        "top_cumulative": [
+            {"module": r["module"], "cumulative_ms": _ms(r["cumulative_us"]), "self_ms": _ms(r["self_us"])}
+            for r in sorted(records, key=lambda r: r["cumulative_us"], reverse=True)[:top]
+        ],
+        "top_self": [
+            {"module": r["module"], "self_ms": _ms(r["self_us"])}
+            for r in sorted(records, key=lambda r: r["self_us"], reverse=True)[:top]
+        ],
+        "by_package": [
+            {"package": package, "self_ms": _ms(us)}
+            for package, us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+        ],
+    }
+
+
+def profile_imports(module: str, top: int = 20, python: Optional[str] = None, cwd: Optional[str] = None,
+                    timeout: float = 120.0) -> dict:
+    """在新的子进程里导入 module 并分析导入耗时；导入失败时 error 字段给出 stderr 最后一行"""
+    if not re.fullmatch(r"[A-Za-z_][\w.]*", module):
+        raise ValueError(f"非法的模块名: {module}")
+    # ru_maxrss 在 Linux 上单位是 KB（macOS 是字节）
+    code = (
+        f"import {module}\n"
+        "import resource, sys\n"
+        f"print('{_RSS_MARKER}', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stderr)\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [cwd or os.getcwd(), os.getenv("PYTHONPATH")])))
+    proc = subprocess.run([python or sys.executable, "-X", "importtime", "-c", code], cwd=cwd,
+                          capture_output=True, text=True, timeout=timeout, env=env)
+    records = parse_importtime(proc.stderr)
+    result = summarize(records, top=top)
+    result["module"] = module
+    result["max_rss_mb"] = None
+    for line in proc.stderr.splitlines():
+        if line.startswith(_RSS_MARKER):
+            result["max_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    result["error"] = None
+    if proc.returncode != 0:
+        other = [line for line in proc.stderr.splitlines() if line.strip() and not _LINE.match(line)]
+        result["error"] = other[-1] if other else f"exit code {proc.returncode}"
+        logger.warning("导入 %s 失败：%s", module, result["error"])
+    return result
+
+
+def format_report(result: dict) -> str:
+    lines = [f"导入 {result['module']}：{result['total_ms']} ms，{result['module_count']} 个模块，"
+             f"峰值 RSS {result['max_rss_mb']} MB"]
+    if result.get("error"):
+        lines.append(f"导入失败：{result['error']}")
+    lines.append("\n累计耗时最高：")
+    lines += [f"  {r['cumulative_ms']:>10.2f} ms  (自身 {r['self_ms']:>8.2f})  {r['module']}"
+              for r in result["top_cumulative"]]
+    lines.append("\n按顶层包汇总（自身耗时）：")
+    lines += [f"  {r['self_ms']:>10.2f} ms  {r['package']}" for r in result["by_package"]]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="分析模块导入耗时（python -X importtime）")
+    parser.add_argument("module", nargs="?", default="src.api.main", help="要导入的模块，默认 src.api.main")
+    parser.add_argument("--top", type=int, default=20, help="排行显示条数")
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args(argv)
+    result = profile_imports(args.module, top=args.top)
+    print(json.dumps(result, ensure_ascii=False, indent=2) if args.json else format_report(result))
+    return 1 if result["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
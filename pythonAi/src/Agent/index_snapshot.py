@@ -0,0 +1,161 @@
+'''
+只读向量快照（多进程共享）
+多 worker 部署时，每个进程各自打开向量库会把同一份索引在内存里复制 N 份。
+这里把知识库全部块的归一化向量导出成一个 .npy 文件，各进程用 np.load(mmap_mode="r") 映射：
+- 只读映射走操作系统页缓存，N 个 worker 共享同一份物理内存，不会各自复制
+- 检索：一次矩阵乘法 + argpartition 取 top-k；块的文本与 metadata 从 BM25 索引（SQLite）按 id 取回
+- 快照按知识库版本命名，current.json 指向当前版本；先写数据文件、最后原子替换指针，
+  并发导出或读取时不会读到写了一半的文件；旧版本文件删除后，已映射它的进程仍可继续使用
+'''
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.Agent.vector_index import normalize_rows, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+POINTER_FILE = "current.json"
+
+
+class VectorSnapshot:
+    def __init__(self, version: str, ids: List[str], vectors: np.ndarray):
+        self.version = version
+        self.ids = ids
+        self.vectors = vectors  # (块数, 维度)，float32，已按行归一化；通常是只读内存映射
+        self._rows: Optional[Dict[str, int]] = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def memory_mapped(self) -> bool:
+        return isinstance(self.vectors, np.memmap)
+
+    def _row_index(self) -> Dict[str, int]:
+        # 只有按 id 子集检索（metadata 过滤）时才需要 id -> 行号
+        if self._rows is None:
+            self._rows = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return self._rows
+
+    def search(self, query_embedding, k: int, ids: Optional[Sequence[str]] = None
+               ) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """返回 (块id列表, 对应的向量, 余弦相似度)，按相似度降序；ids 不为 None 时只在这些块里检索"""
+        empty = ([], np.empty((0, self.vectors.shape[1]), dtype=np.float32), np.empty(0, dtype=np.float32))
+        if not len(self.ids) or k <= 0:
+            return empty
+        query_vec = normalize_rows(query_embedding)[0]
+        if ids is None:
+            rows = None
+            scores = np.asarray(self.vectors @ query_vec)
+        else:
+            row_index = self._row_index()
+            rows = np.fromiter((row_index[i] for i in ids if i in row_index), dtype=np.int64)
+            if not rows.size:
+                return empty
+            scores = np.asarray(self.vectors[rows] @ query_vec)
+        top = top_k_indices(scores, k)
+        picked = top if rows is None else rows[top]
+        # 只复制选中的 k 行，整块矩阵始终留在共享映射里
+        return [self.ids[i] for i in picked], np.array(self.vectors[picked]), scores[top]
+
+
+def _read_pointer(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, POINTER_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def pointer_stamp(directory: str) -> Optional[Tuple[int, int]]:
+    """current.json 的 (mtime_ns, inode)，用于低成本判断其他进程是否导出了新快照"""
+    try:
+        stat = os.stat(os.path.join(directory, POINTER_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino
+
+
+def snapshot_version(directory: str) -> Optional[str]:
+    pointer = _read_pointer(directory)
+    return pointer.get("version") if pointer else None
+
+
+def load_snapshot(directory: str, version: Optional[str] = None) -> Optional[VectorSnapshot]:
+    """映射当前快照；没有快照或版本不一致时返回 None"""
+    pointer = _read_pointer(directory)
+    if pointer is None or (version is not None and pointer.get("version") != version):
+        return None
+    try:
+        vectors = np.load(os.path.join(directory, pointer["vectors"]), mmap_mode="r")
+        with open(os.path.join(directory, pointer["ids"]), "r", encoding="utf-8") as f:
+            ids = json.load(f)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("向量快照无法加载：%s", e)
+        return None
+    if vectors.shape[0] != len(ids):
+        logger.warning("向量快照损坏：%s 行向量、%s 个id", vectors.shape[0], len(ids))
+        return None
+    return VectorSnapshot(pointer["version"], ids, vectors)
+
+
+def export_snapshot(directory: str, version: str, pages) -> int:
+    """
+    把 pages（可迭代的 (id列表, 向量列表) 分页）写成快照，返回块数
+    向量先写进一个按页扩展的临时文件，最后一次性写出 .npy，不需要把整个集合放进 Python 列表
+    """
+    os.makedirs(directory, exist_ok=True)
+    suffix = f"{version}.{os.getpid()}"
+    raw_path = os.path.join(directory, f"vectors-{suffix}.raw")
+    ids: List[str] = []
+    dim = None
+    try:
+        with open(raw_path, "wb") as raw:
+            for page_ids, page_vectors in pages:
+                if not len(page_ids):
+                    continue
+                matrix = normalize_rows(page_vectors)
+                dim = dim or matrix.shape[1]
+                raw.write(matrix.tobytes())
+                ids.extend(page_ids)
+        vectors_name = f"vectors-{version}.npy"
+        ids_name = f"ids-{version}.json"
+        vectors_tmp = os.path.join(directory, f"vectors-{suffix}.npy.tmp")
+        ids_tmp = os.path.join(directory, f"ids-{suffix}.json.tmp")
+        shape = (len(ids), dim or 0)
+        out = np.lib.format.open_memmap(vectors_tmp, mode="w+", dtype=np.float32, shape=shape)
+        if len(ids):
+            out[:] = np.memmap(raw_path, dtype=np.float32, mode="r", shape=shape)
+        out.flush()
+        del out
+        with open(ids_tmp, "w", encoding="utf-8") as f:
+            json.dump(ids, f, ensure_ascii=False)
+        os.replace(vectors_tmp, os.path.join(directory, vectors_name))
+        os.replace(ids_tmp, os.path.join(directory, ids_name))
+        pointer_tmp = os.path.join(directory, f"{POINTER_FILE}.{os.getpid()}.tmp")
+        with open(pointer_tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "vectors": vectors_name, "ids": ids_name,
+                       "count": len(ids), "dim": dim}, f)
+        os.replace(pointer_tmp, os.path.join(directory, POINTER_FILE))
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    _remove_stale(directory, keep={vectors_name, ids_name, POINTER_FILE})
+    return len(ids)
+
+
+def _remove_stale(directory: str, keep):
+    """删除旧版本的快照文件（Linux 上已映射旧文件的进程不受影响）；其他进程正在写的临时文件不动"""
+    for name in os.listdir(directory):
+        if name in keep or name.endswith(".tmp") or name.endswith(".raw"):
+            continue
+        if name.startswith(("vectors-", "ids-")):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
@@ -0,0 +1,143 @@
+'''
+知识库运行时入库任务
+原来知识库只能在服务启动时加载，新增文档必须重启。这里把入库做成后台任务：
+- 上传的文件先落到知识库目录，再提交任务，接口立即返回任务id
+- 任务在后台线程池里执行 解析 -> 清洗 -> 分割 -> 嵌入 -> 写入（复用引擎的 清单 + 写入器 路径）
+- 可查询状态与进度，可取消（排队中的任务直接取消；执行中的任务处理完当前文件后停止）
+'''
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class IngestJob:
+    def __init__(self, paths: List[str]):
+        self.job_id = uuid.uuid4().hex
+        self.paths = list(paths)
+        self.status = QUEUED
+        self.done_files: List[str] = []
+        self.chunks_written = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def to_dict(self) -> dict:
+        total = len(self.paths)
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "files": [os.path.basename(p) for p in self.paths],
+            "done_files": [os.path.basename(p) for p in self.done_files],
+            "progress": round(len(self.done_files) / total, 4) if total else 1.0,
+            "chunks_written": self.chunks_written,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestJobManager:
+    def __init__(self, engine, max_workers: int = 2, max_finished_jobs: int = 200):
+        self.engine = engine
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kb-ingest")
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, engine) -> "IngestJobManager":
+        return cls(
+            engine,
+            max_workers=int(os.getenv("KB_INGEST_WORKERS", "2")),
+            max_finished_jobs=int(os.getenv("KB_INGEST_MAX_JOBS", "200")),
+        )
+
+    def submit(self, paths: List[str]) -> IngestJob:
+        job = IngestJob(paths)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._evict_locked()
+        job.future = self._executor.submit(self._run, job)
+        logger.info("入库任务 %s 已提交：%s", job.job_id, [os.path.basename(p) for p in paths])
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[dict]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        """取消任务；任务不存在返回 None"""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            # 还在排队，直接取消
+            job.status = CANCELLED
+            job.finished_at = time.time()
+        return job
+
+    def _run(self, job: IngestJob):
+        if job.cancel_event.is_set():
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+
+        def on_file_done(path, ids):
+            job.done_files.append(path)
+            job.chunks_written += len(ids)
+
+        try:
+            self.engine.ingest_files(job.paths, on_file_done=on_file_done, should_cancel=job.cancel_event.is_set)
+            if job.cancel_event.is_set() and len(job.done_files) < len(job.paths):
+                job.status = CANCELLED
+            else:
+                job.status = SUCCEEDED
+        except Exception as e:
+            logger.exception("入库任务 %s 失败", job.job_id)
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            logger.info("入库任务 %s 结束：%s，%s 个块，用时 %.1fs", job.job_id, job.status,
+                        job.chunks_written, job.finished_at - job.started_at)
+
+    def _evict_locked(self):
+        """只保留最近 max_finished_jobs 个已结束任务的记录"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.status not in FINISHED_STATES:
+                job.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,249 @@
+'''
+向量库批量写入器
+把文档块按批发给嵌入接口并写入 Chroma：
+- batch_size 控制单次请求的文本条数
+- asyncio.Semaphore 控制并发批次数
+- 令牌桶限制每秒请求数，遇到 429 / 超时按指数退避重试
+- 每写完一批就记录检查点，导入中断后重启可以从断点继续
+'''
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+def run_coroutine_sync(coro):
+    """在同步代码里执行协程；如果当前线程已有事件循环（如 FastAPI lifespan），放到新线程里执行"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def runner():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:  # 把异常带回调用线程
+            result["error"] = e
+
+    thread = threading.Thread(target=runner, name="ingest-writer")
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result.get("value")
+
+
+def is_retryable_error(e: Exception) -> bool:
+    """限流（429）和超时类错误可以重试，其余错误直接抛出"""
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if status in (429, 500, 502, 503, 504):
+        return True
+    # 智谱接口限流时的业务错误码为 1302/1303
+    message = str(e).lower()
+    return any(word in message for word in ("429", "rate limit", "too many requests", "timeout", "timed out", "1302", "1303"))
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，允许 capacity 大小的突发"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class IngestCheckpoint:
+    """检查点：追加写入已完成的块id（JSON Lines），重启后跳过这些块"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done_ids: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self.done_ids.update(json.loads(line))
+
+    def mark(self, ids: List[str]):
+        self.done_ids.update(ids)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(ids) + "\n")
+
+    def clear(self):
+        self.done_ids.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class EmbeddingWriter:
+    def __init__(self, vectorstore, embeddings, *, batch_size: int = 32, max_concurrency: int = 4,
+                 requests_per_second: float = 5.0, max_retries: int = 6, base_delay: float = 1.0,
+                 max_delay: float = 60.0, checkpoint_path: Optional[str] = None):
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.checkpoint = IngestCheckpoint(checkpoint_path) if checkpoint_path else None
+
+    @classmethod
+    def from_env(cls, vectorstore, embeddings, checkpoint_path: Optional[str] = None):
+        """从环境变量读取写入参数，方便按供应商配额调整"""
+        return cls(
+            vectorstore,
+            embeddings,
+            batch_size=int(os.getenv("KB_EMBED_BATCH_SIZE", "32")),
+            max_concurrency=int(os.getenv("KB_EMBED_CONCURRENCY", "4")),
+            requests_per_second=float(os.getenv("KB_EMBED_RPS", "5")),
+            checkpoint_path=checkpoint_path,
+        )
+
+    def _already_written(self, ids: List[str]) -> Set[str]:
+        """检查点里记录过、并且确实还在库里的块id"""
+        if not self.checkpoint:
+            return set()
+        candidates = [i for i in ids if i in self.checkpoint.done_ids]
+        if not candidates:
+            return set()
+        existing = self.vectorstore._collection.get(ids=candidates, include=[])
+        return set(existing.get("ids", []))
+
+    async def _embed_with_retry(self, texts: List[str], bucket: TokenBucket) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            try:
+                return await self.embeddings.aembed_documents(texts)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                # 指数退避 + 随机抖动，避免并发批次同时重试
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt)) * (0.5 + random.random())
+                logger.warning(f"嵌入请求失败（第 {attempt + 1} 次）：{e}，{delay:.1f}s 后重试")
+                await asyncio.sleep(delay)
+
+    async def _write_batch(self, batch: List[Tuple[str, str, Document]], bucket: TokenBucket,
+                           semaphore: asyncio.Semaphore):
+        async with semaphore:
+            ids = [chunk_id for _, chunk_id, _ in batch]
+            docs = [doc for _, _, doc in batch]
+            vectors = await self._embed_with_retry([d.page_content for d in docs], bucket)
+            await asyncio.to_thread(
+                self.vectorstore._collection.upsert,
+                ids=ids,
+                embeddings=vectors,
+                documents=[d.page_content for d in docs],
+                metadatas=[d.metadata or None for d in docs],
+            )
+            if self.checkpoint:
+                self.checkpoint.mark(ids)
+        return batch
+
+    async def awrite_files(self, files: Iterable[Tuple[str, List[Document], List[str]]],
+                           on_file_done: Optional[Callable[[str, List[str]], None]] = None) -> int:
+        """
+        流式写入多个文件的文档块。
+
+        Args:
+            files: 产出 (文件路径, 文档块, 块id) 的可迭代对象，可以是边分割边产出的生成器
+            on_file_done: 某个文件的全部块写入成功后回调（用于更新清单）
+
+        Returns:
+            实际写入的块数量
+        """
+        bucket = TokenBucket(self.requests_per_second)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        remaining: Dict[str, int] = {}
+        file_ids: Dict[str, List[str]] = {}
+        tasks: Set[asyncio.Task] = set()
+        buffer: List[Tuple[str, str, Document]] = []
+        written = 0
+
+        def finish_batch(batch):
+            nonlocal written
+            written += len(batch)
+            for path, _, _ in batch:
+                remaining[path] -= 1
+                if remaining[path] == 0:
+                    remaining.pop(path)
+                    if on_file_done:
+                        on_file_done(path, file_ids.pop(path))
+
+        async def drain(limit: int):
+            # 在途批次超过上限时等待，形成背压，避免分割速度远快于嵌入速度时堆积内存
+            nonlocal tasks
+            while len(tasks) > limit:
+                finished, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    finish_batch(task.result())
+
+        def flush():
+            while len(buffer) >= self.batch_size:
+                batch = buffer[:self.batch_size]
+                del buffer[:self.batch_size]
+                tasks.add(asyncio.create_task(self._write_batch(batch, bucket, semaphore)))
+
+        iterator: Iterator = iter(files)
+        sentinel = object()
+        while True:
+            # 分割生成器可能阻塞（等待子进程），放到线程里取下一个
+            item = await asyncio.to_thread(next, iterator, sentinel)
+            if item is sentinel:
+                break
+            path, docs, ids = item
+            skip = await asyncio.to_thread(self._already_written, ids)
+            todo = [(path, chunk_id, doc) for chunk_id, doc in zip(ids, docs) if chunk_id not in skip]
+            file_ids[path] = list(ids)
+            if skip:
+                print(f"  ⏭️ {path}：检查点中已有 {len(skip)} 个块，跳过")
+            if not todo:
+                if on_file_done:
+                    on_file_done(path, file_ids.pop(path))
+                continue
+            remaining[path] = len(todo)
+            buffer.extend(todo)
+            flush()
+            await drain(self.max_concurrency * 2)
+
+        if buffer:
+            tasks.add(asyncio.create_task(self._write_batch(list(buffer), bucket, semaphore)))
+            buffer.clear()
+        await drain(0)
+
+        if self.checkpoint:
+            self.checkpoint.clear()
+        return written
+
+    def write_files(self, files, on_file_done=None) -> int:
+        """awrite_files 的同步入口"""
+        return run_coroutine_sync(self.awrite_files(files, on_file_done))
@@ -0,0 +1,165 @@
+'''
+知识库文件清单（manifest）
+记录每个知识库文件的 (路径, 修改时间, 大小, 内容哈希, 文档块id列表)，
+启动时与磁盘比对，只对新增/修改的文件重新分割入库，对已删除的文件删除其文档块。
+'''
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl  # 仅 POSIX；Windows 上只做进程内互斥
+except ImportError:
+    fcntl = None
+
+
+KB_SUPPORTED_EXTS = ('.pdf', '.md', '.txt')  # 知识库目录扫描与运行时入库支持的文件类型
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """流式计算文件内容哈希，大文件也不会一次读进内存"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def make_chunk_id(path: str, index: int, text: str) -> str:
+    """文档块id：由文件路径、块序号、块内容共同决定，同一内容重复入库时id不变"""
+    digest = hashlib.sha1(f"{os.path.normpath(path)}\x00{index}\x00{text}".encode("utf-8")).hexdigest()
+    return f"kb-{digest[:24]}"
+
+
+class InterProcessLock:
+    """
+    知识库写锁：fcntl.flock 做跨进程互斥（多个 worker 共用同一个持久化目录），
+    同一线程内可重入（启动同步里会再调用入库、快照导出），不同线程之间互斥
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    @property
+    def depth(self) -> int:
+        """当前线程持有的层数（只在持有锁时有意义）"""
+        return self._depth
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+                self._file = open(self.lock_path, "a+")
+                if fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_EX)
+            except Exception:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._rlock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._rlock.release()
+        return False
+
+
+class KnowledgeBaseManifest:
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.entries: Dict[str, dict] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.manifest_path):
+            self.entries = {}
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+        except Exception as e:
+            # 清单损坏时当作首次建库处理，后续同步会按 source 清理旧块
+            logger.warning(f"知识库清单读取失败，将重新全量同步: {e}")
+            self.entries = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        # 临时文件名带进程号：多个 worker 同时保存时不会互相覆盖临时文件
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.entries}, f, ensure_ascii=False, indent=2)
+        # 先写临时文件再替换，避免写到一半进程退出导致清单损坏
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_empty(self) -> bool:
+        return not self.entries
+
+    def diff(self, files: List[str]) -> Tuple[List[str], List[str]]:
+        """与磁盘比对，返回 (需要重新入库的文件, 已被删除的文件)"""
+        changed = []
+        current = set()
+        for path in files:
+            key = os.path.normpath(path)
+            current.add(key)
+            stat = os.stat(path)
+            entry = self.entries.get(key)
+            # 快速路径：修改时间和大小都没变，认为内容没变，不计算哈希
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+            content_hash = file_sha256(path)
+            if entry and entry["hash"] == content_hash:
+                # 只是被 touch 过，内容没变：刷新时间戳即可
+                entry["mtime"] = stat.st_mtime
+                entry["size"] = stat.st_size
+                continue
+            changed.append(path)
+        removed = [key for key in self.entries if key not in current]
+        return changed, removed
+
+    def reload(self):
+        """从磁盘重新读取（其他进程可能已经更新了清单）"""
+        self._load()
+
+    def chunk_ids(self, path: str) -> List[str]:
+        entry = self.entries.get(os.path.normpath(path))
+        return list(entry["chunk_ids"]) if entry else []
+
+    def update(self, path: str, chunk_ids: List[str]):
+        stat = os.stat(path)
+        self.entries[os.path.normpath(path)] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "hash": file_sha256(path),
+            "chunk_ids": list(chunk_ids),
+        }
+
+    def remove(self, path: str):
+        self.entries.pop(os.path.normpath(path), None)
+
+    def clear(self):
+        self.entries = {}
+
+    def version(self) -> str:
+        """知识库版本号：所有文件路径与内容哈希的摘要，任一文件增删改都会变化"""
+        h = hashlib.sha1()
+        for path in sorted(self.entries):
+            h.update(f"{path}\x00{self.entries[path]['hash']}\n".encode("utf-8"))
+        return h.hexdigest()[:16]
@@ -1,23 +1,187 @@
 #记忆类
 '''
 创建一个对话记忆类   封装获取  清空 添加 存储对话的方法
+可选 max_messages / max_tokens：超出时从最早的消息开始丢弃（环形缓冲），
+保证发给 LLM 的历史长度不会随对话轮数无限增长
+可选 compact_threshold：历史超过该 token 数时先“压缩”而不是直接丢弃：
+  1. 旧消息里的上传文件原文折叠成附件句柄（原文保存在 attachments 中，客户端可通过 /attachments 接口取回）
+  2. 仍然超出时，把较早的轮次合并进一段增量维护的摘要（最近归档的原始消息保留在 archived 中）
+  attachments、archived 都有条数上限，长会话里不会无限增长
+  摘要可能调用 LLM，调用期间不持有记忆的锁，新消息可以照常写入
 '''
+import hashlib
+import re
+import threading
+from collections import OrderedDict, deque
+
+from src.Agent.token_utils import estimate_tokens, truncate_to_tokens
+
+# /ask 构造的带文件消息格式：用户上传了文件，内容如下：\n{file_text}\n\n用户问题：{question}
+FILE_PAYLOAD_PATTERN = re.compile(r"用户上传了文件，内容如下：\n(.*?)\n\n用户问题：", re.S)
+
+
+def simple_summarizer(existing_summary, messages, max_tokens=600):
+    """不调用 LLM 的摘要：每条消息保留开头一段，追加到已有摘要后，超出预算时保留最新部分"""
+    lines = [existing_summary] if existing_summary else []
+    for msg in messages:
+        content = re.sub(r"\s+", " ", msg["content"]).strip()
+        lines.append(f"{msg['role']}: {content[:80]}{'…' if len(content) > 80 else ''}")
+    summary = "\n".join(lines)
+    if estimate_tokens(summary) > max_tokens:
+        # 从尾部截取：把文本反转后截断再反转回来
+        summary = truncate_to_tokens(summary[::-1], max_tokens)[::-1]
+    return summary
+
+
+def make_llm_summarizer(llm, max_chars=400):
+    """用 LLM 增量维护摘要：在已有摘要基础上合并新的对话轮次"""
+    def summarize(existing_summary, messages):
+        dialogue = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = (
+            f"下面是一段简历助手对话的已有摘要和新增的对话内容。请把新增内容合并进摘要，"
+            f"保留用户的目标岗位、简历关键事实、已确定的修改意见和未完成的需求，不超过{max_chars}字。\n\n"
+            f"【已有摘要】\n{existing_summary or '（无）'}\n\n【新增对话】\n{dialogue}\n\n【更新后的摘要】"
+        )
+        try:
+            return llm.invoke(prompt).content.strip()
+        except Exception:
+            # LLM 不可用时退回到截断式摘要，保证压缩一定能完成
+            return simple_summarizer(existing_summary, messages)
+    return summarize
+
+
 class ConversationMemory:
-    def __init__(self):
+    def __init__(self, max_messages=None, max_tokens=None, compact_threshold=None,
+                 summarizer=None, keep_recent=4, fold_min_chars=500, max_attachments=8, max_archived=100):
         self.memoryList = [] #初始化一个空对话列表
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self._token_counts = []  # 与 memoryList 一一对应的 token 数
+        self.total_tokens = 0
 
-#添加消息
-    def add_to_memory(self,role,content):
+        # 压缩策略
+        self.compact_threshold = compact_threshold
+        self.summarizer = summarizer or simple_summarizer
+        self.keep_recent = keep_recent          # 压缩时至少保留最近几条原始消息
+        self.fold_min_chars = fold_min_chars    # 文件原文超过该长度才折叠
+        self.summary = ""                       # 增量维护的历史摘要
+        self.summarized_through = 0             # 摘要覆盖到的最新消息id（消息带持久层id时）
+        self.max_attachments = max_attachments
+        self.attachments = OrderedDict()        # 附件id -> 上传文件原文（LRU，最多 max_attachments 个）
+        self.archived = deque(maxlen=max_archived)  # 最近被合并进摘要的原始消息
+        self._lock = threading.RLock()          # 保护消息列表与 token 计数
+        self._compact_lock = threading.Lock()   # 同一时间只做一次压缩
+        self._generation = 0                    # clearList 时递增，丢弃清空前开始的压缩结果
+
+#添加消息（compact=True 时超出阈值先压缩，再按窗口兜底丢弃）
+    def add_to_memory(self,role,content,compact=True,message_id=None):
         message = {'role':role, 'content':content}
-        self.memoryList.append(message)
+        if message_id is not None:
+            message['id'] = message_id  # 持久层消息id，用于记录摘要覆盖到哪一条
+        tokens = estimate_tokens(content)
+        with self._lock:
+            self.memoryList.append(message)
+            self._token_counts.append(tokens)
+            self.total_tokens += tokens
+        if compact and self.needs_compaction():
+            self.compact()
+        with self._lock:
+            self._trim()
+
+#超出窗口时丢弃最早的消息（至少保留最新一条）
+    def _trim(self):
+        while len(self.memoryList) > 1 and (
+            (self.max_messages is not None and len(self.memoryList) > self.max_messages)
+            or (self.max_tokens is not None and self.total_tokens > self.max_tokens)
+        ):
+            self.memoryList.pop(0)
+            self.total_tokens -= self._token_counts.pop(0)
+
+    def _set_content(self, index, content):
+        self.memoryList[index] = {**self.memoryList[index], 'content': content}
+        tokens = estimate_tokens(content)
+        self.total_tokens += tokens - self._token_counts[index]
+        self._token_counts[index] = tokens
+
+#是否需要压缩
+    def needs_compaction(self):
+        return self.compact_threshold is not None and self.total_tokens > self.compact_threshold
+
+#压缩历史：先折叠文件原文，仍超出阈值再把较早的轮次合并进摘要
+    def compact(self):
+        with self._compact_lock:
+            with self._lock:
+                if not self.needs_compaction():
+                    return
+                # 1. 折叠除最新一条以外消息里的文件原文
+                for i in range(len(self.memoryList) - 1):
+                    folded = self._fold_file_payload(self.memoryList[i]['content'])
+                    if folded is not None:
+                        self._set_content(i, folded)
+                if not self.needs_compaction():
+                    return
+
+                # 2. 合并较早的轮次进摘要，只保留最近 keep_recent 条
+                cut = len(self.memoryList) - self.keep_recent
+                if cut <= 0:
+                    return
+                old_messages = self.memoryList[:cut]
+                summary = self.summary
+                generation = self._generation
+            # 生成摘要可能要调用 LLM：不持有锁，期间新消息可以照常写入
+            new_summary = self.summarizer(summary, old_messages)
+            with self._lock:
+                if generation != self._generation:
+                    return
+                # 摘要期间窗口可能已经丢弃了其中一部分，只删除仍在列表头部的那些
+                old_ids = {id(message) for message in old_messages}
+                drop = 0
+                while drop < len(self.memoryList) and id(self.memoryList[drop]) in old_ids:
+                    drop += 1
+                self.summary = new_summary
+                self.summarized_through = max(
+                    [self.summarized_through] + [message['id'] for message in old_messages if 'id' in message])
+                self.archived.extend(old_messages)
+                del self.memoryList[:drop]
+                self.total_tokens -= sum(self._token_counts[:drop])
+                del self._token_counts[:drop]
+
+    def _fold_file_payload(self, content):
+        """把消息中的上传文件原文替换成附件句柄；没有可折叠内容时返回 None"""
+        match = FILE_PAYLOAD_PATTERN.search(content)
+        if not match or len(match.group(1)) < self.fold_min_chars:
+            return None
+        file_text = match.group(1)
+        attachment_id = hashlib.sha1(file_text.encode("utf-8")).hexdigest()[:12]
+        self.attachments[attachment_id] = file_text
+        self.attachments.move_to_end(attachment_id)
+        while len(self.attachments) > self.max_attachments:
+            self.attachments.popitem(last=False)
+        handle = f"用户上传了文件（附件#{attachment_id}，共{len(file_text)}字，原文已从对话历史中移除，需要原文时请用户重新上传）\n\n用户问题："
+        return content[:match.start()] + handle + content[match.end():]
+
+#按附件id取回上传文件原文
+    def get_attachment(self, attachment_id):
+        return self.attachments.get(attachment_id)
 
 #清空消息列表
     def clearList(self):
-        self.memoryList.clear()
+        with self._lock:
+            self.memoryList.clear()
+            self._token_counts.clear()
+            self.total_tokens = 0
+            self.summary = ""
+            self.summarized_through = 0
+            self.attachments.clear()
+            self.archived.clear()
+            self._generation += 1
 
-#获取消息列表
+#获取消息列表（有摘要时放在最前面，作为一条 system 消息）
     def getAllMemoryList(self):
-        return self.memoryList.copy()
+        with self._lock:
+            if self.summary:
+                return [{'role': 'system', 'content': f"【此前对话摘要】\n{self.summary}"}] + self.memoryList.copy()
+            return self.memoryList.copy()
 
 #获取最近N条消息
     def getLastMemoryList(self,n):
@@ -41,4 +205,4 @@ class ConversationMemory:
         #用推导式获取列表中消息内容   新列表 = [对元素的操作 for 元素 in 可迭代对象 if 条件]  if可选
         role_content = [msg['content'] for msg in recent_messageList if msg['role']=='user']
 
-        return role_content
\ No newline at end of file
+        return role_content
@@ -0,0 +1,121 @@
+'''
+检索结果缓存（两级）
+1. 精确缓存：规范化后的问题 + k + search_type 完全相同，直接返回上次的上下文
+2. 语义缓存：问题向量与历史问题的余弦相似度超过阈值（如“STAR法则是什么” / “star法则是什么？”），复用上次的上下文
+条目带 TTL 和数量上限（LRU），并绑定知识库版本，知识库一变旧条目全部失效。
+'''
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from src.Agent.embedding_cache import normalize_text
+
+
+class _Entry:
+    __slots__ = ("vector", "params", "kb_version", "created", "value")
+
+    def __init__(self, vector, params, kb_version, value):
+        self.vector = vector
+        self.params = params
+        self.kb_version = kb_version
+        self.created = time.time()
+        self.value = value
+
+
+class QueryResultCache:
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 600.0, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._kb_version = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(question: str, params: Tuple[Hashable, ...]) -> Tuple:
+        return (normalize_text(question).lower(),) + tuple(params)
+
+    def _check_version_locked(self, kb_version):
+        # 知识库版本变化：整体清空，避免返回旧知识
+        if kb_version != self._kb_version:
+            self._entries.clear()
+            self._kb_version = kb_version
+
+    def _alive(self, entry: _Entry, now: float) -> bool:
+        return now - entry.created <= self.ttl_seconds
+
+    def get_exact(self, question: str, params: Tuple, kb_version) -> Optional[str]:
+        key = self._key(question, params)
+        now = time.time()
+        with self._lock:
+            self._check_version_locked(kb_version)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self._alive(entry, now):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry.value
+
+    def get_semantic(self, query_vector: List[float], params: Tuple, kb_version) -> Optional[str]:
+        """在参数相同的条目中找余弦相似度最高的历史问题，超过阈值则复用"""
+        vector = self._normalize(query_vector)
+        now = time.time()
+        with self._lock:
+            self._check_version_locked(kb_version)
+            keys, matrix = [], []
+            for key, entry in list(self._entries.items()):
+                if not self._alive(entry, now):
+                    del self._entries[key]
+                    continue
+                if entry.params == tuple(params) and entry.vector is not None:
+                    keys.append(key)
+                    matrix.append(entry.vector)
+            if keys:
+                scores = np.stack(matrix) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.semantic_hits += 1
+                    return self._entries[keys[best]].value
+            self.misses += 1
+            return None
+
+    def put(self, question: str, query_vector: Optional[List[float]], params: Tuple, kb_version, value: str):
+        key = self._key(question, params)
+        vector = self._normalize(query_vector) if query_vector is not None else None
+        with self._lock:
+            self._check_version_locked(kb_version)
+            self._entries[key] = _Entry(vector, tuple(params), kb_version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def stats(self) -> Dict[str, float]:
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / total, 4) if total else 0.0,
+        }
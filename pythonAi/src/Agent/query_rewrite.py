@@ -0,0 +1,78 @@
+'''
+问题改写（MultiQuery）缓存
+MultiQueryRetriever 每次都要调用一次 LLM 生成多个改写问题，耗时数秒。
+这里按规范化后的问题做 LRU 缓存，相同问题第二次起直接复用改写结果。
+'''
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from langchain_classic.retrievers import MultiQueryRetriever
+
+from src.Agent.embedding_cache import normalize_text
+
+
+class RewriteCache:
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return normalize_text(question).lower()
+
+    def get(self, question: str) -> Optional[List[str]]:
+        key = self._key(question)
+        with self._lock:
+            queries = self._items.get(key)
+            if queries is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            # 返回副本：MultiQueryRetriever 会在列表末尾追加原问题
+            return list(queries)
+
+    def put(self, question: str, queries: List[str]):
+        with self._lock:
+            self._items[self._key(question)] = list(queries)
+            self._items.move_to_end(self._key(question))
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class CachedMultiQueryRetriever(MultiQueryRetriever):
+    """生成改写问题前先查 RewriteCache，其余行为与 MultiQueryRetriever 一致"""
+
+    rewrite_cache: Any = None
+
+    def generate_queries(self, question, run_manager):
+        cached = self.rewrite_cache.get(question) if self.rewrite_cache is not None else None
+        if cached is not None:
+            return cached
+        queries = super().generate_queries(question, run_manager)
+        if self.rewrite_cache is not None and queries:
+            self.rewrite_cache.put(question, queries)
+        return list(queries)
+
+    async def agenerate_queries(self, question, run_manager):
+        cached = self.rewrite_cache.get(question) if self.rewrite_cache is not None else None
+        if cached is not None:
+            return cached
+        queries = await super().agenerate_queries(question, run_manager)
+        if self.rewrite_cache is not None and queries:
+            self.rewrite_cache.put(question, queries)
+        return list(queries)
@@ -0,0 +1,353 @@
+'''
+交叉编码器重排服务（FlashRank，ms-marco-MiniLM-L-12-v2）
+RAGPipeline 里每个查询都单独调用一次 FlashrankRerank，并发请求之间什么也不共享。
+这里把重排做成进程内共享的服务：
+- 模型只在启动时加载一次（flashrank 为可选依赖，未安装时重排自动关闭）
+- 后台线程做微批处理：并发请求的 (问题, 文档块) 对在 max_wait_ms 内攒成一批，一次 ONNX 推理
+- (问题, 文档块) 分数做 LRU 缓存，同一问题/同一批块再次出现时不再推理
+- 可设置 ONNX Runtime 的 CPU 线程数
+- 延迟预算：超过 latency_budget_ms 还没拿到分数时直接返回原检索顺序，不让重排拖慢请求
+'''
+
+import asyncio
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+
+from src.Agent.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RERANK_MODEL = "ms-marco-MiniLM-L-12-v2"
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()[:16]
+
+
+class _Request:
+    __slots__ = ("pairs", "keys", "future")
+
+    def __init__(self, pairs, keys):
+        self.pairs = pairs      # [(问题, 文档块文本)]
+        self.keys = keys        # 与 pairs 一一对应的缓存键
+        self.future = Future()
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, num_threads: int = 0,
+                 max_batch_pairs: int = 64, max_wait_ms: float = 5.0, cache_size: int = 4096,
+                 latency_budget_ms: float = 300.0, max_length: int = 512, cache_dir: Optional[str] = None):
+        self.model_name = model_name
+        self.num_threads = num_threads          # 0 表示使用 ONNX Runtime 默认线程数
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait_ms / 1000.0
+        self.cache_size = cache_size
+        self.latency_budget = latency_budget_ms / 1000.0
+        self.max_length = max_length
+        self.cache_dir = cache_dir
+        self._ranker = None
+        self._load_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.scored_pairs = 0
+        self.budget_fallbacks = 0
+
+    @classmethod
+    def from_env(cls) -> "CrossEncoderReranker":
+        return cls(
+            model_name=os.getenv("RAG_RERANK_MODEL", DEFAULT_RERANK_MODEL),
+            num_threads=int(os.getenv("RAG_RERANK_THREADS", "0")),
+            max_batch_pairs=int(os.getenv("RAG_RERANK_BATCH", "64")),
+            max_wait_ms=float(os.getenv("RAG_RERANK_WAIT_MS", "5")),
+            cache_size=int(os.getenv("RAG_RERANK_CACHE_SIZE", "4096")),
+            latency_budget_ms=float(os.getenv("RAG_RERANK_BUDGET_MS", "300")),
+            cache_dir=os.getenv("RAG_RERANK_CACHE_DIR") or None,
+        )
+
+    # ---------- 模型加载 ----------
+    def load(self) -> "CrossEncoderReranker":
+        """加载模型并启动微批线程（只执行一次）；flashrank 未安装时抛 ImportError"""
+        with self._load_lock:
+            if self._ranker is not None:
+                return self
+            from flashrank import Ranker  # 可选依赖，用到时才导入
+
+            kwargs = {"model_name": self.model_name, "max_length": self.max_length}
+            if self.cache_dir:
+                kwargs["cache_dir"] = self.cache_dir
+            ranker = Ranker(**kwargs)
+            if self.num_threads > 0:
+                self._set_thread_count(ranker)
+            self._ranker = ranker
+            self._worker = threading.Thread(target=self._worker_loop, name="rerank-batcher", daemon=True)
+            self._worker.start()
+            logger.info("重排模型 %s 已加载（线程数=%s）", self.model_name, self.num_threads or "默认")
+        return self
+
+    @property
+    def loaded(self) -> bool:
+        return self._ranker is not None
+
+    def _set_thread_count(self, ranker):
+        """flashrank 不暴露 SessionOptions，这里用相同的模型文件按指定线程数重建推理会话"""
+        try:
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.num_threads
+            options.inter_op_num_threads = 1
+            ranker.session = ort.InferenceSession(ranker.session._model_path, options)
+        except Exception as e:
+            logger.warning("设置重排线程数失败，使用默认线程数：%s", e)
+
+    # ---------- 推理 ----------
+    def _score_pairs(self, pairs: Sequence[Tuple[str, str]]) -> List[float]:
+        """对一批 (问题, 文档块) 打分，问题可以各不相同（与 flashrank 的成对模型推理一致）"""
+        ranker = self._ranker
+        session = getattr(ranker, "session", None)
+        tokenizer = getattr(ranker, "tokenizer", None)
+        if session is None or tokenizer is None:
+            return self._score_pairs_by_query(pairs)
+        encodings = tokenizer.encode_batch([list(pair) for pair in pairs])
+        onnx_input = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+        }
+        token_type_ids = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        if not np.all(token_type_ids == 0):
+            onnx_input["token_type_ids"] = token_type_ids
+        logits = session.run(None, onnx_input)[0]
+        if logits.shape[1] == 1:
+            scores = 1.0 / (1.0 + np.exp(-logits.flatten()))
+        else:
+            exp_logits = np.exp(logits)
+            scores = exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+        return scores.astype(float).tolist()
+
+    def _score_pairs_by_query(self, pairs):
+        """非成对模型（如列表式 LLM 重排）只能按问题分组调用 rerank"""
+        from flashrank import RerankRequest
+
+        by_query: Dict[str, List[int]] = {}
+        for i, (query, _) in enumerate(pairs):
+            by_query.setdefault(query, []).append(i)
+        scores = [0.0] * len(pairs)
+        for query, indices in by_query.items():
+            passages = [{"id": i, "text": pairs[i][1]} for i in indices]
+            for item in self._ranker.rerank(RerankRequest(query=query, passages=passages)):
+                scores[item["id"]] = float(item["score"])
+        return scores
+
+    def _worker_loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            n_pairs = len(first.pairs)
+            deadline = time.monotonic() + self.max_wait
+            # 在 max_wait 内继续收集其他请求，直到凑满一批
+            while n_pairs < self.max_batch_pairs:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+                n_pairs += len(item.pairs)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[_Request]):
+        # 同一批里重复的 (问题, 块) 只推理一次
+        unique: "OrderedDict[Tuple[str, str], Tuple[str, str]]" = OrderedDict()
+        for request in batch:
+            for key, pair in zip(request.keys, request.pairs):
+                unique.setdefault(key, pair)
+        keys = list(unique)
+        try:
+            scores: Dict[Tuple[str, str], float] = {}
+            for start in range(0, len(keys), self.max_batch_pairs):
+                chunk = keys[start:start + self.max_batch_pairs]
+                scores.update(zip(chunk, self._score_pairs([unique[key] for key in chunk])))
+                self.batches += 1
+            self.scored_pairs += len(keys)
+            self._cache_put(scores)
+        except Exception as e:
+            logger.warning("重排推理失败：%s", e)
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        for request in batch:
+            if not request.future.done():
+                request.future.set_result([scores[key] for key in request.keys])
+
+    # ---------- 缓存 ----------
+    def _cache_lookup(self, keys) -> List[Optional[float]]:
+        with self._cache_lock:
+            found = []
+            for key in keys:
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                found.append(score)
+            hits = sum(score is not None for score in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return found
+
+    def _cache_put(self, scores: Dict[Tuple[str, str], float]):
+        with self._cache_lock:
+            for key, score in scores.items():
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---------- 对外接口 ----------
+    def _submit(self, query: str, texts: Sequence[str]):
+        """返回 (分数列表, 未命中缓存的请求)；全部命中时请求为 None"""
+        query_key = _text_key(query)
+        keys = [(query_key, _text_key(text)) for text in texts]
+        scores = self._cache_lookup(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if not missing:
+            return scores, None, missing
+        request = _Request([(query, texts[i]) for i in missing], [keys[i] for i in missing])
+        self._queue.put(request)
+        return scores, request, missing
+
+    def score(self, query: str, texts: Sequence[str], timeout: Optional[float] = None) -> Optional[List[float]]:
+        """对文档块打分；超过延迟预算时返回 None（已提交的推理仍会完成并写入缓存）"""
+        if not texts:
+            return []
+        scores, request, missing = self._submit(query, list(texts))
+        if request is not None:
+            try:
+                fresh = request.future.result(timeout=self.latency_budget if timeout is None else timeout)
+            except FutureTimeoutError:
+                self.budget_fallbacks += 1
+                return None
+            for i, score in zip(missing, fresh):
+                scores[i] = score
+        return scores
+
+    async def ascore(self, query: str, texts: Sequence[str], timeout: Optional[float] = None) -> Optional[List[float]]:
+        if not texts:
+            return []
+        scores, request, missing = self._submit(query, list(texts))
+        if request is not None:
+            try:
+                # shield：超时只放弃等待，不取消已经进入批次的推理
+                fresh = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(request.future)),
+                    self.latency_budget if timeout is None else timeout,
+                )
+            except asyncio.TimeoutError:
+                self.budget_fallbacks += 1
+                return None
+            for i, score in zip(missing, fresh):
+                scores[i] = score
+        return scores
+
+    @staticmethod
+    def _order(docs: Sequence[Document], scores: Optional[List[float]], top_n: int) -> List[Document]:
+        if scores is None:
+            # 超出延迟预算：保持原检索顺序
+            return list(docs[:top_n])
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:top_n]
+        return [docs[i] for i in order]
+
+    def rerank(self, query: str, docs: Sequence[Document], top_n: int = 4,
+               timeout: Optional[float] = None) -> List[Document]:
+        try:
+            scores = self.score(query, [d.page_content for d in docs], timeout)
+        except Exception:
+            scores = None
+        return self._order(docs, scores, top_n)
+
+    async def arerank(self, query: str, docs: Sequence[Document], top_n: int = 4,
+                      timeout: Optional[float] = None) -> List[Document]:
+        try:
+            scores = await self.ascore(query, [d.page_content for d in docs], timeout)
+        except Exception:
+            scores = None
+        return self._order(docs, scores, top_n)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "loaded": self.loaded,
+            "cache_entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "batches": self.batches,
+            "avg_batch_pairs": round(self.scored_pairs / self.batches, 2) if self.batches else 0.0,
+            "budget_fallbacks": self.budget_fallbacks,
+        }
+
+    def close(self):
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout=5)
+            self._worker = None
+
+
+class RerankCompressor(BaseDocumentCompressor):
+    """把共享的 CrossEncoderReranker 包装成 LangChain 文档压缩器，可替换 FlashrankRerank"""
+
+    reranker: CrossEncoderReranker
+    top_n: int = 4
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def compress_documents(self, documents: Sequence[Document], query: str,
+                           callbacks: Callbacks = None) -> Sequence[Document]:
+        return self.reranker.rerank(query, documents, self.top_n)
+
+    async def acompress_documents(self, documents: Sequence[Document], query: str,
+                                  callbacks: Callbacks = None) -> Sequence[Document]:
+        return await self.reranker.arerank(query, documents, self.top_n)
+
+
+_shared_reranker: Optional[CrossEncoderReranker] = None
+_shared_failed = False
+_shared_lock = threading.Lock()
+
+
+def get_reranker() -> Optional[CrossEncoderReranker]:
+    """进程内共享的重排服务；第一次调用时加载模型，flashrank 不可用时返回 None"""
+    global _shared_reranker, _shared_failed
+    with _shared_lock:
+        if _shared_reranker is None and not _shared_failed:
+            try:
+                _shared_reranker = CrossEncoderReranker.from_env().load()
+            except Exception as e:
+                logger.warning("重排模型不可用，检索结果不做重排：%s", e)
+                _shared_failed = True
+        return _shared_reranker
@@ -0,0 +1,362 @@
+'''
+按会话管理对话记忆
+- 每个会话一个有 token 预算的 ConversationMemory（超出预算丢弃最早的消息）
+- 超过压缩阈值时先折叠上传文件原文、把较早的轮次合并成摘要，预算只作为兜底；
+  压缩（可能调用 LLM）在回答之后由后台任务执行，不占用提问的响应时间
+- 长时间不活跃的会话从内存中淘汰，内存中的会话数有上限（LRU）
+- 可选 SQLite 持久层：淘汰或重启后，会话历史按预算从数据库恢复
+- 多 worker 部署（shared=True）：同一会话的请求可能落到不同进程，取会话时比对持久层里的最新消息id，
+  其他进程写入过新消息就从持久层重新加载
+- 持久层同时保存上传文件文本（按上传id）与折叠的附件原文（按会话+附件id），
+  后续请求落到没有进程内副本的 worker 时从这里取回
+- 压缩后的摘要及其覆盖到的最新消息id也写入持久层（session_state）：重新加载会话时恢复摘要与附件，
+  只加载摘要之后的原始消息，换 worker 不会丢掉已压缩的历史
+'''
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from src.Agent.memory import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteSessionStore:
+    """会话消息持久层：只追加写入，按会话读取最近的消息"""
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._connect()
+
+    def _connect(self):
+        # 连接不能跨 fork 使用：gunicorn preload 时模块在主进程导入，worker 里第一次用到时按进程号重连
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " upload_id TEXT PRIMARY KEY,"
+            " filename TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " file_hash TEXT,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_file_hash ON uploads(file_hash)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS attachments ("
+            " session_id TEXT NOT NULL,"
+            " attachment_id TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " PRIMARY KEY (session_id, attachment_id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_state ("
+            " session_id TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " summarized_through INTEGER NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._connect()
+        return self._conn
+
+    def append(self, session_id: str, role: str, content: str) -> int:
+        """写入一条消息，返回消息id"""
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT INTO messages (session_id, role, content, created) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, time.time()),
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    def last_id(self, session_id: str) -> int:
+        """会话最新一条消息的id（没有消息时为 0）"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT MAX(id) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] or 0
+
+    def load_recent(self, session_id: str, limit: int, after_id: int = 0):
+        """最近 limit 条消息 [(id, role, content)]，只取 id 大于 after_id 的（摘要已覆盖的不再加载）"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+                (session_id, after_id, limit),
+            ).fetchall()
+        return list(reversed(rows))
+
+    def save_state(self, session_id: str, summary: str, summarized_through: int):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO session_state (session_id, summary, summarized_through, updated)"
+                " VALUES (?, ?, ?, ?)",
+                (session_id, summary, summarized_through, time.time()),
+            )
+            conn.commit()
+
+    def load_state(self, session_id: str):
+        """返回 (摘要, 摘要覆盖到的消息id)；没有压缩过时返回 ("", 0)"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT summary, summarized_through FROM session_state WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM attachments WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+            conn.commit()
+
+    # ---------- 上传文件（多 worker 共用，按上传id） ----------
+    def save_upload(self, upload_id: str, filename: str, text: str, file_hash: Optional[str] = None,
+                    ttl_seconds: Optional[float] = None):
+        """保存上传文件文本；顺带清理超过 ttl_seconds 未访问的上传"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (upload_id, filename, text, file_hash, last_access) VALUES (?, ?, ?, ?, ?)",
+                (upload_id, filename or "", text, file_hash, now),
+            )
+            if ttl_seconds is not None:
+                conn.execute("DELETE FROM uploads WHERE last_access < ?", (now - ttl_seconds,))
+            conn.commit()
+
+    def load_upload(self, upload_id: str, ttl_seconds: Optional[float] = None):
+        """返回 (文件名, 文本, 文件哈希)；不存在或已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT filename, text, file_hash, last_access FROM uploads WHERE upload_id = ?", (upload_id,)
+            ).fetchone()
+            if row is None or (ttl_seconds is not None and now - row[3] > ttl_seconds):
+                return None
+            conn.execute("UPDATE uploads SET last_access = ? WHERE upload_id = ?", (now, upload_id))
+            conn.commit()
+        return row[0], row[1], row[2]
+
+    def find_upload_by_hash(self, file_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT upload_id FROM uploads WHERE file_hash = ? ORDER BY last_access DESC LIMIT 1", (file_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    # ---------- 折叠的附件原文（按会话） ----------
+    def save_attachments(self, session_id: str, attachments: dict, keep: int):
+        """写入会话的附件（已存在的不重复写），每个会话只保留最近 keep 个"""
+        if not attachments:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR IGNORE INTO attachments (session_id, attachment_id, text, created) VALUES (?, ?, ?, ?)",
+                [(session_id, attachment_id, text, now) for attachment_id, text in attachments.items()],
+            )
+            conn.execute(
+                "DELETE FROM attachments WHERE session_id = ? AND attachment_id NOT IN ("
+                " SELECT attachment_id FROM attachments WHERE session_id = ? ORDER BY created DESC LIMIT ?)",
+                (session_id, session_id, keep),
+            )
+            conn.commit()
+
+    def load_attachments(self, session_id: str) -> dict:
+        """会话的全部附件 {附件id: 原文}，按写入先后排列"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT attachment_id, text FROM attachments WHERE session_id = ? ORDER BY created", (session_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def load_attachment(self, session_id: str, attachment_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT text FROM attachments WHERE session_id = ? AND attachment_id = ?", (session_id, attachment_id)
+            ).fetchone()
+        return row[0] if row else None
+
+
+class SessionMemoryManager:
+    def __init__(self, max_tokens: int = 6000, max_messages: int = 40, idle_ttl: float = 1800.0,
+                 max_sessions: int = 1000, db_path: Optional[str] = None,
+                 compact_threshold: Optional[int] = 3000, summarizer: Optional[Callable] = None,
+                 shared: bool = False):
+        self.max_tokens = max_tokens
+        self.compact_threshold = compact_threshold
+        self.summarizer = summarizer  # 为 None 时用不调用 LLM 的截断式摘要
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.store = SQLiteSessionStore(db_path) if db_path else None
+        self.shared = shared and self.store is not None  # 持久层被多个进程共用
+        self._sessions: "OrderedDict[str, ConversationMemory]" = OrderedDict()
+        self._last_access = {}
+        self._synced_ids = {}  # 会话 -> 内存中的记忆已包含的最新消息id（shared 模式）
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self._compaction_tasks = set()  # 持有后台压缩任务的引用，避免被垃圾回收
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取配置；设置 SESSION_DB_PATH 时启用 SQLite 持久层，SESSION_SHARED=1 表示多进程共用"""
+        return cls(
+            max_tokens=int(os.getenv("SESSION_MAX_TOKENS", "6000")),
+            max_messages=int(os.getenv("SESSION_MAX_MESSAGES", "40")),
+            idle_ttl=float(os.getenv("SESSION_IDLE_TTL", "1800")),
+            max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "1000")),
+            db_path=os.getenv("SESSION_DB_PATH") or None,
+            compact_threshold=int(os.getenv("SESSION_COMPACT_TOKENS", "3000")) or None,
+            shared=os.getenv("SESSION_SHARED", "0") == "1",
+        )
+
+    def _new_memory(self) -> ConversationMemory:
+        return ConversationMemory(
+            max_messages=self.max_messages,
+            max_tokens=self.max_tokens,
+            compact_threshold=self.compact_threshold,
+            summarizer=self.summarizer,
+        )
+
+    def get(self, session_id: str) -> ConversationMemory:
+        """获取会话记忆；内存中没有时从持久层恢复（窗口与 token 预算同样生效）"""
+        with self._lock:
+            self._sweep_locked()
+            memory = self._sessions.get(session_id)
+            latest = self.store.last_id(session_id) if self.shared else None
+            if memory is not None and latest is not None and latest != self._synced_ids.get(session_id):
+                # 其他 worker 写入过这个会话：丢弃本进程里过期的记忆，从持久层重新加载
+                memory = None
+            if memory is None:
+                memory = self._new_memory()
+                if latest is not None:
+                    self._synced_ids[session_id] = latest
+                if self.store:
+                    # 先恢复摘要与附件，再加载摘要之后的原始消息
+                    memory.summary, memory.summarized_through = self.store.load_state(session_id)
+                    memory.attachments.update(self.store.load_attachments(session_id))
+                    # 恢复时不做压缩（持有全局锁，不能调用 LLM），只按预算保留最近的消息
+                    for message_id, role, content in self.store.load_recent(
+                            session_id, self.max_messages, after_id=memory.summarized_through):
+                        memory.add_to_memory(role, content, compact=False, message_id=message_id)
+                self._sessions[session_id] = memory
+                while len(self._sessions) > self.max_sessions:
+                    evicted, _ = self._sessions.popitem(last=False)
+                    self._last_access.pop(evicted, None)
+                    self._synced_ids.pop(evicted, None)
+            self._sessions.move_to_end(session_id)
+            self._last_access[session_id] = time.time()
+            return memory
+
+    def add_to_memory(self, session_id: str, role: str, content: str, compact: bool = True):
+        # 持久层保存原文，内存中的记忆可能被压缩
+        memory = self.get(session_id)
+        message_id = self.store.append(session_id, role, content) if self.store else None
+        memory.add_to_memory(role, content, compact=compact, message_id=message_id)
+        if compact:
+            self._save_state(session_id, memory)
+        if self.store:
+            if self.shared:
+                with self._lock:
+                    self._synced_ids[session_id] = message_id
+
+    async def aadd_to_memory(self, session_id: str, role: str, content: str, compact: bool = True):
+        """异步版本：压缩可能调用 LLM 生成摘要，放到线程里执行，不阻塞事件循环"""
+        await asyncio.to_thread(self.add_to_memory, session_id, role, content, compact)
+
+    def schedule_compaction(self, session_id: str) -> Optional[asyncio.Task]:
+        """回答完成后在后台压缩会话历史；不需要压缩时返回 None"""
+        with self._lock:
+            memory = self._sessions.get(session_id)
+        if memory is None or not memory.needs_compaction():
+            return None
+        task = asyncio.get_running_loop().create_task(asyncio.to_thread(self._compact, session_id, memory))
+        self._compaction_tasks.add(task)
+        task.add_done_callback(self._on_compaction_done)
+        return task
+
+    def _compact(self, session_id: str, memory: ConversationMemory):
+        memory.compact()
+        self._save_state(session_id, memory)
+
+    def _save_state(self, session_id: str, memory: ConversationMemory):
+        """压缩结果（摘要、折叠出的附件）写入持久层：其他 worker 重新加载会话时恢复，/attachments 也能取回"""
+        if not self.store:
+            return
+        with memory._lock:
+            summary, through = memory.summary, memory.summarized_through
+            attachments = dict(memory.attachments)
+        if summary:
+            self.store.save_state(session_id, summary, through)
+        if attachments:
+            self.store.save_attachments(session_id, attachments, keep=memory.max_attachments)
+
+    def _on_compaction_done(self, task: asyncio.Task):
+        self._compaction_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"会话历史压缩失败: {task.exception()}")
+
+    def get_attachment(self, session_id: str, attachment_id: str) -> Optional[str]:
+        """取回被折叠的上传文件原文（只在所属会话内可见）；本进程没有时查持久层"""
+        with self._lock:
+            memory = self._sessions.get(session_id)
+        text = memory.get_attachment(attachment_id) if memory else None
+        if text is None and self.store:
+            text = self.store.load_attachment(session_id, attachment_id)
+        return text
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._last_access.pop(session_id, None)
+            self._synced_ids.pop(session_id, None)
+        if self.store:
+            self.store.delete(session_id)
+
+    def _sweep_locked(self, interval: float = 60.0):
+        """淘汰空闲会话（最多每 interval 秒扫描一次）；持久层中的历史保留"""
+        now = time.time()
+        if now - self._last_sweep < interval:
+            return
+        self._last_sweep = now
+        idle = [sid for sid, ts in self._last_access.items() if now - ts > self.idle_ttl]
+        for sid in idle:
+            self._sessions.pop(sid, None)
+            self._last_access.pop(sid, None)
+            self._synced_ids.pop(sid, None)
+        if idle:
+            logger.info(f"淘汰 {len(idle)} 个空闲会话，当前活跃会话 {len(self._sessions)} 个")
+
+    def __len__(self):
+        return len(self._sessions)
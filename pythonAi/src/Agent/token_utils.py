@@ -0,0 +1,56 @@
+'''
+token 计数工具
+优先用 tiktoken 精确计数；tiktoken 不可用（未安装或离线无法下载编码表）时按字符估算：
+中文等全角字符约 1 字 1 token，其余字符约 4 个 1 token。
+'''
+
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_failed = False
+
+_WIDE_CHAR = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken 不可用，改用字符数估算 token：{e}")
+            _encoding_failed = True
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    wide = len(_WIDE_CHAR.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断文本到不超过 max_tokens 个 token"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    # 估算模式：二分查找满足预算的最长前缀
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
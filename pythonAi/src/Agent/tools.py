@@ -24,7 +24,7 @@ def 工具名(参数1: 类型, 参数2: 类型) -> 返回类型:
 
 
 from langchain.tools import tool
-from langchain_community.document_loaders import PyPDFLoader, TextLoader  
+from langchain_core.tools import StructuredTool
 
 import math
 import requests
@@ -38,20 +38,33 @@ import time
 
 import logging
 
+from src.Agent.upload_store import UploadStore
+
 logger = logging.getLogger(__name__)
 
 #集成agent到服务， 在初始化工具的时候 引入rag_engine
 # 全局变量，用于注入RAG引擎（在初始化Agent时设置）
 _rag_engine = None
 _llm = None
+_upload_store = None  # 上传文档索引（按上传id复用分割与嵌入结果）
 
 def init_tools(rag_engine, llm):
     """在创建Agent前调用，注入RAG引擎实例与Agent LLM实例"""
-    global _rag_engine, _llm
+    global _rag_engine, _llm, _upload_store
     _rag_engine = rag_engine
     _llm = llm
+    _upload_store = UploadStore(
+        rag_engine.embeddings,
+        ttl_seconds=float(os.getenv("UPLOAD_TTL", "3600")),
+        max_uploads=int(os.getenv("UPLOAD_MAX_ENTRIES", "256")),
+    )
     logger.info("工具已注入RAG引擎与Agent LLM")
 
+
+def get_upload_store():
+    """供 API 层注册上传文档；init_tools 之前为 None"""
+    return _upload_store
+
 # @tool 把函数变成了一个具有标准化接口的“工具对象”
 @tool
 def search_Weather(city:str )->str:
@@ -116,19 +129,34 @@ def get_current_time(city:str="北京")->str:
         return "城市不支持"
         
 from langchain_text_splitters import RecursiveCharacterTextSplitter 
-from langchain_chroma import Chroma
-from langchain_community.embeddings import ZhipuAIEmbeddings
+from src.Agent.vector_index import NumpyVectorIndex
 
 
 # 初步RAG流程
 # 全局向量库
 vectorstore = None
 
-#嵌入模型
-embeddings = ZhipuAIEmbeddings(
-    model="embedding-3",  # 智谱向量模型
-    api_key=os.getenv("ZHIPUAI_API_KEY"),  # 和 LLM 同 key
-    )
+#嵌入模型：第一次用到时再创建（导入本模块时不建客户端、不打开缓存库）
+_embeddings = None
+
+
+def get_embeddings():
+    """已注入 RAG 引擎时直接复用引擎的嵌入模型，否则单独创建（与 RAG 引擎共用同一个磁盘缓存文件）"""
+    global _embeddings
+    if _rag_engine is not None:
+        return _rag_engine.embeddings
+    if _embeddings is None:
+        from langchain_community.embeddings import ZhipuAIEmbeddings
+        from src.Agent.embedding_cache import CachedEmbeddings
+
+        _embeddings = CachedEmbeddings(
+            ZhipuAIEmbeddings(
+                model="embedding-3",  # 智谱向量模型
+                api_key=os.getenv("ZHIPUAI_API_KEY"),  # 和 LLM 同 key
+            ),
+            cache_path="./chroma_db/embedding_cache.sqlite3",
+        )
+    return _embeddings
 @tool
 def query_document(fileName:str,question:str)->str:
     """向量检索本地TXT或PDF文档，并根据问题回答。
@@ -147,8 +175,10 @@ def query_document(fileName:str,question:str)->str:
         # 根据文件类型选择加载器（LangChain 标准文档加载）
 
         if fileName.lower().endswith('.pdf'):
+            from langchain_community.document_loaders import PyPDFLoader
             loader = PyPDFLoader(file_path)
         elif fileName.lower().endswith('.txt'):
+            from langchain_community.document_loaders import TextLoader
             loader = TextLoader(file_path, encoding='utf-8')
         else:
             return "不支持的文件格式，只支持 .txt 或 .pdf"
@@ -161,9 +191,9 @@ def query_document(fileName:str,question:str)->str:
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=80) #chunk_size 切成300字的块，  重叠80字
         splits = text_splitter.split_documents(docs)
 
-        # 构建/更新向量库  第一次创建， 后续添加
+        # 构建/更新向量库  第一次创建， 后续添加（进程内 NumPy 索引，无需 Chroma 集合）
         if vectorstore is None:
-            vectorstore = Chroma.from_documents(documents=splits, embedding=embeddings)
+            vectorstore = NumpyVectorIndex.from_documents(splits, get_embeddings())
         else:
             vectorstore.add_documents(splits)
 
@@ -189,9 +219,9 @@ def query_document(fileName:str,question:str)->str:
         return f" RAG 失败: {str(e)}"
 
 
-@tool
-def smart_document_qa(question: str) -> str:
-    
+# 以下三个工具同时提供同步与异步实现：
+# agent.invoke 走同步函数，agent.ainvoke / astream 走协程，不再占用线程池
+def _smart_document_qa(question: str) -> str:
     """从简历知识库中查询相关信息。当用户询问关于简历写作、STAR法则、量化成果、项目描述等问题时使用。"""
     if _rag_engine is None:
         return "知识库未就绪"
@@ -205,52 +235,92 @@ def smart_document_qa(question: str) -> str:
         return f"查询知识库时出错: {str(e)}"
 
 
-@tool
-def extract_relevant_chunks(file_text: str, question: str, k: int = 4) -> str:
-    """从用户上传的文档文本中抽取与问题最相关的片段（文档块）。
+async def _asmart_document_qa(question: str) -> str:
+    """从简历知识库中查询相关信息。当用户询问关于简历写作、STAR法则、量化成果、项目描述等问题时使用。"""
+    if _rag_engine is None:
+        return "知识库未就绪"
+    try:
+        answer = await _rag_engine.aget_context(question, k=6, search_type="mmr", llm=_llm)
+        print(f"调用了smart_document_qa工具（异步）")
+        return answer
+    except Exception as e:
+        logger.error(f"知识库查询失败: {e}")
+        return f"查询知识库时出错: {str(e)}"
+
+
+smart_document_qa = StructuredTool.from_function(
+    func=_smart_document_qa,
+    coroutine=_asmart_document_qa,
+    name="smart_document_qa",
+)
+
+
+def _format_upload_chunks(rel_docs) -> str:
+    context = "\n\n".join([d.page_content for d in rel_docs if getattr(d, "page_content", None)])
+    return f"（以下为从上传文档中抽取的相关片段）\n{context}" if context.strip() else "未抽取到有效片段"
+
+
+def _extract_relevant_chunks(question: str, upload_id: str = "", file_text: str = "", k: int = 4) -> str:
+    """从用户上传的文档中抽取与问题最相关的片段（文档块）。
     
     使用场景：
     - 用户上传简历/文档，并要求“基于文档内容进行润色/改写/总结/提取要点”
     
     Args:
-        file_text: 用户上传文件解析出的纯文本（可能较长）
         question: 用户意图/任务描述（如“请按STAR法则润色这段经历”）
+        upload_id: 上传文件id（对话中“上传文件id：up-...”），优先使用，无需再传原文
+        file_text: 上传文件的纯文本，仅在没有 upload_id 时使用
         k: 返回的相关块数量（默认4）
     """
-    if _rag_engine is None:
+    if _rag_engine is None or _upload_store is None:
         return "服务未就绪"
-    if not file_text or not file_text.strip():
-        return "未提供可用的文件文本"
     try:
-        splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=120)
-        docs = splitter.create_documents([file_text])
-        if not docs:
-            return "文件内容为空"
-        # 为上传文本建立临时向量库（内存）
-        tmp_vs = Chroma.from_documents(documents=docs, embedding=_rag_engine.embeddings, persist_directory=None)
-        retriever = tmp_vs.as_retriever(search_type="mmr", search_kwargs={"k": int(k), "fetch_k": max(12, int(k) * 3), "lambda_mult": 0.5})
-        rel_docs = retriever.invoke(question)
-        context = "\n\n".join([d.page_content for d in rel_docs if getattr(d, "page_content", None)])
-        return f"（以下为从上传文档中抽取的相关片段）\n{context}" if context.strip() else "未抽取到有效片段"
+        if not upload_id:
+            if not file_text or not file_text.strip():
+                return "未提供上传文件id或文件文本"
+            # 同一份文本只分割、嵌入一次，之后按id复用
+            upload_id = _upload_store.register(file_text)
+        rel_docs = _upload_store.search(upload_id, question, k=int(k), fetch_k=max(12, int(k) * 3))
+        return _format_upload_chunks(rel_docs)
+    except KeyError:
+        return f"上传文件 {upload_id} 不存在或已过期，请重新上传"
     except Exception as e:
         logger.error(f"抽取上传文档片段失败: {e}")
         return f"抽取失败: {str(e)}"
-        
-@tool(return_direct=True)
-def polish_text(text: str, style: str = "professional", rules_context: str = "", file_context: str = "") -> str:
-    """润色文本（结合知识库规则 + 上传文档相关片段）。
-    
-    支持风格：professional（专业）、concise（简洁）、friendly（友好）。
-    当有 rules_context / file_context 时，会优先遵循其中的规则与事实。
-    """
-    if _llm is None:
+
+
+async def _aextract_relevant_chunks(question: str, upload_id: str = "", file_text: str = "", k: int = 4) -> str:
+    """从用户上传的文档中抽取与问题最相关的片段（文档块）。"""
+    if _rag_engine is None or _upload_store is None:
         return "服务未就绪"
+    try:
+        if not upload_id:
+            if not file_text or not file_text.strip():
+                return "未提供上传文件id或文件文本"
+            upload_id = await _upload_store.aregister(file_text)
+        rel_docs = await _upload_store.asearch(upload_id, question, k=int(k), fetch_k=max(12, int(k) * 3))
+        return _format_upload_chunks(rel_docs)
+    except KeyError:
+        return f"上传文件 {upload_id} 不存在或已过期，请重新上传"
+    except Exception as e:
+        logger.error(f"抽取上传文档片段失败: {e}")
+        return f"抽取失败: {str(e)}"
+
+
+extract_relevant_chunks = StructuredTool.from_function(
+    func=_extract_relevant_chunks,
+    coroutine=_aextract_relevant_chunks,
+    name="extract_relevant_chunks",
+)
+
+
+def _build_polish_prompt(text: str, style: str, rules_context: str, file_context: str) -> str:
     style_prompts = {
         "professional": "请用专业、正式的语气润色以下文本，保持原意但提升表达质量，使语言更精炼、逻辑更清晰：\n\n",
         "concise": "请用简洁、精炼的语言重写以下文本，去除冗余词汇，保留核心信息：\n\n",
         "friendly": "请用友好、亲切的语气润色以下文本，使其更易读、更有亲和力：\n\n",
     }
-    prompt = (
+    return (
         style_prompts.get(style, style_prompts["professional"])
         + "\n【必须遵循的简历写作规则（来自知识库）】\n"
         + (rules_context.strip() or "（无）")
@@ -259,6 +329,17 @@ def polish_text(text: str, style: str = "professional", rules_context: str = "",
         + "\n\n【需要润色的原文】\n"
         + text
     )
+
+
+def _polish_text(text: str, style: str = "professional", rules_context: str = "", file_context: str = "") -> str:
+    """润色文本（结合知识库规则 + 上传文档相关片段）。
+    
+    支持风格：professional（专业）、concise（简洁）、friendly（友好）。
+    当有 rules_context / file_context 时，会优先遵循其中的规则与事实。
+    """
+    if _llm is None:
+        return "服务未就绪"
+    prompt = _build_polish_prompt(text, style, rules_context, file_context)
     start = time.time()
     try:
         response = _llm.invoke(prompt)
@@ -273,6 +354,30 @@ def polish_text(text: str, style: str = "professional", rules_context: str = "",
         return f"润色失败: {str(e)}"
 
 
+async def _apolish_text(text: str, style: str = "professional", rules_context: str = "", file_context: str = "") -> str:
+    """润色文本（结合知识库规则 + 上传文档相关片段）。"""
+    if _llm is None:
+        return "服务未就绪"
+    prompt = _build_polish_prompt(text, style, rules_context, file_context)
+    start = time.time()
+    try:
+        response = await _llm.ainvoke(prompt)
+        logger.info(f"LLM 润色成功调用耗时: {time.time() - start:.2f} 秒")
+        return response.content
+    except Exception as e:
+        logger.error(f"润色失败: {e}")
+        logger.info(f"LLM 润色调用耗时: {time.time() - start:.2f} 秒")
+        return f"润色失败: {str(e)}"
+
+
+polish_text = StructuredTool.from_function(
+    func=_polish_text,
+    coroutine=_apolish_text,
+    name="polish_text",
+    return_direct=True,
+)
+
+
 @tool("sayHello",description="say hello to you!")
 def greeting(name:str)->str:
     
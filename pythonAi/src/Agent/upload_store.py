@@ -0,0 +1,182 @@
+'''
+上传文档索引（按上传id复用）
+用户上传的简历在一次会话里会被反复使用（多轮润色、多次调用 extract_relevant_chunks）。
+这里在第一次上传时完成 解析 -> 分割 -> 嵌入，结果按上传id保存在进程内，
+后续轮次和工具调用直接按id检索，不再重复解析和嵌入。
+- 上传id由文本内容哈希决定，同一份文件重复上传得到同一个id
+- 另外记录原始文件字节的哈希，同一个文件再次上传时连解析都可以跳过
+- 条目带 TTL 和数量上限（LRU）
+- 可选共享持久层 backend（会话用的 SQLiteSessionStore）：注册时写入上传文本，
+  多 worker 部署下后续请求落到其他进程、进程内没有该上传时，从持久层取回文本重新分割、嵌入
+  （嵌入有磁盘缓存，基本不再调用接口）
+'''
+
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.Agent.embedding_cache import normalize_text
+from src.Agent.vector_index import NumpyVectorIndex
+
+
+def make_upload_id(text: str) -> str:
+    return "up-" + hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()[:16]
+
+
+class _Upload:
+    __slots__ = ("upload_id", "filename", "text", "index", "file_hash", "last_access")
+
+    def __init__(self, upload_id, filename, text, index, file_hash):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.text = text
+        self.index = index  # 文档块的 NumpyVectorIndex
+        self.file_hash = file_hash
+        self.last_access = time.time()
+
+
+class UploadStore:
+    def __init__(self, embeddings, ttl_seconds: float = 3600.0, max_uploads: int = 256,
+                 chunk_size: int = 800, chunk_overlap: int = 120, backend=None):
+        self.embeddings = embeddings
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_uploads = max_uploads
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self._uploads: "OrderedDict[str, _Upload]" = OrderedDict()
+        self._by_file_hash: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    # ---------- 注册 ----------
+    def _split(self, text: str, filename: str) -> List[Document]:
+        return self.splitter.create_documents([text], metadatas=[{"source": filename or "upload"}])
+
+    def _save(self, upload: _Upload):
+        with self._lock:
+            self._uploads[upload.upload_id] = upload
+            self._uploads.move_to_end(upload.upload_id)
+            if upload.file_hash:
+                self._by_file_hash[upload.file_hash] = upload.upload_id
+            self._evict_locked()
+
+    def register(self, text: str, filename: str = "", file_hash: Optional[str] = None) -> str:
+        """注册上传文本并完成分割与嵌入，返回上传id；已注册过的内容直接返回原id"""
+        upload_id = make_upload_id(text)
+        if self.get(upload_id) is not None:
+            return upload_id
+        index = NumpyVectorIndex.from_documents(self._split(text, filename), self.embeddings)
+        self._save(_Upload(upload_id, filename, text, index, file_hash))
+        self._persist(upload_id, filename, text, file_hash)
+        return upload_id
+
+    async def aregister(self, text: str, filename: str = "", file_hash: Optional[str] = None) -> str:
+        upload_id = make_upload_id(text)
+        if self.get(upload_id) is not None:
+            return upload_id
+        index = await NumpyVectorIndex.afrom_documents(self._split(text, filename), self.embeddings)
+        self._save(_Upload(upload_id, filename, text, index, file_hash))
+        await asyncio.to_thread(self._persist, upload_id, filename, text, file_hash)
+        return upload_id
+
+    def _persist(self, upload_id: str, filename: str, text: str, file_hash: Optional[str]):
+        if self.backend is not None:
+            self.backend.save_upload(upload_id, filename, text, file_hash, ttl_seconds=self.ttl_seconds)
+
+    # ---------- 查询 ----------
+    def _get_local(self, upload_id: str) -> Optional[_Upload]:
+        now = time.time()
+        with self._lock:
+            self._evict_locked(now)
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                return None
+            upload.last_access = now
+            self._uploads.move_to_end(upload_id)
+            return upload
+
+    def _load_shared(self, upload_id: str):
+        if self.backend is None:
+            return None
+        return self.backend.load_upload(upload_id, ttl_seconds=self.ttl_seconds)
+
+    def get(self, upload_id: str) -> Optional[_Upload]:
+        """进程内没有时从共享持久层取回并重建索引"""
+        upload = self._get_local(upload_id)
+        if upload is not None:
+            return upload
+        row = self._load_shared(upload_id)
+        if row is None:
+            return None
+        filename, text, file_hash = row
+        index = NumpyVectorIndex.from_documents(self._split(text, filename), self.embeddings)
+        upload = _Upload(upload_id, filename, text, index, file_hash)
+        self._save(upload)
+        return upload
+
+    async def aget(self, upload_id: str) -> Optional[_Upload]:
+        """异步版本：持久层读取放到线程里，重建索引走异步嵌入"""
+        upload = self._get_local(upload_id)
+        if upload is not None:
+            return upload
+        row = await asyncio.to_thread(self._load_shared, upload_id)
+        if row is None:
+            return None
+        filename, text, file_hash = row
+        index = await NumpyVectorIndex.afrom_documents(self._split(text, filename), self.embeddings)
+        upload = _Upload(upload_id, filename, text, index, file_hash)
+        self._save(upload)
+        return upload
+
+    def find_by_file_hash(self, file_hash: str) -> Optional[str]:
+        """按原始文件字节哈希查找已注册的上传id（同一文件再次上传时跳过解析）"""
+        with self._lock:
+            upload_id = self._by_file_hash.get(file_hash)
+        if upload_id and self._get_local(upload_id) is not None:
+            return upload_id
+        return self.backend.find_upload_by_hash(file_hash) if self.backend is not None else None
+
+    def get_text(self, upload_id: str) -> Optional[str]:
+        upload = self._get_local(upload_id)
+        if upload is not None:
+            return upload.text
+        row = self._load_shared(upload_id)
+        return row[1] if row else None
+
+    def search_by_vector(self, upload_id: str, query_vector, k: int = 4, fetch_k: int = 12,
+                         lambda_mult: float = 0.5) -> List[Document]:
+        """在指定上传文档的块中做 MMR 检索；上传id不存在（过期）时抛 KeyError"""
+        upload = self.get(upload_id)
+        if upload is None:
+            raise KeyError(upload_id)
+        return upload.index.max_marginal_relevance_search_by_vector(query_vector, k=k, fetch_k=fetch_k,
+                                                                    lambda_mult=lambda_mult)
+
+    def search(self, upload_id: str, question: str, k: int = 4, **kwargs) -> List[Document]:
+        return self.search_by_vector(upload_id, self.embeddings.embed_query(question), k=k, **kwargs)
+
+    async def asearch(self, upload_id: str, question: str, k: int = 4, **kwargs) -> List[Document]:
+        await self.aget(upload_id)  # 进程内没有时先异步取回，search_by_vector 里不会再同步嵌入
+        return self.search_by_vector(upload_id, await self.embeddings.aembed_query(question), k=k, **kwargs)
+
+    # ---------- 淘汰 ----------
+    def _evict_locked(self, now: Optional[float] = None):
+        now = now or time.time()
+        expired = [uid for uid, u in self._uploads.items() if now - u.last_access > self.ttl_seconds]
+        for uid in expired:
+            self._drop_locked(uid)
+        while len(self._uploads) > self.max_uploads:
+            self._drop_locked(next(iter(self._uploads)))
+
+    def _drop_locked(self, upload_id: str):
+        upload = self._uploads.pop(upload_id, None)
+        if upload and upload.file_hash and self._by_file_hash.get(upload.file_hash) == upload_id:
+            del self._by_file_hash[upload.file_hash]
+
+    def __len__(self):
+        return len(self._uploads)
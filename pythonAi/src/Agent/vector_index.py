@@ -0,0 +1,164 @@
+'''
+进程内 NumPy 向量索引
+上传简历、单次请求的临时文档通常只有几块到几十块，为它们创建 Chroma 集合的开销远大于检索本身。
+这里用一块连续的 float32 矩阵保存归一化后的向量：
+- 相似度检索：一次矩阵乘法 + argpartition 取 top-k
+- MMR：候选两两相似度矩阵一次算好，贪心选择时增量更新“与已选块的最大相似度”
+- as_retriever() 返回标准 LangChain 检索器，可以直接替换 Chroma 的检索器
+- 矩阵与文档列表作为一个元组整体发布：追加时构造新元组再一次性替换引用，
+  检索只读取一次引用，并发追加时不会拿到行数与文档数对不上的中间状态
+'''
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """转成连续的 float32 矩阵并按行归一化（零向量保持为零）"""
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """取分数最高的 k 个下标（按分数降序）；argpartition 为 O(n)，只对 k 个结果排序"""
+    n = scores.shape[0]
+    if k >= n:
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+def mmr_select(query_vector: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    在候选向量（已归一化）上做 MMR，返回选中的候选下标
+    score = lambda * 与问题的相似度 - (1 - lambda) * 与已选块的最大相似度
+    候选两两相似度矩阵只算一次；每选出一块，用它那一行增量更新“与已选块的最大相似度”，
+    贪心选择总代价 O(k·n)，而不是每轮重新计算与全部已选块的相似度 O(k²·n)
+    """
+    n = candidates.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    relevance = candidates @ query_vector
+    pairwise = candidates @ candidates.T
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_sim = pairwise[first].copy()
+    chosen = np.zeros(n, dtype=bool)
+    chosen[first] = True
+    while len(selected) < min(k, n):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        scores[chosen] = -np.inf
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        chosen[idx] = True
+        np.maximum(max_sim, pairwise[idx], out=max_sim)
+    return selected
+
+
+class NumpyVectorIndex:
+    def __init__(self, embeddings=None):
+        self.embeddings = embeddings
+        # (矩阵, 文档列表)：矩阵为 (块数, 维度) 连续 float32，已归一化；发布后两者都不再原地修改
+        self._state: Tuple[Optional[np.ndarray], List[Document]] = (None, [])
+        self._lock = threading.Lock()  # 只串行化写入，检索不加锁
+
+    @property
+    def documents(self) -> List[Document]:
+        return self._state[1]
+
+    # ---------- 构建 ----------
+    @classmethod
+    def from_documents(cls, documents: List[Document], embeddings) -> "NumpyVectorIndex":
+        index = cls(embeddings)
+        if documents:
+            index.add_vectors(documents, embeddings.embed_documents([d.page_content for d in documents]))
+        return index
+
+    @classmethod
+    async def afrom_documents(cls, documents: List[Document], embeddings) -> "NumpyVectorIndex":
+        index = cls(embeddings)
+        if documents:
+            index.add_vectors(documents, await embeddings.aembed_documents([d.page_content for d in documents]))
+        return index
+
+    def add_vectors(self, documents: List[Document], vectors):
+        if not documents:
+            return
+        block = normalize_rows(vectors)
+        with self._lock:
+            matrix, docs = self._state
+            # 追加后重新拼成一块连续矩阵（临时语料很小，拷贝代价可以忽略）
+            matrix = block if matrix is None else np.ascontiguousarray(np.vstack([matrix, block]))
+            self._state = (matrix, docs + list(documents))
+
+    def add_documents(self, documents: List[Document]):
+        self.add_vectors(documents, self.embeddings.embed_documents([d.page_content for d in documents]))
+
+    def __len__(self):
+        return len(self.documents)
+
+    # ---------- 检索 ----------
+    def _query(self, query_vector) -> np.ndarray:
+        return normalize_rows(query_vector)[0]
+
+    def similarity_search_by_vector_with_score(self, query_vector, k: int = 4) -> List[Tuple[Document, float]]:
+        matrix, documents = self._state
+        if not documents:
+            return []
+        scores = matrix @ self._query(query_vector)
+        return [(documents[i], float(scores[i])) for i in top_k_indices(scores, int(k))]
+
+    def similarity_search_by_vector(self, query_vector, k: int = 4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(query_vector, k)]
+
+    def max_marginal_relevance_search_by_vector(self, query_vector, k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5) -> List[Document]:
+        matrix, documents = self._state
+        if not documents:
+            return []
+        query = self._query(query_vector)
+        candidates = top_k_indices(matrix @ query, max(int(fetch_k), int(k)))
+        picked = mmr_select(query, matrix[candidates], int(k), lambda_mult)
+        return [documents[candidates[i]] for i in picked]
+
+    def search_by_vector(self, query_vector, search_type: str = "similarity", **kwargs) -> List[Document]:
+        if search_type == "mmr":
+            return self.max_marginal_relevance_search_by_vector(query_vector, **kwargs)
+        kwargs = {key: value for key, value in kwargs.items() if key == "k"}
+        return self.similarity_search_by_vector(query_vector, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(self.embeddings.embed_query(query), k, fetch_k, lambda_mult)
+
+    def as_retriever(self, search_type: str = "similarity", search_kwargs: Optional[Dict[str, Any]] = None):
+        return NumpyIndexRetriever(index=self, search_type=search_type, search_kwargs=search_kwargs or {})
+
+
+class NumpyIndexRetriever(BaseRetriever):
+    """NumpyVectorIndex 的 LangChain 检索器包装，用法与 vectorstore.as_retriever() 相同"""
+
+    index: Any
+    search_type: str = "similarity"
+    search_kwargs: Dict[str, Any] = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector = self.index.embeddings.embed_query(query)
+        return self.index.search_by_vector(vector, self.search_type, **self.search_kwargs)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector = await self.index.embeddings.aembed_query(query)
+        return self.index.search_by_vector(vector, self.search_type, **self.search_kwargs)
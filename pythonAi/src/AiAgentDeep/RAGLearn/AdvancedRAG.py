@@ -5,12 +5,48 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough ,RunnableLambda,RunnableBranch
 from langchain_classic.retrievers import MultiQueryRetriever  # 可选多查询
+import difflib
 import os
 import re  # 导入正则表达式用于清洗
+import time
 
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownTextSplitter,MarkdownHeaderTextSplitter
 
+try:
+    from src.Agent.token_utils import estimate_tokens
+except ImportError:
+    # 在 RAGLearn 目录下直接运行本脚本时没有 src 包：粗略按每 2 个字符 1 个 token 估算
+    def estimate_tokens(text: str) -> int:
+        return len(text or "") // 2
+
+QA_CHAIN_TYPES = ("stuff", "map_reduce", "refine", "auto")
+
+
+def _run_steps(steps):
+    """
+    同步执行“步骤生成器”：生成器产出 (runnable, 方法名, 输入, 关键字参数)，这里调用后把结果送回生成器。
+    打分、排序、提前结束等逻辑只在生成器里写一份，同步/异步只在驱动函数里区分 invoke 与 ainvoke
+    """
+    try:
+        step = next(steps)
+        while True:
+            runnable, method, payload, kwargs = step
+            step = steps.send(getattr(runnable, method)(payload, **kwargs))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _arun_steps(steps):
+    """异步驱动：同一个步骤生成器，调用换成 a 前缀的协程（invoke -> ainvoke，batch -> abatch）"""
+    try:
+        step = next(steps)
+        while True:
+            runnable, method, payload, kwargs = step
+            step = steps.send(await getattr(runnable, "a" + method)(payload, **kwargs))
+    except StopIteration as stop:
+        return stop.value
+
 
 
 
@@ -22,6 +58,21 @@ class RAGEngineLCEL:
         self.embeddings = ZhipuAIEmbeddings(model="embedding-3", api_key=os.getenv("ZHIPUAI_API_KEY"))
 
         self.llm = ChatZhipuAI(model="glm-4-flash", temperature=0.0, api_key=os.getenv("ZHIPUAI_API_KEY"))
+        # map 阶段最多同时发出的 LLM 请求数
+        self.map_max_concurrency = int(os.getenv("RAG_MAP_CONCURRENCY", "8"))
+        # refine：相关度低于该分数（0-10）的块不参与精炼；连续 refine_patience 轮答案几乎不变就提前结束
+        self.refine_min_score = float(os.getenv("RAG_REFINE_MIN_SCORE", "5"))
+        self.refine_stable_ratio = float(os.getenv("RAG_REFINE_STABLE_RATIO", "0.95"))
+        self.refine_patience = int(os.getenv("RAG_REFINE_PATIENCE", "1"))
+        # auto 路由：上下文能放进窗口就走 stuff；放不下时按来源数和延迟目标在 map_reduce / refine 之间选
+        self.context_window = int(os.getenv("RAG_CONTEXT_WINDOW", "128000"))    # glm-4-flash 上下文窗口
+        self.answer_reserve = int(os.getenv("RAG_ANSWER_RESERVE", "4096"))      # 留给提示词与回答的 token
+        self.latency_slo = float(os.getenv("RAG_LATENCY_SLO_SECONDS", "15"))
+        self.multi_source_threshold = int(os.getenv("RAG_ROUTER_MULTI_SOURCE", "3"))
+        # 各链型实测耗时（指数滑动平均，秒）；没有实测值时按单次 LLM 调用耗时估算
+        self.chain_latency = {}
+        self.llm_call_seconds = float(os.getenv("RAG_LLM_CALL_SECONDS", "3"))
+        self._routed_chains = {}
 
         #测试代码， 事先就已经创建好了知识库
         #self.vectorstore = Chroma(persist_directory=persist_directory, embedding_function=self.embeddings)
@@ -272,12 +323,208 @@ class RAGEngineLCEL:
         print("✅ 新向量库创建完成。")
         return vectorstore
 
-    def get_qa_chain(self, chain_type: str = "stuff"):
+    def _build_retriever(self):
+        """共用高级 retriever（MultiQuery + MMR）"""
+        return MultiQueryRetriever.from_llm(
+            retriever=self.vectorstore.as_retriever(
+                search_type="mmr",
+                search_kwargs={"k": 8, "fetch_k": 20, "lambda_mult": 0.5}
+            ),
+            llm=self.llm
+        )
+
+    def _map_reduce_parts(self):
+        """map 链（逐块总结，无关时返回'无关'）与 reduce 提示词"""
+        # 优化 Map prompt（Day8 知识点：Map 阶段需强相关过滤，避免混杂无关文档如“自主创业”）
+        # 带上问题，模型才能判断片段是否相关
+        map_prompt = ChatPromptTemplate.from_template(
+            "问题：{question}\n\n如果文档片段与问题相关，总结关键信息；如果无关，直接返回'无关'：\n\n{context}\n\n总结："
+        )
+        map_chain = map_prompt | self.llm | StrOutputParser()
+
+        reduce_prompt = ChatPromptTemplate.from_template(
+         """汇总以下相关总结，给出最终答案（忽略'无关'）：
+            {context}
+
+            问题：{question}
+            最终回答："""
+        )
+        return map_chain, reduce_prompt
+
+    @staticmethod
+    def _is_relevant_summary(summary: str) -> bool:
+        """map 结果为'无关'（含引号、句号等变体）或过短时视为无关，不进入 reduce"""
+        text = summary.strip().strip("'\"‘’“”。.！!")
+        return not text.startswith("无关") and len(text) > 20
+
+    def _map_config(self):
+        return {"max_concurrency": self.map_max_concurrency}
+
+    def _collect_map_summaries(self, map_chain, docs, question):
+        """并发执行 map，按完成顺序收集相关总结，最后按原文档顺序返回"""
+        inputs = [{"context": doc.page_content, "question": question} for doc in docs]
+        relevant = {}
+        for i, summary in map_chain.batch_as_completed(inputs, config=self._map_config()):
+            if self._is_relevant_summary(summary):
+                relevant[i] = summary
+        print(f"🧩 map 完成：{len(docs)} 个文档块，{len(relevant)} 个相关")
+        return [relevant[i] for i in sorted(relevant)]
+
+    async def _acollect_map_summaries(self, map_chain, docs, question):
+        inputs = [{"context": doc.page_content, "question": question} for doc in docs]
+        summaries = await map_chain.abatch(inputs, config=self._map_config())
+        relevant = [s for s in summaries if self._is_relevant_summary(s)]
+        print(f"🧩 map 完成：{len(docs)} 个文档块，{len(relevant)} 个相关")
+        return relevant
+
+    def _relevance_score_chain(self):
+        """相关度打分链：只输出 0-10 的整数，提示和输出都很短，可以一次并发打完所有块"""
+        score_prompt = ChatPromptTemplate.from_template(
+            "判断文档片段对回答问题的有用程度，只输出 0 到 10 之间的一个整数，不要输出其他内容。\n\n"
+            "问题：{question}\n\n文档片段：\n{context}\n\n分数："
+        )
+        return score_prompt | self.llm | StrOutputParser()
+
+    @staticmethod
+    def _parse_score(text: str) -> float:
+        match = re.search(r"\d+(?:\.\d+)?", text or "")
+        return min(float(match.group()), 10.0) if match else 0.0
+
+    def _rank_relevant(self, docs, score_texts):
+        """过滤掉低于阈值的块，其余按相关度降序（同分保持检索顺序）"""
+        scored = [(self._parse_score(text), i) for i, text in enumerate(score_texts)]
+        relevant = sorted((item for item in scored if item[0] >= self.refine_min_score), key=lambda x: (-x[0], x[1]))
+        print(f"📊 相关度打分：{[score for score, _ in scored]}，{len(relevant)}/{len(docs)} 个块参与精炼")
+        return [docs[i] for _, i in relevant]
+
+    def _is_stable(self, old_answer: str, new_answer: str) -> bool:
+        """新旧答案几乎一样（字符级相似度达到阈值）时认为答案已稳定"""
+        return difflib.SequenceMatcher(None, old_answer, new_answer).ratio() >= self.refine_stable_ratio
+
+    async def astream_map_reduce(self, question: str):
+        """
+        流式 map_reduce：每个 map 完成就产出一条 {"event": "map", ...}（相关总结即 reduce 的部分输入），
+        全部完成后流式产出 reduce 的答案 {"event": "token", "text": ...}
+        """
+        docs = await self._build_retriever().ainvoke(question)
+        map_chain, reduce_prompt = self._map_reduce_parts()
+        inputs = [{"context": doc.page_content, "question": question} for doc in docs]
+        relevant = {}
+        async for i, summary in map_chain.abatch_as_completed(inputs, config=self._map_config()):
+            is_relevant = self._is_relevant_summary(summary)
+            if is_relevant:
+                relevant[i] = summary
+            yield {"event": "map", "index": i, "relevant": is_relevant, "summary": summary}
+        combined = "\n\n".join(relevant[i] for i in sorted(relevant))
+        async for chunk in (reduce_prompt | self.llm | StrOutputParser()).astream(
+            {"context": combined, "question": question}
+        ):
+            yield {"event": "token", "text": chunk}
+
+    def _estimate_latency(self, chain_type: str, n_docs: int) -> float:
+        """估算某链型的耗时：优先用实测值，否则按 LLM 调用轮数估算"""
+        if chain_type in self.chain_latency:
+            return self.chain_latency[chain_type]
+        per_call = self.chain_latency.get("stuff", self.llm_call_seconds)
+        if chain_type == "map_reduce":
+            # 并发 map 按 max_concurrency 分轮，再加一次 reduce
+            rounds = -(-n_docs // max(self.map_max_concurrency, 1))
+            return per_call * (rounds + 1)
+        if chain_type == "refine":
+            # 一轮并发打分 + 逐块精炼（最坏情况全部相关）
+            return per_call * (1 + n_docs)
+        return per_call
+
+    def _record_latency(self, chain_type: str, seconds: float, alpha: float = 0.3):
+        old = self.chain_latency.get(chain_type)
+        self.chain_latency[chain_type] = seconds if old is None else (1 - alpha) * old + alpha * seconds
+
+    def choose_chain_type(self, docs, question: str = ""):
+        """根据上下文 token 数、不同来源数和延迟目标选择链型，返回 (链型, 决策依据)"""
+        context_tokens = sum(estimate_tokens(doc.page_content) for doc in docs) + estimate_tokens(question)
+        budget = self.context_window - self.answer_reserve
+        sources = len({doc.metadata.get("source", "") for doc in docs})
+        signals = {"context_tokens": context_tokens, "budget": budget, "sources": sources, "docs": len(docs)}
+        if context_tokens <= budget:
+            signals["reason"] = "上下文放得进窗口"
+            return "stuff", signals
+
+        # 放不下：多来源需要综合 -> map_reduce；来源集中 -> refine（逐块精炼、可提前结束）
+        preferred = "map_reduce" if sources >= self.multi_source_threshold else "refine"
+        other = "refine" if preferred == "map_reduce" else "map_reduce"
+        estimates = {ct: round(self._estimate_latency(ct, len(docs)), 2) for ct in (preferred, other)}
+        signals["estimated_seconds"] = estimates
+        if estimates[preferred] > self.latency_slo and estimates[other] <= self.latency_slo:
+            signals["reason"] = f"{preferred} 预计超出延迟目标 {self.latency_slo}s"
+            return other, signals
+        signals["reason"] = "来源较多，分块汇总" if preferred == "map_reduce" else "来源集中，逐块精炼"
+        return preferred, signals
+
+    def _routed_chain(self, chain_type: str):
+        if chain_type not in self._routed_chains:
+            self._routed_chains[chain_type] = self.get_qa_chain(chain_type, with_retriever=False)
+        return self._routed_chains[chain_type]
+
+    def _route_steps(self, inputs):
+        """auto 链的步骤：选择链型、执行、记录耗时（同步/异步共用，见 _run_steps）"""
+        if inputs.get("__no_answer__"):
+            return "抱歉，我在知识库中没有找到相关信息。你可以尝试换个问题。"
+        chain_type, signals = self.choose_chain_type(inputs["context"], inputs["question"])
+        start = time.perf_counter()
+        answer = yield self._routed_chain(chain_type), "invoke", inputs, {}
+        elapsed = time.perf_counter() - start
+        self._record_latency(chain_type, elapsed)
+        print(f"🧭 链型路由：{chain_type}，依据 {signals}，耗时 {elapsed:.2f}s")
+        return answer
+
+    def _build_router(self):
+        """auto 链：对检索结果选择链型并执行，打印决策与耗时"""
+        def route(inputs):
+            return _run_steps(self._route_steps(inputs))
+
+        async def aroute(inputs):
+            return await _arun_steps(self._route_steps(inputs))
+
+        return RunnableLambda(route, afunc=aroute)
+
+    def _refine_steps(self, chains, inputs):
+        """refine 链的步骤：并发打分、按相关度排序、逐块精炼、答案稳定后提前结束（同步/异步共用）"""
+        initial_chain, refine_chain, score_chain = chains
+        docs = inputs["context"]
+        question = inputs["question"]
+        # 1. 一次并发打分，只保留相关块，并按相关度从高到低精炼
+        scores = yield score_chain, "batch", [
+            {"context": doc.page_content, "question": question} for doc in docs
+        ], {"config": self._map_config()}
+        ranked = self._rank_relevant(docs, scores)
+        if not ranked:
+            return "根据现有资料无法回答该问题。"
+
+        # 2. 最相关的块直接生成初始答案，之后逐块精炼，答案稳定后提前结束
+        answer = yield initial_chain, "invoke", {"context": ranked[0].page_content, "question": question}, {}
+        stable_rounds = 0
+        for i, doc in enumerate(ranked[1:], start=2):
+            new_answer = yield refine_chain, "invoke", {
+                "existing_answer": answer,
+                "context": doc.page_content,
+                "question": question
+            }, {}
+            stable_rounds = stable_rounds + 1 if self._is_stable(answer, new_answer) else 0
+            answer = new_answer
+            print(f"--- 处理第 {i} 个相关文档后，答案更新为 ---\n{answer}\n") # 调试用
+            if stable_rounds >= self.refine_patience:
+                print(f"⏹️ 答案已稳定，跳过剩余 {len(ranked) - i} 个文档")
+                break
+
+        return answer
+
+    def get_qa_chain(self, chain_type: str = "stuff", with_retriever: bool = True):
         """
         返回三种高级链（
-        chain_type 支持: "stuff", "map_reduce", "refine"
+        chain_type 支持: "stuff", "map_reduce", "refine"，以及按每个问题自动选择的 "auto"
+        with_retriever=False 时返回不带检索的链，输入为 {"context": 文档列表, "question": 问题}
         """
-        if chain_type not in ["stuff", "map_reduce", "refine"]:
+        if chain_type not in QA_CHAIN_TYPES:
             raise ValueError(f"不支持的 chain_type: {chain_type}")
 
         # 共用 prompt
@@ -292,20 +539,20 @@ class RAGEngineLCEL:
         )
 
         # 共用高级 retriever（原来的 MultiQuery + 阈值）
-        retriever = MultiQueryRetriever.from_llm(
-            retriever=self.vectorstore.as_retriever(
-                
-                search_type="mmr",
-                search_kwargs={"k": 8, "fetch_k": 20, "lambda_mult": 0.5}
-            ),
-            llm=self.llm
-        )
+        if with_retriever:
+            retriever = self._build_retriever()
+            head = {"context": retriever, "question": RunnablePassthrough()} | RunnableLambda(self.check_and_mark)
+        else:
+            head = RunnablePassthrough()
+
+        # ============ 0. Auto（按上下文大小、来源数、延迟目标选择链型） ============
+        if chain_type == "auto":
+            return head | self._build_router()
 
         # ============ 1. Stuff（默认链） ============
         if chain_type == "stuff":
             return (
-                {"context": retriever, "question": RunnablePassthrough()}
-                | RunnableLambda(self.check_and_mark)  # 你原来的防幻觉检查
+                head  # 检索 + 你原来的防幻觉检查
                 | prompt
                 | self.llm
                 | StrOutputParser()
@@ -313,35 +560,24 @@ class RAGEngineLCEL:
 
         # ============ 2. Map-Reduce（并行处理每个文档，最后汇总） ============
         elif chain_type == "map_reduce":
-        # 优化 Map prompt（Day8 知识点：Map 阶段需强相关过滤，避免混杂无关文档如“自主创业”）
         #MapReduceDocumentsChain 手动实现官方的MapReduceDocumentsChain 逻辑
-            map_prompt = ChatPromptTemplate.from_template(
-                "如果文档片段与问题相关，总结关键信息；如果无关，直接返回'无关'：\n\n{context}\n\n总结："
-            )
-            map_chain = map_prompt | self.llm | StrOutputParser()
-
-            reduce_prompt = ChatPromptTemplate.from_template(
-             """汇总以下相关总结，给出最终答案（忽略'无关'）：
-                {context}
-
-                问题：{question}
-                最终回答："""
-            )
+            map_chain, reduce_prompt = self._map_reduce_parts()
 
             def map_reduce_func(inputs):
                 docs = inputs["context"]
                 question = inputs["question"]
-                #对每个文档快进行独立总结
-                summaries = [map_chain.invoke({"context": doc.page_content}) for doc in docs]
-                
-                filtered_summaries = [s for s in summaries if s != '无关' and len(s) > 20]
-                combined = "\n\n".join(filtered_summaries)
+                # 对每个文档块并发独立总结（batch + max_concurrency），总耗时接近一次 LLM 调用
+                combined = "\n\n".join(self._collect_map_summaries(map_chain, docs, question))
                 return reduce_prompt.invoke({"context": combined, "question": question})
 
+            async def amap_reduce_func(inputs):
+                question = inputs["question"]
+                summaries = await self._acollect_map_summaries(map_chain, inputs["context"], question)
+                return reduce_prompt.invoke({"context": "\n\n".join(summaries), "question": question})
+
             return (
-                {"context": retriever, "question": RunnablePassthrough()}
-                | RunnableLambda(self.check_and_mark)
-                | RunnableLambda(map_reduce_func)
+                head
+                | RunnableLambda(map_reduce_func, afunc=amap_reduce_func)
                 | self.llm
                 | StrOutputParser()
                 )
@@ -367,29 +603,30 @@ class RAGEngineLCEL:
                 请输出更新后的最终答案："""
             )
 
+            initial_prompt = ChatPromptTemplate.from_template(
+                """根据以下上下文精准回答问题，只使用上下文信息，不要编造：
+                上下文：
+                {context}
+
+                问题：{question}
+
+                回答："""
+            )
+            initial_chain = initial_prompt | self.llm | StrOutputParser()
+            refine_chain = refine_prompt | self.llm | StrOutputParser()
+            score_chain = self._relevance_score_chain()
+
+            chains = (initial_chain, refine_chain, score_chain)
+
             def refine_func(inputs):
-                docs = inputs["context"]
-                question = inputs["question"]
-                # 初始答案为空
-                answer = "正在根据资料逐步生成答案……" 
-
-                for i, doc in enumerate(docs):
-                    # 准备本轮迭代的输入
-                    chain_input = refine_prompt.invoke({
-                        "existing_answer": answer,
-                        "context": doc.page_content,
-                        "question": question
-                    })
-                    # 调用模型，获取更新后的答案
-                    answer = self.llm.invoke(chain_input).content
-                    print(f"--- 处理第 {i+1} 个文档后，答案更新为 ---\n{answer}\n") # 调试用
-
-                return answer
+                return _run_steps(self._refine_steps(chains, inputs))
+
+            async def arefine_func(inputs):
+                return await _arun_steps(self._refine_steps(chains, inputs))
 
             return (
-                {"context": retriever, "question": RunnablePassthrough()}
-                | RunnableLambda(self.check_and_mark)
-                | RunnableLambda(refine_func)
+                head
+                | RunnableLambda(refine_func, afunc=arefine_func)
             )
 
 
@@ -443,6 +680,9 @@ if __name__ == "__main__":
     print("\n=== Refine ===")
     refine_result = engine.get_qa_chain("refine").invoke(question)
     print(refine_result)
+
+    print("\n=== Auto ===")
+    print(engine.get_qa_chain("auto").invoke(question))
     
 
 
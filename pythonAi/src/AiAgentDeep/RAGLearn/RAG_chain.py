@@ -14,12 +14,23 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownTex
 
 
 
+
 class RAGEngineLCEL:
     def __init__(self, persist_directory="./chroma_db",docs_path="./knowledge_base"): #向量库路径， 知识库文件夹路径
         self.persist_directory = persist_directory  # 路径
         self.docs_path = docs_path
 
+        # 嵌入结果缓存到磁盘，answer_with_file_context 对同一份上传文件不再重复嵌入；
+        # 在本目录单独运行脚本时没有 src 包，不带缓存直接调用接口
         self.embeddings = ZhipuAIEmbeddings(model="embedding-3", api_key=os.getenv("ZHIPUAI_API_KEY"))
+        try:
+            from src.Agent.embedding_cache import CachedEmbeddings
+            self.embeddings = CachedEmbeddings(
+                self.embeddings,
+                cache_path=os.path.join(persist_directory, "embedding_cache.sqlite3"),
+            )
+        except ImportError:
+            print("⚠️ 未找到 src.Agent.embedding_cache，嵌入结果不缓存")
 
         self.llm = ChatZhipuAI(model="glm-4.6v", temperature=0.0, api_key=os.getenv("ZHIPUAI_API_KEY"))
 
@@ -132,6 +132,20 @@ def build_vectorstore(docs: List[Document]) -> Chroma:
     return vectorstore
 
 
+def filter_signature(metadata_filter: Dict) -> tuple:
+    """过滤条件的规范化签名，用作检索器缓存键"""
+    return tuple(sorted((k, str(v)) for k, v in metadata_filter.items()))
+
+
+def metadata_matches(metadata: Dict, metadata_filter: Dict) -> bool:
+    """简单等值过滤（与 Chroma 的 {"key": value} 写法一致），值为列表时表示任选其一"""
+    for key, value in metadata_filter.items():
+        allowed = value if isinstance(value, (list, tuple, set)) else [value]
+        if metadata.get(key) not in allowed:
+            return False
+    return True
+
+
 class RAGPipeline:
     def __init__(self):
         self.docs = load_documents_with_metadata()
@@ -174,18 +188,31 @@ class RAGPipeline:
         
         
         # 关键词检索器（BM25）  关键词检索召回6个块
-        bm25_retriever = BM25Retriever.from_documents(self.docs)
-        bm25_retriever.k = 6
+        # 只构建一次，get_retriever 等处复用，不再每次请求重新分词建索引
+        self.bm25_retriever = BM25Retriever.from_documents(self.docs)
+        self.bm25_retriever.k = 6
+        # 过滤签名 -> 已构建好的过滤检索器
+        self._filtered_retrievers: Dict[tuple, Any] = {}
         
         # 混合检索（Ensemble）      EnsembleRetriever 组合检索器 权重分配
         self.ensemble_retriever = EnsembleRetriever(
-            retrievers=[semantic_retriever, bm25_retriever],
+            retrievers=[semantic_retriever, self.bm25_retriever],
             weights=[0.65, 0.35]  
         )
         
         # 重排序（rerank）   拿到两种检索召回的文档块， 通过rerank模型对召回的所有文档块打分， 最后返回最终的文档块
         #rerank 模型（这里是 ms-marco-MiniLM-L-12-v2）是一个小型交叉编码器（cross-encoder），它同时看 query + 文档全文，打出的分数更接近人类判断的相关性
-        compressor = FlashrankRerank(model="ms-marco-MiniLM-L-12-v2", top_n=4)
+        # 优先用进程内共享的重排服务（模型只加载一次，并发请求微批推理，分数有 LRU 缓存）；
+        # 在本目录单独运行脚本时没有 src 包，直接用 FlashrankRerank
+        try:
+            from src.Agent.reranker import RerankCompressor, get_reranker
+            reranker = get_reranker()
+        except ImportError:
+            reranker = None
+        if reranker is not None:
+            compressor = RerankCompressor(reranker=reranker, top_n=4)
+        else:
+            compressor = FlashrankRerank(model="ms-marco-MiniLM-L-12-v2", top_n=4)
         self.compression_retriever = ContextualCompressionRetriever(
             base_compressor=compressor,
             base_retriever=self.ensemble_retriever
@@ -194,15 +221,22 @@ class RAGPipeline:
     def get_retriever(self, metadata_filter: Optional[Dict] = None):
         """支持 metadata 过滤的 retriever"""
         if metadata_filter:
-            # 注意：EnsembleRetriever 本身不支持 filter，需要在子 retriever 上分别加
-            # 这里简化演示：只对语义部分加 filter（BM25 不支持 filter）
-            filtered_semantic = self.vectorstore.as_retriever(
-                search_kwargs={"k": 6, "filter": metadata_filter}
-            )
-            return EnsembleRetriever(
-                retrievers=[filtered_semantic, BM25Retriever.from_documents(self.docs, k=6)],
-                weights=[0.65, 0.35]
-            )
+            # EnsembleRetriever 本身不支持 filter，需要在子 retriever 上分别加；
+            # 同一过滤条件只构建一次，BM25 只在满足条件的文档子集上建索引
+            key = filter_signature(metadata_filter)
+            if key not in self._filtered_retrievers:
+                filtered_semantic = self.vectorstore.as_retriever(
+                    search_kwargs={"k": 6, "filter": metadata_filter}
+                )
+                subset = [d for d in self.docs if metadata_matches(d.metadata, metadata_filter)]
+                retrievers = [filtered_semantic]
+                if subset:
+                    retrievers.append(BM25Retriever.from_documents(subset, k=6))
+                self._filtered_retrievers[key] = EnsembleRetriever(
+                    retrievers=retrievers,
+                    weights=[0.65, 0.35][:len(retrievers)]
+                )
+            return self._filtered_retrievers[key]
         return self.compression_retriever
 
         
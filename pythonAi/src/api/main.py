@@ -16,14 +16,19 @@ import logging
 import re
 import uuid
 import asyncio
-from typing import Optional
-from fastapi import Request  
-from src.Agent.RAG_chain import RAGEngineLCEL
-from src.Agent.agentCore import create_ai_agent, get_api_key, get_memory_as_langchain_messages
-from src.Agent.memory import ConversationMemory
-from fastapi.responses import FileResponse
-from docx import Document
-from langchain_community.document_loaders import UnstructuredWordDocumentLoader,PyPDFLoader
+import hashlib
+import json
+import multiprocessing
+import time
+from typing import List, Optional
+from fastapi import Request, Response
+# 这里只导入轻量模块，应用可以立即开始监听；RAG 引擎、Agent、文档解析器（langchain_community / docx / unstructured）
+# 都在后台初始化或第一次用到时再导入
+from src.Agent.kb_manifest import KB_SUPPORTED_EXTS
+from src.Agent.ingest_jobs import IngestJobManager
+from src.Agent.memory import make_llm_summarizer
+from src.Agent.session_memory import SessionMemoryManager
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
 
 load_dotenv()
@@ -33,29 +38,127 @@ logger = logging.getLogger(__name__)
 # 全局变量
 rag_engine = None
 agent = None
-# 注意：生产环境应按会话管理memory，这里简单使用全局仅用于演示
-memory = ConversationMemory()
+ingest_jobs = None  # 知识库运行时入库任务
+# 按会话管理记忆：每个会话独立的 token 预算窗口，空闲会话自动淘汰（可选 SQLite 持久化）
+session_memory = SessionMemoryManager.from_env()
+
+SESSION_HEADER = "X-Session-Id"
+SESSION_COOKIE = "session_id"
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+def get_session_id(request: Request):
+    """从请求头或 Cookie 取会话id；没有或格式不合法时生成新的，返回 (会话id, 是否新建)"""
+    session_id = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    if session_id and _SESSION_ID_PATTERN.match(session_id):
+        return session_id, False
+    return uuid.uuid4().hex, True
+
+PERSIST_DIRECTORY = "./chroma_db"
+DOCS_PATH = "./knowledge_base"
+
+# 启动阶段：starting（后台初始化中）-> ready / failed
+startup_state = {"phase": "starting", "error": None, "started_at": time.time(), "ready_at": None}
+RETRY_AFTER_SECONDS = os.getenv("READY_RETRY_AFTER", "5")
+
+
+def init_services():
+    """重量级初始化（在后台线程执行）：RAG 引擎（扫描/解析/嵌入知识库）、入库任务、Agent"""
+    global rag_engine, agent, ingest_jobs
+    from src.Agent.RAG_chain import RAGEngineLCEL
+    from src.Agent.agentCore import create_ai_agent, create_summary_llm, get_api_key
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global rag_engine, agent
     logger.info("正在初始化 RAG 引擎...")
+    engine = RAGEngineLCEL(
+        persist_directory=PERSIST_DIRECTORY,
+        docs_path=DOCS_PATH
+    )
+    logger.info("✅ RAG 引擎初始化成功")
+    ingest_jobs = IngestJobManager.from_env(engine)
+
+    # 初始化Agent
+    api_key = get_api_key()
+    agent = create_ai_agent(api_key, engine)
+    logger.info("✅ Agent 初始化成功")
+    # 上传文件文本写入会话持久层：多 worker 部署时后续请求落到其他进程也能按 upload_id 取回
+    from src.Agent.tools import get_upload_store
+    get_upload_store().backend = session_memory.store
+    # 长会话的历史压缩用 LLM 增量摘要
+    session_memory.summarizer = make_llm_summarizer(create_summary_llm(api_key))
+    rag_engine = engine
+
+
+def _prepare_shared_index():
+    """独立进程里同步知识库并导出向量快照；进程退出时释放全部线程与连接"""
+    os.environ["RAG_RERANK"] = "0"  # 只做入库与导出，不需要重排模型
+    from src.Agent.RAG_chain import RAGEngineLCEL
+
+    RAGEngineLCEL(persist_directory=PERSIST_DIRECTORY, docs_path=DOCS_PATH)
+
+
+def warm_up():
+    """
+    多进程部署（gunicorn preload）时在主进程 fork 前调用：
+    1. 导入重量级模块，加载分词词典与 token 编码表，worker 以写时复制方式共享这部分内存
+    2. 启用向量快照时，在独立（spawn）进程里完成知识库同步与快照导出，worker 启动时只需映射快照，
+       也不会几个 worker 同时重复入库；主进程本身不创建线程池、数据库连接和推理会话（不能跨 fork 使用）
+    """
+    started = time.time()
+    import src.Agent.RAG_chain  # noqa: F401
+    import src.Agent.agentCore  # noqa: F401
+    from src.Agent.bm25_index import jieba
+    from src.Agent.token_utils import estimate_tokens
+
+    for module in ("langchain_community.document_loaders", "docx"):
+        try:
+            __import__(module)
+        except ImportError as e:
+            logger.warning(f"预加载 {module} 失败：{e}")
+    if jieba is not None:
+        jieba.initialize()
+    estimate_tokens("warm up")
+
+    if os.getenv("RAG_INDEX_SNAPSHOT", "0") == "1":
+        process = multiprocessing.get_context("spawn").Process(target=_prepare_shared_index, name="kb-prepare")
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            # 由 worker 启动时同步并导出快照：同步与导出持有知识库的跨进程写锁，
+            # 第一个拿到锁的 worker 完成后，其余 worker 读到最新清单，发现没有变化直接映射快照
+            logger.warning(f"知识库预同步进程异常退出（exit code {process.exitcode}）")
+    logger.info(f"✅ 预热完成，用时 {time.time() - started:.1f}s")
+
+
+async def initialize_in_background():
     try:
-        rag_engine = RAGEngineLCEL(
-            persist_directory="./chroma_db",
-            docs_path="./knowledge_base"
-        )
-        logger.info("✅ RAG 引擎初始化成功")
-        
-        # 初始化Agent
-        api_key = get_api_key()
-        agent = create_ai_agent(api_key, rag_engine)
-        logger.info("✅ Agent 初始化成功")
+        await asyncio.to_thread(init_services)
+        startup_state["phase"] = "ready"
+        startup_state["ready_at"] = time.time()
+        logger.info(f"✅ 服务就绪，初始化用时 {startup_state['ready_at'] - startup_state['started_at']:.1f}s")
     except Exception as e:
-        logger.error(f"初始化失败: {e}")
-        raise e
+        logger.error(f"初始化失败: {e}", exc_info=True)
+        startup_state["phase"] = "failed"
+        startup_state["error"] = str(e)
+
+
+def ensure_ready():
+    """初始化完成前，依赖 RAG 引擎/Agent 的接口返回 503 并提示稍后重试"""
+    if startup_state["phase"] != "ready":
+        detail = "服务初始化失败" if startup_state["phase"] == "failed" else "服务正在启动，请稍后重试"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": RETRY_AFTER_SECONDS})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 不在这里等待初始化：应用立即开始接受连接，就绪状态通过 /readyz 查询
+    startup_state.update(phase="starting", error=None, started_at=time.time(), ready_at=None)
+    init_task = asyncio.create_task(initialize_in_background())
     yield
     logger.info("API 服务正在关闭")
+    if not init_task.done():
+        init_task.cancel()
+    if ingest_jobs is not None:
+        ingest_jobs.shutdown()
 
 app = FastAPI(
     title="简历润色助手 API",
@@ -73,6 +176,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ---------- 存活与就绪探针 ----------
+@app.get("/healthz")
+async def healthz():
+    """存活探针：进程在运行即返回 200"""
+    return {"status": "ok", "phase": startup_state["phase"]}
+
+
+@app.get("/readyz")
+async def readyz():
+    """就绪探针：后台初始化完成后返回 200，之前返回 503 + Retry-After"""
+    body = {
+        "ready": startup_state["phase"] == "ready",
+        "phase": startup_state["phase"],
+        "error": startup_state["error"],
+        "elapsed_seconds": round((startup_state["ready_at"] or time.time()) - startup_state["started_at"], 2),
+    }
+    if body["ready"]:
+        return body
+    return JSONResponse(status_code=503, content=body, headers={"Retry-After": RETRY_AFTER_SECONDS})
+
 # ---------- 数据模型 ----------
 
 
@@ -81,39 +204,36 @@ class PolishRequest(BaseModel):
     style: str = "professional"
 
 
-from langchain_core.callbacks import BaseCallbackHandler
+def make_debug_config():
+    """Agent 调用配置（带调试回调）；langchain_core 的回调模块会连带导入 langsmith，放到第一次提问时再导入"""
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.runnables import RunnableConfig
 
-class DebugCallbackHandler(BaseCallbackHandler):
-    def on_agent_action(self, action, **kwargs):
-        logger.info(f"Agent Action: {action.log}")
-    def on_agent_finish(self, finish, **kwargs):
-        logger.info(f"Agent Finish: {finish.return_values}")
+    class DebugCallbackHandler(BaseCallbackHandler):
+        def on_agent_action(self, action, **kwargs):
+            logger.info(f"Agent Action: {action.log}")
+        def on_agent_finish(self, finish, **kwargs):
+            logger.info(f"Agent Finish: {finish.return_values}")
 
-from langchain_core.runnables import RunnableConfig
+    return RunnableConfig(callbacks=[DebugCallbackHandler()])
 
-@app.post("/ask")
-async def ask_endpoint(
-    raw_request: Request,  # 新增，用于手动读取 JSON
-    file: UploadFile = File(None),
-    question: str = Form(None)
-):
+async def read_ask_input(raw_request: Request, file: Optional[UploadFile], question: Optional[str],
+                         upload_id: Optional[str] = None):
     """
-    统一的问答接口：
-    - 无文件时，手动从请求体读取 JSON { "question": "..." }
-    - 有文件时，从表单字段获取 question
+    解析问答请求：返回 (用户问题, 上传文件文本, 发给 Agent 的消息, 上传id)，/ask 与 /ask/stream 共用
+    - 带文件：multipart 表单，question 为表单字段；同时传了 upload_id 时以新上传的文件为准
+    - 不带文件：multipart / urlencoded 表单时从表单字段读 question、upload_id，否则按 JSON 请求体解析
+    上传的文件注册到 UploadStore（解析、分割、嵌入只做一次），发给 Agent 的消息里只放文件句柄和上传id，
+    原文不进对话历史，需要时由 extract_relevant_chunks 按 upload_id 检索；后续轮次只传 upload_id 即可
     """
-    logger.info(f"=== /ask 请求参数 ===")
-    logger.info(f"file: {file}")
-    logger.info(f"question (form): {question}")
-    logger.info(f"===================")
-
-    global memory
-    if agent is None or rag_engine is None:
-        raise HTTPException(status_code=503, detail="服务未就绪")
+    from src.Agent.tools import get_upload_store
 
     user_input = ""
     file_text = ""
+    upload_store = get_upload_store()
     has_file = file is not None and file.filename is not None
+    content_type = raw_request.headers.get("content-type", "")
+    is_form = content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded"))
 
     if has_file:
         # ---------- 文件上传处理 ----------
@@ -132,17 +252,32 @@ async def ask_endpoint(
         if file_ext not in allowed_extensions:
             raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file_ext}")
 
-        # 保存临时文件并提取文本
-        tmp_path = None
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-                shutil.copyfileobj(file.file, tmp)
-                tmp_path = tmp.name
-            file_text = await extract_text_from_file(tmp_path, file_ext)
-        finally:
-            if tmp_path and os.path.exists(tmp_path):
-                os.unlink(tmp_path)
-            await file.close()
+        # 同一个文件已经注册过：跳过保存与解析
+        file_bytes = await file.read()
+        await file.close()
+        file_hash = hashlib.sha1(file_bytes).hexdigest()
+        upload_id = await asyncio.to_thread(upload_store.find_by_file_hash, file_hash) if upload_store is not None else None
+        if upload_id:
+            file_text = await asyncio.to_thread(upload_store.get_text, upload_id) or ""
+        if not file_text:
+            upload_id = None
+            # 保存临时文件并提取文本
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
+                    tmp.write(file_bytes)
+                    tmp_path = tmp.name
+                file_text = await extract_text_from_file(tmp_path, file_ext)
+            finally:
+                if tmp_path and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            if upload_store is not None and file_text.strip():
+                upload_id = await upload_store.aregister(file_text, filename=file.filename, file_hash=file_hash)
+    elif is_form:
+        # ---------- 不带文件的表单（例如后续轮次只传 upload_id） ----------
+        user_input = (question or "").strip()
+        if not user_input:
+            raise HTTPException(status_code=400, detail="字段 'question' 不能为空")
     else:
         # ---------- 纯文本 JSON 处理 ----------
         try:
@@ -154,42 +289,245 @@ async def ask_endpoint(
         user_input = body.get("question", "").strip()
         if not user_input:
             raise HTTPException(status_code=400, detail="字段 'question' 不能为空")
+        upload_id = upload_id or body.get("upload_id")
+
+    # 上传可能注册在其他 worker：aget 在进程内找不到时从共享持久层取回
+    if upload_id and not has_file and (upload_store is None or await upload_store.aget(upload_id) is None):
+        raise HTTPException(status_code=404, detail="上传文件不存在或已过期，请重新上传")
 
     # ---------- 构造 Agent 消息 ----------
-    if file_text:
+    if file_text and upload_id:
+        # 文件已注册：消息里只放句柄，原文按需由 extract_relevant_chunks 检索
+        filename = file.filename if has_file else ""
+        agent_message = f"用户上传了文件{f'《{filename}》' if filename else ''}（共{len(file_text)}字，原文未附在消息中）\n\n用户问题：{user_input}"
+    elif file_text:
+        # 没有 UploadStore（或文件注册失败）时只能把原文放进消息
         agent_message = f"用户上传了文件，内容如下：\n{file_text}\n\n用户问题：{user_input}"
     else:
         agent_message = user_input
+    if upload_id:
+        agent_message += f"\n\n（上传文件id：{upload_id}，调用 extract_relevant_chunks 时传入 upload_id 即可）"
 
-    # 添加到记忆并调用 Agent（保持不变）
-    memory.add_to_memory('user', agent_message)
-    langchain_messages = get_memory_as_langchain_messages(memory)
+    return user_input, file_text, agent_message, upload_id
+
+
+@app.post("/ask")
+async def ask_endpoint(
+    raw_request: Request,  # 新增，用于手动读取 JSON
+    response: Response,
+    file: UploadFile = File(None),
+    question: str = Form(None),
+    upload_id: str = Form(None)
+):
+    """
+    统一的问答接口：
+    - 无文件时，从 JSON 请求体 { "question": "...", "upload_id": "..." } 或表单字段读取
+    - 有文件时，从表单字段获取 question
+    """
+    logger.info(f"=== /ask 请求参数 ===")
+    logger.info(f"file: {file}")
+    logger.info(f"question (form): {question}")
+    logger.info(f"===================")
+
+    ensure_ready()
+    from src.Agent.agentCore import get_memory_as_langchain_messages
+
+    session_id, is_new_session = get_session_id(raw_request)
+    if is_new_session:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+
+    user_input, file_text, agent_message, upload_id = await read_ask_input(raw_request, file, question, upload_id)
+
+    # 添加到当前会话的记忆并调用 Agent（历史受 token 预算限制；压缩放到回答之后在后台做）
+    await session_memory.aadd_to_memory(session_id, 'user', agent_message, compact=False)
+    langchain_messages = get_memory_as_langchain_messages(session_memory.get(session_id))
 
     try:
-        config = RunnableConfig(callbacks=[DebugCallbackHandler()])
+        config = make_debug_config()
 
         input_dict = {"messages": langchain_messages}
 
-        loop = asyncio.get_event_loop()
-        # response = await loop.run_in_executor(None, agent.invoke, input_dict)
-
-        response = await loop.run_in_executor(None, lambda: agent.invoke(input_dict, config=config))
-        print(f"agent答案={response}")
+        # 原生异步调用：工具走各自的协程实现，不再把整个 agent.invoke 丢进默认线程池
+        result = await agent.ainvoke(input_dict, config=config)
+        print(f"agent答案={result}")
 
     # 提取答案
-        if hasattr(response, 'content'):
-            answer = response.content
-        elif isinstance(response, dict) and 'messages' in response:
+        if hasattr(result, 'content'):
+            answer = result.content
+        elif isinstance(result, dict) and 'messages' in result:
         # 如果返回的是包含消息的字典，取最后一条消息的内容
-            last_message = response['messages'][-1]
+            last_message = result['messages'][-1]
             answer = last_message.content if hasattr(last_message, 'content') else str(last_message)
         else:
-            answer = str(response)
-        memory.add_to_memory('assistant', answer)
-        return {"question": user_input, "answer": answer}
+            answer = str(result)
+        await session_memory.aadd_to_memory(session_id, 'assistant', answer, compact=False)
+        session_memory.schedule_compaction(session_id)
+        return {"question": user_input, "answer": answer, "session_id": session_id, "upload_id": upload_id}
     except Exception as e:
         logger.error(f"Agent调用失败: {e}", exc_info=True)  # 打印详细错误栈
         raise HTTPException(status_code=500, detail="处理失败")
+def sse_event(event: str, data: dict) -> str:
+    """按 Server-Sent Events 格式编码一条事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_agent_events(session_id: str, user_input: str, langchain_messages, upload_id: Optional[str] = None):
+    """
+    用 agent.astream 同时订阅两种流模式：
+    - messages：模型逐 token 输出，转成 token 事件
+    - updates：每一步结束后的状态更新，转成 tool_call / tool_result 事件，并记录最后一条消息
+    最后一条消息即最终答案（polish_text 是 return_direct 工具，此时最终答案是工具结果）
+    """
+    yield sse_event("start", {"session_id": session_id, "question": user_input, "upload_id": upload_id})
+    answer = ""
+    try:
+        config = make_debug_config()
+        async for mode, chunk in agent.astream(
+            {"messages": langchain_messages},
+            config=config,
+            stream_mode=["updates", "messages"],
+        ):
+            if mode == "messages":
+                message_chunk, metadata = chunk
+                # 只转发模型节点的文本增量，工具节点的输出在 updates 里整体发送
+                if metadata.get("langgraph_node") == "model" and isinstance(message_chunk.content, str) and message_chunk.content:
+                    yield sse_event("token", {"delta": message_chunk.content})
+                continue
+
+            for step, data in chunk.items():
+                messages = (data or {}).get("messages") or []
+                for message in messages:
+                    for tool_call in getattr(message, "tool_calls", None) or []:
+                        yield sse_event("tool_call", {"name": tool_call["name"], "args": tool_call["args"]})
+                    if step == "tools":
+                        yield sse_event("tool_result", {"name": getattr(message, "name", ""), "content": str(message.content)[:500]})
+                if messages:
+                    last_message = messages[-1]
+                    answer = last_message.content if hasattr(last_message, "content") else str(last_message)
+
+        await session_memory.aadd_to_memory(session_id, 'assistant', answer, compact=False)
+        session_memory.schedule_compaction(session_id)
+        yield sse_event("final", {"question": user_input, "answer": answer, "session_id": session_id})
+    except asyncio.CancelledError:
+        # 客户端断开连接：停止生成，不写入记忆
+        logger.info(f"会话 {session_id} 的流式输出被客户端中断")
+        raise
+    except Exception as e:
+        logger.error(f"Agent流式调用失败: {e}", exc_info=True)
+        yield sse_event("error", {"detail": "处理失败"})
+
+
+@app.post("/ask/stream")
+async def ask_stream_endpoint(
+    raw_request: Request,
+    file: UploadFile = File(None),
+    question: str = Form(None),
+    upload_id: str = Form(None)
+):
+    """
+    流式问答接口（SSE），请求格式与 /ask 相同。事件类型：
+    start / token（模型输出增量）/ tool_call / tool_result / final（最终答案）/ error
+    """
+    ensure_ready()
+    from src.Agent.agentCore import get_memory_as_langchain_messages
+
+    session_id, is_new_session = get_session_id(raw_request)
+    user_input, file_text, agent_message, upload_id = await read_ask_input(raw_request, file, question, upload_id)
+
+    await session_memory.aadd_to_memory(session_id, 'user', agent_message, compact=False)
+    langchain_messages = get_memory_as_langchain_messages(session_memory.get(session_id))
+
+    streaming_response = StreamingResponse(
+        stream_agent_events(session_id, user_input, langchain_messages, upload_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # 关闭反向代理缓冲
+    )
+    if is_new_session:
+        streaming_response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return streaming_response
+
+# ---------- 取回被折叠的上传文件原文 ----------
+@app.get("/attachments/{attachment_id}")
+async def get_attachment(attachment_id: str, request: Request):
+    """历史压缩后上传文件原文以附件句柄出现在对话里，按需取回原文"""
+    session_id, _ = get_session_id(request)
+    text = session_memory.get_attachment(session_id, attachment_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="附件不存在或会话已过期")
+    return {"attachment_id": attachment_id, "text": text}
+
+# ---------- 缓存命中率 ----------
+@app.get("/stats/cache")
+async def cache_stats():
+    """查看检索结果缓存与嵌入缓存的命中率"""
+    ensure_ready()
+    return rag_engine.cache_stats()
+
+# ---------- 导入耗时分析 ----------
+@app.get("/debug/importtime")
+async def debug_importtime(module: str = "src.api.main", top: int = 20):
+    """在子进程里导入模块并返回 -X importtime 汇总（需设置 DEBUG_IMPORTTIME=1；不依赖服务就绪）"""
+    if os.getenv("DEBUG_IMPORTTIME") != "1":
+        raise HTTPException(status_code=404, detail="Not Found")
+    from src.Agent.import_profiler import profile_imports
+
+    try:
+        return await asyncio.to_thread(profile_imports, module, max(1, min(top, 200)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ---------- 知识库运行时入库 ----------
+def _require_ingest_jobs():
+    ensure_ready()
+    return ingest_jobs
+
+
+@app.post("/kb/documents", status_code=202)
+async def add_kb_documents(files: List[UploadFile] = File(...)):
+    """上传文档到知识库：文件落盘后提交后台入库任务，立即返回任务id"""
+    jobs = _require_ingest_jobs()
+    # 先校验全部文件再落盘：有一个不合法就整批拒绝，不会只写进去一部分
+    filenames = []
+    for file in files:
+        filename = os.path.basename(file.filename or "")
+        ext = os.path.splitext(filename)[1].lower()
+        if not filename or ext not in KB_SUPPORTED_EXTS:
+            raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file.filename}（支持 {', '.join(KB_SUPPORTED_EXTS)}）")
+        filenames.append(filename)
+    saved = []
+    for file, filename in zip(files, filenames):
+        content = await file.read()
+        path = os.path.join(rag_engine.docs_path, filename)
+        # 先写临时文件再替换，启动扫描不会看到写了一半的文件
+        tmp_path = path + f".{uuid.uuid4().hex[:8]}.part"
+        await asyncio.to_thread(Path(tmp_path).write_bytes, content)
+        os.replace(tmp_path, path)
+        saved.append(path)
+    job = jobs.submit(saved)
+    return job.to_dict()
+
+
+@app.get("/kb/jobs")
+async def list_kb_jobs():
+    return {"jobs": _require_ingest_jobs().list_jobs()}
+
+
+@app.get("/kb/jobs/{job_id}")
+async def get_kb_job(job_id: str):
+    job = _require_ingest_jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job.to_dict()
+
+
+@app.delete("/kb/jobs/{job_id}")
+async def cancel_kb_job(job_id: str):
+    """取消入库任务：排队中直接取消，执行中处理完当前文件后停止"""
+    job = _require_ingest_jobs().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job.to_dict()
+
 # ---------- 润色下载接口（不变）----------
 @app.post("/download_docx", response_class=FileResponse)
 async def download_docx(request: PolishRequest, background_tasks: BackgroundTasks):
@@ -197,6 +535,8 @@ async def download_docx(request: PolishRequest, background_tasks: BackgroundTask
     if not request.text or not request.text.strip():
         raise HTTPException(status_code=400, detail="文本不能为空")
 
+    from docx import Document  # 只有下载接口用到，第一次调用时再导入
+
     doc = Document()
     doc.add_heading('润色后的文本', level=1)
     for para in request.text.split('\n'):
@@ -226,7 +566,8 @@ async def extract_text_from_file(file_path: str, file_ext: str) -> str:
     text = ""
     try:
         if file_ext == '.pdf':
-            
+            from langchain_community.document_loaders import PyPDFLoader
+
             loader = PyPDFLoader(file_path)
             docs = loader.load()
             text = "\n".join([doc.page_content for doc in docs])
@@ -237,6 +578,8 @@ async def extract_text_from_file(file_path: str, file_ext: str) -> str:
                 text = f.read()
         
         elif file_ext == '.docx':
+            from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+
             loader = UnstructuredWordDocumentLoader(file_path, mode="single")
             docs = loader.load()
             text = docs[0].page_content
@@ -319,20 +319,15 @@ async def answer_with_file_context(question: str, file_text: str, rag_engine) ->
     混合检索方案：将文件文本分割、向量化后，与知识库一起检索。
     """
     from langchain_text_splitters import RecursiveCharacterTextSplitter
-    from langchain_community.vectorstores import Chroma
+    from src.Agent.vector_index import NumpyVectorIndex
     
 
     # 1. 分割文件文本
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
     file_docs = text_splitter.create_documents([file_text])
     
-    # 2. 为文件块创建临时向量库（使用内存存储，无需持久化）
-    # 这里使用 Chroma 的 from_documents 并设置 persist_directory=None 使其在内存中运行
-    file_vectorstore = Chroma.from_documents(
-        documents=file_docs,
-        embedding=rag_engine.embeddings,
-        persist_directory=None  # 内存模式
-    )
+    # 2. 为文件块创建临时向量索引（进程内 NumPy 矩阵，不再为几块文本创建 Chroma 集合）
+    file_vectorstore = await NumpyVectorIndex.afrom_documents(file_docs, rag_engine.embeddings)
     
     # 3. 从文件向量库检索相关块
     file_retriever = file_vectorstore.as_retriever(search_kwargs={"k": 2})
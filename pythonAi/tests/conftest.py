@@ -0,0 +1,54 @@
+'''
+测试公共夹具：假嵌入模型 + 本地 Chroma（临时目录），不访问智谱接口与 chromadb 容器
+'''
+
+import os
+import sys
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeEmbeddings(Embeddings):
+    """按字符分桶的确定性向量，内容相近的文本向量也相近"""
+
+    model = "fake-embedding"
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def embed_documents(self, texts):
+        vectors = []
+        for text in texts:
+            vec = [0.0] * 32
+            for ch in text:
+                vec[ord(ch) % 32] += 1.0
+            norm = sum(x * x for x in vec) ** 0.5 or 1.0
+            vectors.append([x / norm for x in vec])
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def engine_env(monkeypatch, tmp_path):
+    """构建 RAGEngineLCEL 所需的环境：本地 Chroma、串行加载、关闭重排与健康探测"""
+    monkeypatch.setenv("ZHIPUAI_API_KEY", "test.key")
+    monkeypatch.setenv("CHROMA_MODE", "local")
+    monkeypatch.setenv("CHROMA_PROBE_INTERVAL", "0")
+    monkeypatch.setenv("RAG_RERANK", "0")
+    monkeypatch.setenv("KB_LOADER_WORKERS", "1")
+    monkeypatch.setenv("ANONYMIZED_TELEMETRY", "False")
+    import src.Agent.RAG_chain as rag_chain
+
+    monkeypatch.setattr(rag_chain, "ZhipuAIEmbeddings", FakeEmbeddings)
+    kb_dir = tmp_path / "kb"
+    kb_dir.mkdir()
+
+    def make_engine():
+        return rag_chain.RAGEngineLCEL(persist_directory=str(tmp_path / "db"), docs_path=str(kb_dir))
+
+    return kb_dir, make_engine
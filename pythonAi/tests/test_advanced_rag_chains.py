@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from src.AiAgentDeep.RAGLearn.AdvancedRAG import RAGEngineLCEL
+
+
+def fake_llm(prompt_value):
+    text = prompt_value.to_string()
+    if "分数：" in text:
+        return "8"
+    return "用 STAR 法则描述项目，成果要量化。"
+
+
+@pytest.fixture
+def engine():
+    # 只测链的组合逻辑，不连接向量库和智谱接口
+    engine = RAGEngineLCEL.__new__(RAGEngineLCEL)
+    engine.llm = RunnableLambda(fake_llm)
+    engine.map_max_concurrency = 4
+    engine.refine_min_score = 5.0
+    engine.refine_stable_ratio = 0.95
+    engine.refine_patience = 1
+    engine.context_window = 128000
+    engine.answer_reserve = 4096
+    engine.latency_slo = 15.0
+    engine.multi_source_threshold = 3
+    engine.chain_latency = {}
+    engine.llm_call_seconds = 3.0
+    engine._routed_chains = {}
+    return engine
+
+
+def make_inputs():
+    docs = [Document(page_content=f"规则 {i}", metadata={"source": "rules.md"}) for i in range(4)]
+    return {"context": docs, "question": "怎么写项目经历"}
+
+
+def test_refine_sync_and_async_share_progress_and_early_stop(engine, capsys):
+    chain = engine.get_qa_chain("refine", with_retriever=False)
+    sync_answer = chain.invoke(make_inputs())
+    sync_out = capsys.readouterr().out
+    async_answer = asyncio.run(chain.ainvoke(make_inputs()))
+    async_out = capsys.readouterr().out
+
+    assert sync_answer == async_answer
+    for out in (sync_out, async_out):
+        assert "处理第 2 个相关文档后" in out
+        assert "答案已稳定，跳过剩余 2 个文档" in out
+
+
+def test_route_sync_and_async_record_latency(engine, capsys):
+    router = engine._build_router()
+    assert router.invoke(make_inputs()) == asyncio.run(router.ainvoke(make_inputs()))
+    assert capsys.readouterr().out.count("链型路由：stuff") == 2
+    assert "stuff" in engine.chain_latency
+    assert router.invoke({"__no_answer__": True}).startswith("抱歉")
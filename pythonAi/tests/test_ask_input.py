@@ -0,0 +1,47 @@
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.testclient import TestClient
+
+import src.Agent.tools as tools
+from src.Agent.upload_store import UploadStore
+from src.api.main import read_ask_input
+
+from conftest import FakeEmbeddings
+
+
+def make_client(monkeypatch):
+    monkeypatch.setattr(tools, "_upload_store", UploadStore(FakeEmbeddings()))
+    app = FastAPI()
+
+    @app.post("/ask")
+    async def ask(raw_request: Request, file: UploadFile = File(None),
+                  question: str = Form(None), upload_id: str = Form(None)):
+        user_input, file_text, agent_message, upload_id = await read_ask_input(raw_request, file, question, upload_id)
+        return {"question": user_input, "agent_message": agent_message, "upload_id": upload_id}
+
+    return TestClient(app)
+
+
+def test_upload_then_follow_up_with_form_upload_id(monkeypatch):
+    client = make_client(monkeypatch)
+    resume = "张三 后端工程师 五年 Python 经验，负责检索服务的性能优化。" * 40
+
+    first = client.post("/ask", data={"question": "帮我润色"},
+                        files={"file": ("resume.txt", resume.encode("utf-8"), "text/plain")})
+    assert first.status_code == 200
+    upload_id = first.json()["upload_id"]
+    assert upload_id.startswith("up-")
+    # 原文不进消息，只带句柄和上传id
+    assert resume not in first.json()["agent_message"]
+    assert upload_id in first.json()["agent_message"]
+
+    # 不带文件的表单：question / upload_id 从表单字段读取，而不是按 JSON 解析
+    follow_up = client.post("/ask", data={"question": "再精简一点", "upload_id": upload_id})
+    assert follow_up.status_code == 200
+    assert follow_up.json()["question"] == "再精简一点"
+    assert follow_up.json()["upload_id"] == upload_id
+
+    as_json = client.post("/ask", json={"question": "再精简一点", "upload_id": upload_id})
+    assert as_json.json()["upload_id"] == upload_id
+
+    missing = client.post("/ask", data={"question": "再精简一点", "upload_id": "up-missing"})
+    assert missing.status_code == 404
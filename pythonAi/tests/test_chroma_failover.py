@@ -0,0 +1,37 @@
+import threading
+
+import chromadb
+from chromadb.config import Settings
+
+
+def test_failover_swaps_store_before_resync_and_holds_kb_lock(engine_env, tmp_path):
+    kb_dir, make_engine = engine_env
+    (kb_dir / "rules.md").write_text("# 规则\n简历成果要量化，使用 STAR 法则描述项目。", encoding="utf-8")
+    engine = make_engine()
+    old_store = engine.vectorstore
+
+    local = chromadb.PersistentClient(path=str(tmp_path / "failover"), settings=Settings(anonymized_telemetry=False))
+    seen = {}
+    ingest_finished = threading.Event()
+    real_sync = engine._sync_knowledge_base
+
+    def sync(vectorstore):
+        seen["swapped"] = engine.vectorstore is vectorstore and engine.vectorstore is not old_store
+        seen["locked"] = engine._kb_lock.depth > 0
+        # 补齐期间另一个线程的入库要等待写锁
+        extra = kb_dir / "extra.md"
+        extra.write_text("在校期间获得国家奖学金。", encoding="utf-8")
+        worker = threading.Thread(target=lambda: (engine.ingest_files([str(extra)]), ingest_finished.set()))
+        worker.start()
+        seen["ingest_blocked"] = not ingest_finished.wait(0.5)
+        real_sync(vectorstore)
+        seen["worker"] = worker
+
+    engine._sync_knowledge_base = sync
+    engine._on_chroma_failover(local)
+    seen["worker"].join(10)
+
+    assert seen["swapped"] and seen["locked"] and seen["ingest_blocked"]
+    assert ingest_finished.is_set()
+    assert engine.vectorstore._collection.count() > 0
+    assert engine.manifest.chunk_ids(str(kb_dir / "extra.md"))
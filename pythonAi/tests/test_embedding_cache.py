@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from src.Agent.embedding_cache import CachedEmbeddings, EmbeddingDiskCache
+
+from conftest import FakeEmbeddings
+
+
+def test_async_cache_io_runs_off_the_event_loop(tmp_path):
+    cache = EmbeddingDiskCache(str(tmp_path / "cache.sqlite3"))
+    embeddings = CachedEmbeddings(FakeEmbeddings(), cache=cache)
+    loop_threads = set()
+    io_threads = set()
+    real_get, real_put = cache.get_many, cache.put_many
+
+    def get_many(keys):
+        io_threads.add(threading.get_ident())
+        return real_get(keys)
+
+    def put_many(items):
+        io_threads.add(threading.get_ident())
+        return real_put(items)
+
+    cache.get_many, cache.put_many = get_many, put_many
+
+    async def run():
+        loop_threads.add(threading.get_ident())
+        first = await embeddings.aembed_documents(["简历", "规则"])
+        second = await embeddings.aembed_documents(["简历", "规则"])
+        return first, second
+
+    first, second = asyncio.run(run())
+    np.testing.assert_allclose(first, second, rtol=1e-6)  # 缓存里是 float32
+    assert embeddings.hits == 2
+    assert io_threads and not (io_threads & loop_threads)
+
+
+def test_query_vectors_stay_out_of_the_disk_cache(tmp_path):
+    cache = EmbeddingDiskCache(str(tmp_path / "cache.sqlite3"))
+    embeddings = CachedEmbeddings(FakeEmbeddings(), cache=cache, query_cache_size=2)
+    for text in ["问题一", "问题二", "问题一", "问题三"]:
+        embeddings.embed_query(text)
+    asyncio.run(embeddings.aembed_query("问题三"))
+
+    assert cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 0
+    assert (embeddings.query_hits, embeddings.query_misses) == (2, 3)
+    assert len(embeddings._query_vectors) == 2
+
+
+def test_eviction_runs_every_n_writes(tmp_path):
+    cache = EmbeddingDiskCache(str(tmp_path / "cache.sqlite3"), max_entries=10, evict_check_every=5)
+    checks = []
+    real_evict = cache._evict_locked
+
+    def evict():
+        checks.append(1)
+        real_evict()
+
+    cache._evict_locked = evict
+    for i in range(12):
+        cache.put_many({f"k{i}": [float(i)] * 4})
+
+    assert len(checks) == 2
+    count = cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    assert count <= 12
+    cache.put_many({f"b{i}": [1.0] * 4 for i in range(5)})
+    assert cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] <= 10
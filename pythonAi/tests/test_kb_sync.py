@@ -0,0 +1,73 @@
+import os
+
+import src.Agent.doc_pipeline as doc_pipeline
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    # 保证 mtime 变化能被清单比对发现
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+
+def test_failed_load_keeps_old_chunks_and_retries(engine_env, monkeypatch):
+    kb_dir, make_engine = engine_env
+    resume = kb_dir / "resume.md"
+    _write(resume, "# 项目经历\n负责检索系统的设计与优化，延迟降低百分之四十。")
+    _write(kb_dir / "rules.txt", "简历规则：成果要量化。")
+
+    engine = make_engine()
+    path = str(resume)
+    old_ids = engine.manifest.chunk_ids(path)
+    old_hash = engine.manifest.entries[path]["hash"]
+    assert old_ids
+
+    # 文件被修改，但这次加载失败（例如 PDF 暂时解析出错）
+    _write(resume, "# 项目经历\n负责检索系统的设计与优化，延迟降低百分之五十。")
+    real_load = doc_pipeline.load_and_split_file
+
+    def flaky_load(file_path):
+        if file_path == path:
+            raise RuntimeError("parse error")
+        return real_load(file_path)
+
+    monkeypatch.setattr(doc_pipeline, "load_and_split_file", flaky_load)
+    engine = make_engine()
+    # 旧块仍在向量库与 BM25 里，清单没有记录新的哈希
+    assert engine.manifest.chunk_ids(path) == old_ids
+    assert engine.manifest.entries[path]["hash"] == old_hash
+    assert len(engine.vectorstore._collection.get(ids=old_ids)["ids"]) == len(old_ids)
+    assert [doc.id for doc in engine.bm25.get_documents(old_ids)] == old_ids
+
+    # 加载恢复正常后，下次同步重新入库这个文件
+    monkeypatch.setattr(doc_pipeline, "load_and_split_file", real_load)
+    engine = make_engine()
+    new_ids = engine.manifest.chunk_ids(path)
+    assert new_ids and new_ids != old_ids
+    assert engine.manifest.entries[path]["hash"] != old_hash
+    assert engine.vectorstore._collection.get(ids=old_ids)["ids"] == []
+    texts = engine.vectorstore._collection.get(ids=new_ids)["documents"]
+    assert any("百分之五十" in text for text in texts)
+
+
+def test_failed_vector_write_leaves_no_lexical_rows(engine_env, monkeypatch):
+    import pytest
+
+    from src.Agent.ingest_writer import EmbeddingWriter
+
+    kb_dir, make_engine = engine_env
+    (kb_dir / "rules.md").write_text("# 规则\n简历成果要量化，使用 STAR 法则描述项目。", encoding="utf-8")
+    engine = make_engine()
+
+    async def failing_write(self, batch, bucket, semaphore):
+        raise RuntimeError("嵌入接口不可用")
+
+    monkeypatch.setattr(EmbeddingWriter, "_write_batch", failing_write)
+    extra = kb_dir / "extra.md"
+    extra.write_text("# 新增\n数学建模竞赛一等奖。", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        engine.ingest_files([str(extra)])
+
+    assert not engine.bm25.search_documents("数学建模", 5)
+    assert not engine.facets.ids_for({"source": str(extra)})
+    assert not engine.manifest.chunk_ids(str(extra))
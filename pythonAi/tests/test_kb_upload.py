@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import src.Agent.doc_pipeline as doc_pipeline
+import src.api.main as main
+
+
+def test_invalid_file_rejects_the_whole_batch(monkeypatch, tmp_path):
+    submitted = []
+    monkeypatch.setattr(main, "_require_ingest_jobs", lambda: SimpleNamespace(submit=submitted.append))
+    monkeypatch.setattr(main, "rag_engine", SimpleNamespace(docs_path=str(tmp_path)))
+
+    response = TestClient(main.app).post("/kb/documents", files=[
+        ("files", ("rules.md", "# 规则".encode("utf-8"), "text/markdown")),
+        ("files", ("virus.exe", b"MZ", "application/octet-stream")),
+    ])
+
+    assert response.status_code == 400
+    assert list(tmp_path.iterdir()) == []
+    assert submitted == []
+
+
+def test_cancel_is_checked_before_loading_the_next_file(engine_env, monkeypatch):
+    kb_dir, make_engine = engine_env
+    engine = make_engine()
+    paths = []
+    for i in range(3):
+        path = kb_dir / f"rules{i}.md"
+        path.write_text(f"# 规则{i}\n成果要量化，第 {i} 条。", encoding="utf-8")
+        paths.append(str(path))
+
+    loaded = []
+    real_load = doc_pipeline.load_and_split_file
+
+    def counting_load(file_path):
+        loaded.append(file_path)
+        return real_load(file_path)
+
+    monkeypatch.setattr(doc_pipeline, "load_and_split_file", counting_load)
+    checks = iter([False, True])
+    engine.ingest_files(paths, should_cancel=lambda: next(checks, True))
+
+    assert loaded == paths[:1]
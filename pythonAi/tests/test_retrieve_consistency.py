@@ -0,0 +1,18 @@
+import asyncio
+
+import pytest
+
+
+@pytest.mark.parametrize("search_type", ["mmr", "similarity", "fast_mmr", "hybrid"])
+def test_sync_and_async_retrieve_agree(engine_env, search_type):
+    kb_dir, make_engine = engine_env
+    (kb_dir / "rules.md").write_text(
+        "# 规则\n简历成果要量化。\n\n## STAR\n使用 STAR 法则描述项目经历。\n\n## 格式\n简历控制在一页以内，突出关键技能。",
+        encoding="utf-8",
+    )
+    (kb_dir / "awards.txt").write_text("获得国家奖学金；数学建模竞赛一等奖；发表论文两篇。", encoding="utf-8")
+    engine = make_engine()
+
+    sync_docs = engine.retrieve("项目经历怎么量化", k=3, search_type=search_type)
+    async_docs = asyncio.run(engine.aretrieve("项目经历怎么量化", k=3, search_type=search_type))
+    assert [doc.page_content for doc in sync_docs] == [doc.page_content for doc in async_docs]
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+from src.Agent.memory import ConversationMemory
+from src.Agent.session_memory import SessionMemoryManager
+
+
+def test_compaction_runs_after_the_answer_in_the_background():
+    calls = []
+
+    def summarizer(existing, messages):
+        calls.append(len(messages))
+        return "摘要"
+
+    manager = SessionMemoryManager(compact_threshold=50, summarizer=summarizer)
+
+    async def run():
+        for i in range(4):
+            await manager.aadd_to_memory("s1", "user", f"问题{i} " + "内容" * 40, compact=False)
+            await manager.aadd_to_memory("s1", "assistant", f"回答{i}", compact=False)
+        # 提问路径上不压缩
+        assert calls == []
+        task = manager.schedule_compaction("s1")
+        assert task is not None
+        await task
+
+    asyncio.run(run())
+    memory = manager.get("s1")
+    assert calls and memory.summary == "摘要"
+    assert memory.getMessageCount() == memory.keep_recent
+
+
+def test_messages_added_while_summarizing_are_kept():
+    started, release = threading.Event(), threading.Event()
+
+    def slow_summarizer(existing, messages):
+        started.set()
+        release.wait(5)
+        return "摘要"
+
+    memory = ConversationMemory(compact_threshold=50, summarizer=slow_summarizer, keep_recent=2)
+    for i in range(6):
+        memory.add_to_memory("user", f"消息{i} " + "内容" * 20, compact=False)
+    worker = threading.Thread(target=memory.compact)
+    worker.start()
+    assert started.wait(5)
+    memory.add_to_memory("user", "摘要期间的新消息", compact=False)
+    release.set()
+    worker.join(5)
+
+    contents = [m["content"] for m in memory.getAllMemoryList()]
+    assert contents[0].endswith("摘要")
+    assert contents[-1] == "摘要期间的新消息"
+    assert len(contents) == 1 + 2 + 1
+    assert memory.total_tokens == sum(memory._token_counts)
+
+
+def test_attachments_and_archive_are_bounded():
+    memory = ConversationMemory(compact_threshold=10, max_attachments=2, max_archived=3, keep_recent=1)
+    for i in range(5):
+        file_text = f"第{i}份简历 " + "经历" * 300
+        memory.add_to_memory("user", f"用户上传了文件，内容如下：\n{file_text}\n\n用户问题：润色{i}")
+        memory.add_to_memory("assistant", f"回答{i}")
+    assert len(memory.attachments) <= 2
+    assert len(memory.archived) <= 3
+
+
+def test_summary_and_attachments_survive_a_worker_hop(tmp_path):
+    db_path = str(tmp_path / "sessions.sqlite3")
+    worker_a = SessionMemoryManager(db_path=db_path, compact_threshold=80, shared=True,
+                                    summarizer=lambda existing, messages: f"摘要覆盖 {len(messages)} 条")
+    worker_b = SessionMemoryManager(db_path=db_path, compact_threshold=80, shared=True)
+    file_text = "负责订单服务重构，接口延迟降低 40%。" * 40
+    worker_a.add_to_memory("s1", "user", f"用户上传了文件，内容如下：\n{file_text}\n\n用户问题：润色", compact=False)
+    for i in range(5):
+        worker_a.add_to_memory("s1", "assistant", f"回答{i} " + "内容" * 20, compact=False)
+
+    async def compact():
+        await worker_a.schedule_compaction("s1")
+
+    asyncio.run(compact())
+    compacted = worker_a.get("s1")
+    assert compacted.summary.startswith("摘要覆盖")
+
+    # 下一轮落到 worker B：恢复摘要与附件，摘要已覆盖的消息不再加载
+    worker_b.add_to_memory("s1", "user", "再精简一点", compact=False)
+    restored = worker_b.get("s1")
+    assert restored.summary == compacted.summary
+    assert restored.attachments == compacted.attachments
+    contents = [m["content"] for m in restored.getAllMemoryList()]
+    assert contents[0].endswith(compacted.summary)
+    assert contents[1:] == [m["content"] for m in compacted.getAllMemoryList()[1:]] + ["再精简一点"]
+
+    # 再回到 worker A：发现 B 写过新消息后重新加载，摘要仍在
+    assert worker_a.get("s1").summary == compacted.summary
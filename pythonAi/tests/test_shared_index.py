@@ -0,0 +1,132 @@
+'''
+多 worker 共用同一个持久化目录：一个 worker 入库后，其他 worker 检索时能看到新版本，清单不会互相覆盖
+（同一进程里的两个引擎实例各自持有锁文件句柄，flock 互斥与跨进程时相同）
+'''
+
+
+def _doc_ids(docs):
+    return {doc.metadata.get("source") for doc in docs}
+
+
+def test_ingest_in_one_worker_is_visible_to_others(engine_env, monkeypatch):
+    monkeypatch.setenv("RAG_INDEX_SNAPSHOT", "1")
+    kb_dir, make_engine = engine_env
+    (kb_dir / "rules.md").write_text("# 规则\n简历成果要量化，使用 STAR 法则描述项目。", encoding="utf-8")
+
+    worker_a = make_engine()
+    worker_b = make_engine()
+    assert worker_a.kb_version == worker_b.kb_version
+    assert worker_b.cache_stats()["snapshot"]["active"]
+
+    # worker A 运行时入库
+    new_file = kb_dir / "extra.md"
+    new_file.write_text("# 新增\n在校期间获得国家奖学金，发表论文两篇。", encoding="utf-8")
+    worker_a.ingest_files([str(new_file)])
+    assert worker_a.kb_version != worker_b.kb_version
+
+    # worker B 下一次检索时发现新快照，检索结果包含新文档
+    docs = worker_b.retrieve("国家奖学金 论文", k=3, search_type="similarity")
+    assert worker_b.kb_version == worker_a.kb_version
+    assert worker_b.cache_stats()["snapshot"]["active"]
+    assert str(new_file) in _doc_ids(docs)
+
+    # worker B 再入库另一个文件：先读入 A 写过的清单，不会把 A 的条目覆盖掉
+    third = kb_dir / "awards.txt"
+    third.write_text("获得数学建模竞赛一等奖。", encoding="utf-8")
+    worker_b.ingest_files([str(third)])
+    worker_a.retrieve("数学建模", k=3, search_type="similarity")
+    for worker in (worker_a, worker_b):
+        worker.manifest.reload()
+        assert worker.manifest.chunk_ids(str(new_file))
+        assert worker.manifest.chunk_ids(str(third))
+    assert worker_a.kb_version == worker_b.kb_version
+
+
+def _hold_lock(lock_path, acquired, release):
+    from src.Agent.kb_manifest import InterProcessLock
+
+    with InterProcessLock(lock_path):
+        acquired.set()
+        release.wait(5)
+
+
+def test_kb_lock_excludes_other_processes(tmp_path):
+    import multiprocessing
+    import threading
+    import time
+
+    from src.Agent.kb_manifest import InterProcessLock
+
+    ctx = multiprocessing.get_context("fork")
+    acquired, release = ctx.Event(), ctx.Event()
+    lock_path = str(tmp_path / "kb.lock")
+    child = ctx.Process(target=_hold_lock, args=(lock_path, acquired, release))
+    child.start()
+    assert acquired.wait(5)
+
+    got_lock = threading.Event()
+
+    def take():
+        with InterProcessLock(lock_path):
+            got_lock.set()
+
+    taker = threading.Thread(target=take)
+    taker.start()
+    time.sleep(0.3)
+    assert not got_lock.is_set()  # 子进程持有锁期间拿不到
+    release.set()
+    taker.join(5)
+    child.join(5)
+    assert got_lock.is_set()
+
+
+def test_rewrite_subqueries_use_snapshot(engine_env, monkeypatch):
+    from langchain_core.language_models import FakeListChatModel
+
+    monkeypatch.setenv("RAG_INDEX_SNAPSHOT", "1")
+    monkeypatch.setenv("RAG_REWRITE_SKIP_THRESHOLD", "2")  # 总是改写
+    kb_dir, make_engine = engine_env
+    (kb_dir / "rules.md").write_text("# 规则\n简历成果要量化，使用 STAR 法则描述项目。", encoding="utf-8")
+    engine = make_engine()
+    assert engine.cache_stats()["snapshot"]["active"]
+
+    def no_chroma(*args, **kwargs):
+        raise AssertionError("启用快照时不应直接查询 Chroma")
+
+    monkeypatch.setattr(engine.vectorstore._collection, "query", no_chroma)
+    llm = FakeListChatModel(responses=["如何量化成果\nSTAR 法则是什么\n项目怎么写"] * 4)
+    for search_type in ("mmr", "similarity"):
+        docs = engine.retrieve("简历怎么写", k=2, search_type=search_type, llm=llm)
+        assert docs
+
+
+def test_async_version_sync_runs_off_the_event_loop(engine_env, monkeypatch):
+    import asyncio
+    import threading
+
+    monkeypatch.setenv("RAG_INDEX_SNAPSHOT", "1")
+    kb_dir, make_engine = engine_env
+    (kb_dir / "rules.md").write_text("# 规则\n简历成果要量化，使用 STAR 法则描述项目。", encoding="utf-8")
+    worker_a = make_engine()
+    worker_b = make_engine()
+    new_file = kb_dir / "extra.md"
+    new_file.write_text("# 新增\n在校期间获得国家奖学金，发表论文两篇。", encoding="utf-8")
+    worker_a.ingest_files([str(new_file)])
+
+    reload_threads = []
+    real_reload = worker_b._reload_manifest
+
+    def reload_manifest():
+        reload_threads.append(threading.get_ident())
+        real_reload()
+
+    worker_b._reload_manifest = reload_manifest
+
+    async def run():
+        context = await worker_b.aget_context("国家奖学金 论文", k=3, search_type="similarity")
+        return threading.get_ident(), context
+
+    loop_thread, context = asyncio.run(run())
+    assert worker_b.kb_version == worker_a.kb_version
+    assert "国家奖学金" in context
+    assert reload_threads and loop_thread not in reload_threads
@@ -0,0 +1,44 @@
+'''
+多 worker 共用会话持久层：上传文件与折叠的附件在一个进程注册，其他进程按 id 取回
+（两个 UploadStore / SessionMemoryManager 实例模拟两个 worker）
+'''
+
+import asyncio
+
+from src.Agent.session_memory import SessionMemoryManager, SQLiteSessionStore
+from src.Agent.upload_store import UploadStore
+
+from conftest import FakeEmbeddings
+
+
+def test_upload_registered_in_one_worker_is_found_in_another(tmp_path):
+    db_path = str(tmp_path / "sessions.sqlite3")
+    worker_a = UploadStore(FakeEmbeddings(), backend=SQLiteSessionStore(db_path))
+    worker_b = UploadStore(FakeEmbeddings(), backend=SQLiteSessionStore(db_path))
+    resume = "2018/05–2020/04 蓝色互动 后端工程师，负责订单服务重构，接口延迟降低 40%。" * 20
+
+    upload_id = asyncio.run(worker_a.aregister(resume, filename="resume.txt", file_hash="abc"))
+    assert len(worker_b) == 0
+    assert worker_b.find_by_file_hash("abc") == upload_id
+    assert worker_b.get_text(upload_id) == resume
+
+    docs = asyncio.run(worker_b.asearch(upload_id, "订单服务", k=2))
+    assert docs and "订单服务" in docs[0].page_content
+    assert worker_b.get("up-missing") is None
+
+
+def test_attachment_folded_in_one_worker_is_served_by_another(tmp_path):
+    db_path = str(tmp_path / "sessions.sqlite3")
+    worker_a = SessionMemoryManager(db_path=db_path, compact_threshold=50, shared=True)
+    worker_b = SessionMemoryManager(db_path=db_path, compact_threshold=50, shared=True)
+    file_text = "获得国家奖学金，发表论文两篇。" * 60
+    worker_a.add_to_memory("s1", "user", f"用户上传了文件，内容如下：\n{file_text}\n\n用户问题：润色", compact=False)
+    worker_a.add_to_memory("s1", "assistant", "好的", compact=False)
+
+    async def compact():
+        await worker_a.schedule_compaction("s1")
+
+    asyncio.run(compact())
+    (attachment_id,) = worker_a.get("s1").attachments
+    assert worker_b.get_attachment("s1", attachment_id) == file_text
+    assert worker_b.get_attachment("other-session", attachment_id) is None
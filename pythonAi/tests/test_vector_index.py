@@ -0,0 +1,37 @@
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.Agent.vector_index import NumpyVectorIndex
+
+
+def test_search_during_concurrent_appends():
+    index = NumpyVectorIndex()
+    rng = np.random.default_rng(0)
+    index.add_vectors([Document(page_content="0")], rng.random((1, 16)))
+    errors = []
+    stop = threading.Event()
+
+    def reader():
+        query = rng.random(16)
+        while not stop.is_set():
+            try:
+                index.similarity_search_by_vector(query, k=8)
+                index.max_marginal_relevance_search_by_vector(query, k=4, fetch_k=8)
+            except Exception as e:  # 行数与文档数不一致时会抛 IndexError
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for i in range(1, 1500):
+        index.add_vectors([Document(page_content=str(i))], rng.random((1, 16)))
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    assert not errors
+    matrix, documents = index._state
+    assert matrix.shape[0] == len(documents) == len(index) == 1500